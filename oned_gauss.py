@@ -0,0 +1,32 @@
+
+import numpy as np
+
+def oned_gauss(rule):
+    '''
+    #-----------------------------------------------------------------------#
+    #  oned_gauss.py - calculates Gauss-Legendre integration points on      #
+    #                  the reference interval [-1,1]                        #
+    #                                                                       #
+    #  Usage:    r, w = oned_gauss(rule)                                    #
+    #                                                                       #
+    #  Variables:     rule                                                  #
+    #                        Number of Gauss points (exact for polynomials  #
+    #                        of degree 2*rule-1)                            #
+    #                 r                                                     #
+    #                        Gauss points in [-1,1]                         #
+    #                 w                                                     #
+    #                        Gauss weights corresponding to r               #
+    #-----------------------------------------------------------------------#
+    '''
+    if rule < 1:
+        raise Exception('oned_gauss: rule must be a positive integer')
+    r, w = np.polynomial.legendre.leggauss(rule)
+    return r, w
+
+
+
+# Test oned_gauss
+rule = 7
+
+if __name__ == '__main__':
+    r, w = oned_gauss(rule)
@@ -0,0 +1,311 @@
+
+import numpy as np
+import scipy.sparse as sp
+from twod_shape_batch import twod_shape_batch
+from twod_bilinear import twod_element_matrices
+from twod_f_int import twod_f_int_batch
+from twod_assemble import twod_assemble_matrix, twod_assemble_vector, _eval_kernel
+from twod_solve import twod_solve
+from twod_profile import twod_timed
+
+def twod_label(x, e_conn):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_adapt.py - residual error estimation and newest vertex bisection   #
+    #                  for linear elements, with incremental reassembly        #
+    #                                                                          #
+    #  twod_label - rotates the vertices of every element so that the first    #
+    #               vertex (the "newest vertex") is opposite the longest edge. #
+    #               The edge opposite the newest vertex is the refinement      #
+    #               edge.  The orientation of the elements is unchanged        #
+    #                                                                          #
+    #  Usage:    e_conn = twod_label(x, e_conn)                                #
+    #--------------------------------------------------------------------------#
+    '''
+    _check_linear(e_conn)
+    d = x[np.roll(e_conn, -1, axis=1)] - x[np.roll(e_conn, 1, axis=1)]
+    k = np.argmax(d[...,0]**2 + d[...,1]**2, axis=1)
+    cols = (k[:,None] + np.arange(3)) % 3
+    return np.take_along_axis(e_conn, cols, axis=1)
+
+
+def twod_edges(e_conn):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_edges - unique edges of a linear mesh                              #
+    #                                                                          #
+    #  Usage:    edges, elem_edge, bnd = twod_edges(e_conn)                    #
+    #                                                                          #
+    #  Variables:     edges                                                    #
+    #                        end nodes of every edge, (n_edges, 2)             #
+    #                 elem_edge                                                #
+    #                        edge opposite each local vertex, (n_elem, 3)      #
+    #                 bnd                                                      #
+    #                        True for edges of only one element                #
+    #--------------------------------------------------------------------------#
+    '''
+    a = np.roll(e_conn, -1, axis=1).ravel()
+    b = np.roll(e_conn, 1, axis=1).ravel()
+    lo = np.minimum(a, b).astype(np.int64)
+    hi = np.maximum(a, b).astype(np.int64)
+    keys, first, inv, counts = np.unique(lo*(int(e_conn.max()) + 1) + hi,
+                                         return_index=True, return_inverse=True,
+                                         return_counts=True)
+    edges = np.column_stack((lo[first], hi[first]))
+    return edges, inv.reshape(e_conn.shape), counts == 1
+
+
+@twod_timed('adapt.estimate')
+def twod_estimate(x, e_conn, u, r, s, w, f=0.):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_estimate - residual error indicators of a linear finite element    #
+    #                  solution of -div(grad(u)) = f                           #
+    #                                                                          #
+    #     eta_K^2 = h_K^2 ||f||_K^2 + 1/2 sum_E h_E^2 |[grad(u)]_E|^2          #
+    #                                                                          #
+    #                  summed over the interior edges E of element K, where    #
+    #                  [grad(u)] is the jump of the (constant) element         #
+    #                  gradients p_x u, p_y u across E                         #
+    #                                                                          #
+    #  Usage:    eta = twod_estimate(x, e_conn, u, r, s, w, f)                 #
+    #                                                                          #
+    #  Variables:     f                                                        #
+    #                        source, constant or f(x,y)                        #
+    #                 eta                                                      #
+    #                        indicator per element, (n_elem,)                  #
+    #--------------------------------------------------------------------------#
+    '''
+    _check_linear(e_conn)
+    x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, e_conn, r, s, w)
+
+    # Element gradients, constant on linear elements
+    u_e = u[e_conn]
+    grad = np.column_stack((np.einsum('ei,ei->e', p_x[:,0,:], u_e),
+                            np.einsum('ei,ei->e', p_y[:,0,:], u_e)))
+
+    edges, elem_edge, bnd = twod_edges(e_conn)
+    d = x[edges[:,1]] - x[edges[:,0]]
+    h_E = np.sqrt(d[:,0]**2 + d[:,1]**2)
+    h_K = h_E[elem_edge].max(axis=1)
+
+    ff = _eval_kernel(f, x_g)*np.ones_like(w_g)
+    eta2 = h_K**2*np.sum(w_g*ff**2, axis=1)
+
+    # The two elements of every interior edge
+    inv   = elem_edge.ravel()
+    order = np.argsort(inv, kind='stable')
+    start = np.searchsorted(inv[order], np.flatnonzero(~bnd))
+    K_1, K_2 = order[start]//3, order[start+1]//3
+    jump2 = 0.5*h_E[~bnd]**2*np.sum((grad[K_1] - grad[K_2])**2, axis=1)
+    eta2 += np.bincount(K_1, jump2, minlength=eta2.size)
+    eta2 += np.bincount(K_2, jump2, minlength=eta2.size)
+    return np.sqrt(eta2)
+
+
+def twod_mark(eta, theta=0.5):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_mark - Doerfler marking: the fewest elements whose indicators      #
+    #              make up the fraction theta of sum(eta^2)                    #
+    #                                                                          #
+    #  Usage:    marked = twod_mark(eta, theta)                                #
+    #--------------------------------------------------------------------------#
+    '''
+    eta2  = eta**2
+    order = np.argsort(eta2)[::-1]
+    n = np.searchsorted(np.cumsum(eta2[order]), theta*eta2.sum()) + 1
+    return np.sort(order[:n])
+
+
+@twod_timed('adapt.refine')
+def twod_refine(x, e_conn, index_b, marked):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_refine - newest vertex bisection of the marked elements, plus the  #
+    #                elements needed to keep the mesh conforming               #
+    #                                                                          #
+    #  Usage:    x, e_conn, index_b, fresh = twod_refine(x, e_conn, index_b,   #
+    #                                                    marked)               #
+    #                                                                          #
+    #  Variables:     e_conn                                                   #
+    #                        linear elements labelled by twod_label (the       #
+    #                        output is labelled again)                         #
+    #                 marked                                                   #
+    #                        indices (or mask) of elements to refine           #
+    #                                                                          #
+    #                 fresh                                                    #
+    #                        True for new elements.  Elements with fresh False #
+    #                        are unchanged and keep their index, children      #
+    #                        take their parent's slot or are appended          #
+    #--------------------------------------------------------------------------#
+    '''
+    _check_linear(e_conn)
+    n_nodes = x.shape[0]
+    edges, elem_edge, bnd = twod_edges(e_conn)
+
+    # Cut the refinement edges of the marked elements, then of every element
+    # with a cut edge, until the mesh closes
+    cut = np.zeros(edges.shape[0], dtype=bool)
+    cut[elem_edge[marked, 0]] = True
+    while True:
+        need = cut[elem_edge].any(axis=1) & ~cut[elem_edge[:,0]]
+        if not need.any():
+            break
+        cut[elem_edge[need, 0]] = True
+
+    # Midpoint nodes
+    cut_edges = np.flatnonzero(cut)
+    mid = np.full(edges.shape[0], -1, dtype=np.int64)
+    mid[cut_edges] = n_nodes + np.arange(cut_edges.size)
+    x = np.vstack((x, 0.5*(x[edges[cut_edges,0]] + x[edges[cut_edges,1]])))
+    index_b = np.concatenate((index_b, mid[cut_edges[bnd[cut_edges]]])).astype(index_b.dtype)
+
+    # Bisect (m = midpoint of v1 v2):  (v0,v1,v2) -> (m,v0,v1), (m,v2,v0).
+    # The children's refinement edges v0 v1 and v2 v0 may be cut as well,
+    # their other edges never are
+    elem  = [e_conn.astype(np.int64)]
+    redge = [elem_edge.astype(np.int64)]
+    fresh = [np.zeros(e_conn.shape[0], dtype=bool)]
+    cur, ed, fr = elem[0].copy(), redge[0].copy(), fresh[0]
+    while True:
+        t = np.flatnonzero((ed[:,0] >= 0) & cut[np.maximum(ed[:,0], 0)])
+        if t.size == 0:
+            break
+        m = mid[ed[t,0]]
+        v0, v1, v2 = cur[t].T
+        none = np.full(t.size, -1)
+        child = np.column_stack((m, v2, v0))
+        child_ed = np.column_stack((ed[t,1], none, none))
+        cur[t] = np.column_stack((m, v0, v1))
+        ed[t]  = np.column_stack((ed[t,2], none, none))
+        fr[t]  = True
+        cur = np.vstack((cur, child))
+        ed  = np.vstack((ed, child_ed))
+        fr  = np.concatenate((fr, np.ones(t.size, dtype=bool)))
+
+    return x, cur.astype(e_conn.dtype), index_b, fr
+
+
+class TwodAdaptive:
+    '''
+    #--------------------------------------------------------------------------#
+    #  TwodAdaptive - adaptive solution of -div(kernel grad(u)) = f with       #
+    #                 linear elements.  Element matrices and vectors are kept  #
+    #                 and only those of new elements are computed after a      #
+    #                 refinement; the global system is patched by removing     #
+    #                 the parents' contributions and adding the children's     #
+    #                                                                          #
+    #  Usage:    ad  = TwodAdaptive(x, e_conn, index_b, r, s, w, kernel, f)    #
+    #            u   = ad.solve(g)                                             #
+    #            eta = ad.estimate(u)                                          #
+    #            ad.refine(twod_mark(eta, theta))                              #
+    #                                                                          #
+    #            ad.x, ad.e_conn, ad.index_b, ad.A, ad.F   current mesh and    #
+    #                                                      system              #
+    #--------------------------------------------------------------------------#
+    '''
+    def __init__(self, x, e_conn, index_b, r, s, w, kernel=None, f=0.):
+        self.rule   = (r, s, w)
+        self.kernel = kernel
+        self.f      = f
+        self.x       = x
+        self.e_conn  = twod_label(x, e_conn)
+        self.index_b = index_b
+        self.A_e, self.F_e = self._element_terms(self.e_conn)
+        n_nodes = x.shape[0]
+        self.A = twod_assemble_matrix(self.e_conn, self.A_e, n_nodes)
+        self.F = twod_assemble_vector(self.e_conn, self.F_e, n_nodes)
+
+    def solve(self, g=0., **kwargs):
+        return twod_solve(self.A, self.F, self.index_b, g, **kwargs)
+
+    def estimate(self, u):
+        return twod_estimate(self.x, self.e_conn, u, *self.rule, f=self.f)
+
+    def refine(self, marked):
+        e_old = self.e_conn
+        n_old = e_old.shape[0]
+        self.x, self.e_conn, self.index_b, fresh = twod_refine(
+            self.x, e_old, self.index_b, marked)
+        n_nodes = self.x.shape[0]
+
+        # Element terms: keep the unchanged ones, compute the new ones
+        parents = np.flatnonzero(fresh[:n_old])
+        A_e = np.empty((self.e_conn.shape[0],) + self.A_e.shape[1:])
+        F_e = np.empty((self.e_conn.shape[0],) + self.F_e.shape[1:])
+        A_e[:n_old] = self.A_e
+        F_e[:n_old] = self.F_e
+        A_new, F_new = self._element_terms(self.e_conn[fresh])
+        A_e[fresh] = A_new
+        F_e[fresh] = F_new
+
+        # Patch the global system
+        A = sp.csr_matrix(self.A)
+        A.resize((n_nodes, n_nodes))
+        self.A = (A - twod_assemble_matrix(e_old[parents], self.A_e[parents], n_nodes)
+                    + twod_assemble_matrix(self.e_conn[fresh], A_new, n_nodes)).tocsr()
+        self.F = (np.concatenate((self.F, np.zeros(n_nodes - self.F.size)))
+                  - twod_assemble_vector(e_old[parents], self.F_e[parents], n_nodes)
+                  + twod_assemble_vector(self.e_conn[fresh], F_new, n_nodes))
+        self.A_e, self.F_e = A_e, F_e
+        return fresh
+
+    def _element_terms(self, e_conn):
+        x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(self.x, e_conn, *self.rule)
+        A_e = twod_element_matrices('stiffness', _eval_kernel(self.kernel, x_g),
+                                    w_g, phi, p_x, p_y)
+        F_e = twod_f_int_batch(_eval_kernel(self.f, x_g)*np.ones_like(w_g), phi[0], w_g)
+        return A_e, F_e
+
+
+def _check_linear(e_conn):
+    if e_conn.shape[1] != 3:
+        raise Exception('twod_adapt: only linear elements are supported')
+
+
+
+# Test twod_adapt
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble, twod_assemble_load
+
+    # Sharp peak at (0.3, 0.3): u = exp(-a r^2), f = -Laplace(u)
+    a = 400.
+    u_ex = lambda x,y: np.exp(-a*((x-.3)**2 + (y-.3)**2))
+    f = lambda x,y: (4*a - 4*a**2*((x-.3)**2 + (y-.3)**2))*u_ex(x,y)
+    r, s, w = twod_gauss(7)
+
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'linear', 9, 9)
+    ad = TwodAdaptive(x, e_conn, index_b, r, s, w, f=f)
+    while ad.x.shape[0] < 4000:
+        g = u_ex(*ad.x[ad.index_b].T)
+        u = ad.solve(g)
+        ad.refine(twod_mark(ad.estimate(u), 0.5))
+
+        # Conforming, positively oriented, covering the square
+        x, e_conn = ad.x, ad.e_conn
+        edges, elem_edge, bnd = twod_edges(e_conn)
+        xb = x[edges[bnd]].reshape(-1, 2)
+        assert (np.isclose(xb, 0.) | np.isclose(xb, 1.)).any(axis=1).all()
+        x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, e_conn, r, s, w)
+        d1, d2 = x[e_conn[:,1]] - x[e_conn[:,0]], x[e_conn[:,2]] - x[e_conn[:,0]]
+        assert np.all(d1[:,0]*d2[:,1] - d1[:,1]*d2[:,0] > 0) and np.isclose(w_g.sum(), 1.)
+        assert np.array_equal(np.sort(ad.index_b),
+                              np.flatnonzero(np.isin(np.arange(x.shape[0]), edges[bnd])))
+
+    # Patched system equals a full reassembly
+    A = twod_assemble(x, e_conn, r, s, w)
+    F = twod_assemble_load(x, e_conn, r, s, w, f)
+    assert abs(ad.A - A).max() < 1e-10 and np.allclose(ad.F, F)
+
+    # Fewer nodes than a uniform mesh of the same accuracy
+    u = ad.solve(u_ex(*ad.x[ad.index_b].T))
+    err = np.abs(u - u_ex(*ad.x.T)).max()
+    x_u, e_u, b_u = twod_mesh(0, 1, 0, 1, 'linear', 129, 129)
+    A = twod_assemble(x_u, e_u, r, s, w)
+    F = twod_assemble_load(x_u, e_u, r, s, w, f)
+    u_u = twod_solve(A, F, b_u, u_ex(*x_u[b_u].T))
+    err_u = np.abs(u_u - u_ex(*x_u.T)).max()
+    assert ad.x.shape[0] < x_u.shape[0]/2 and err < err_u
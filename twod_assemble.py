@@ -0,0 +1,473 @@
+
+import inspect
+import numpy as np
+import scipy.sparse as sp
+from twod_shape_batch import twod_shape_batch
+from twod_shapeiso import twod_shapeiso_batch
+from twod_edge_shape_batch import twod_edge_shape_batch
+from twod_bilinear import twod_bilinear_batch, twod_element_matrices
+from twod_f_int import twod_f_int_batch
+from twod_gauss import twod_gauss_degree
+from twod_profile import twod_timer, twod_count
+
+# Polynomial degree of the basis by number of element nodes
+_ORDER = {3: 1, 6: 2, 7: 3, 10: 3}
+
+def twod_assemble(x, e_conn, r=None, s=None, w=None, form='stiffness', kernel=None, congruent=True,
+                  plan=None, out=None, iso=False):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_assemble.py - assembles the global sparse matrix of               #
+    #                     \int{ kernel*grad(phi).grad(test) }  (stiffness)     #
+    #                     \int{ kernel*phi*test }              (mass)          #
+    #                     \int{ (b.grad(phi))*test }           (advection)     #
+    #                                                                          #
+    #  Usage:    A = twod_assemble(x, e_conn, r, s, w, form, kernel)           #
+    #                                                                          #
+    #  Variables:     x                                                        #
+    #                        Node coordinates of the mesh (dim: n_nodes, 2)    #
+    #                 e_conn                                                   #
+    #                        Element connectivity (dim: n_elem, n_dof)         #
+    #                 (r,s), w                                                 #
+    #                        Gauss points and weights on the unit triangle,    #
+    #                        if None the cheapest rule exact for the form      #
+    #                        (see twod_rule)                                   #
+    #                 form                                                     #
+    #                        'stiffness', 'mass' or 'advection'                #
+    #                 kernel                                                   #
+    #                        None (=1), a constant, or a callable kernel(x,y)  #
+    #                        evaluated at the physical Gauss points x_g        #
+    #                        (for 'advection' the pair b = (b_x, b_y), or a    #
+    #                        callable returning it)                            #
+    #                 congruent                                                #
+    #                        if True and the kernel is constant, compute one   #
+    #                        element matrix per distinct element shape (see    #
+    #                        twod_congruent) and copy it to every element      #
+    #                 plan                                                     #
+    #                        (optional) AssemblyPlan of e_conn, reuses the     #
+    #                        precomputed CSR structure                         #
+    #                 out                                                      #
+    #                        (optional) matrix returned by an earlier call     #
+    #                        with the same plan, its data is refilled in place #
+    #                 iso                                                      #
+    #                        if True map elements isoparametrically (curved    #
+    #                        elements, see twod_shapeiso_batch)                #
+    #                                                                          #
+    #                 A                                                        #
+    #                        Global matrix in CSR format (n_nodes, n_nodes)    #
+    #--------------------------------------------------------------------------#
+    '''
+    r, s, w = twod_rule(r, s, w, form, e_conn.shape[1], kernel)
+    twod_count('assemble.elements', e_conn.shape[0])
+    elements, inv = e_conn, None
+    if congruent and not iso and _is_constant(kernel):
+        with twod_timer('assemble.congruent'):
+            rep, inv = twod_congruent(x, e_conn)
+        elements = e_conn[rep]
+
+    with twod_timer('assemble.shape'):
+        shape = twod_shapeiso_batch if iso else twod_shape_batch
+        x_g, w_g, phi, p_x, p_y, jac = shape(x, elements, r, s, w)
+    with twod_timer('assemble.element'):
+        A_e = twod_element_matrices(form, _eval_kernel(kernel, x_g), w_g, phi, p_x, p_y)
+    if inv is not None:
+        A_e = A_e[inv]
+
+    with twod_timer('assemble.scatter'):
+        if plan is not None:
+            return plan.assemble(A_e, out)
+        return twod_assemble_matrix(e_conn, A_e, x.shape[0])
+
+
+def twod_assemble_load(x, e_conn, r, s, w, f, congruent=True, iso=False):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_assemble_load - assembles the global load vector \int{ f*test }    #
+    #                                                                          #
+    #  Usage:    F = twod_assemble_load(x, e_conn, r, s, w, f)                 #
+    #                                                                          #
+    #  Variables:     r, s, w                                                  #
+    #                        as in twod_assemble, None picks a rule            #
+    #                 f                                                        #
+    #                        A constant or a callable f(x,y) evaluated at      #
+    #                        the physical Gauss points x_g, or a list of       #
+    #                        n_rhs of them                                     #
+    #                 iso                                                      #
+    #                        as in twod_assemble                               #
+    #                                                                          #
+    #                 F                                                        #
+    #                        Global load vector (dim: n_nodes), or a block     #
+    #                        (dim: n_nodes, n_rhs) if f is a list              #
+    #--------------------------------------------------------------------------#
+    '''
+    multi = isinstance(f, (list, tuple))
+    sources = list(f) if multi else [f]
+    varying = next((g for g in sources if not _is_constant(g)), None)
+    r, s, w = twod_rule(r, s, w, 'load', e_conn.shape[1], varying)
+
+    if congruent and not iso and all(_is_constant(g) for g in sources):
+        rep, inv = twod_congruent(x, e_conn)
+        elements = e_conn[rep]
+    else:
+        inv = None
+        elements = e_conn
+
+    twod_count('load.elements', e_conn.shape[0])
+    with twod_timer('load.shape'):
+        shape = twod_shapeiso_batch if iso else twod_shape_batch
+        x_g, w_g, phi, p_x, p_y, jac = shape(x, elements, r, s, w)
+    with twod_timer('load.element'):
+        Ff = np.empty(w_g.shape + (len(sources),), dtype=w_g.dtype)
+        for k, g in enumerate(sources):
+            Ff[...,k] = _eval_kernel(g, x_g)
+        F_e = twod_f_int_batch(Ff, phi[0], w_g)
+    if inv is not None:
+        F_e = F_e[inv]
+
+    with twod_timer('load.scatter'):
+        F = twod_assemble_vector(e_conn, F_e, x.shape[0])
+    return F if multi else F[:,0]
+
+
+def twod_assemble_neumann(x, e_bnd, r, w, g):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_assemble_neumann - assembles the boundary load vector              #
+    #                          \int_{edges}{ g*test } over all edges at once   #
+    #                                                                          #
+    #  Usage:    F = twod_assemble_neumann(x, e_bnd, r, w, g)                  #
+    #                                                                          #
+    #  Variables:     e_bnd                                                    #
+    #                        edge connectivity, e.g. from twod_mesh_edges      #
+    #                        (select sides with e_bnd[np.isin(e_tag, tags)])   #
+    #                 r, w                                                     #
+    #                        Gauss points and weights on [-1,1]                #
+    #                 g                                                        #
+    #                        A constant or a callable g(x,y) (may also take    #
+    #                        the outward normal as g(x,y,n_x,n_y))             #
+    #--------------------------------------------------------------------------#
+    '''
+    x_g, w_g, phi, normal = twod_edge_shape_batch(x, e_bnd, r, w)
+    F_e = twod_f_int_batch(_eval_edge(g, x_g, normal)*np.ones_like(w_g), phi[0], w_g)
+    return twod_assemble_vector(e_bnd, F_e, x.shape[0])
+
+
+def twod_assemble_robin(x, e_bnd, r, w, alpha=1.):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_assemble_robin - assembles the boundary matrix                     #
+    #                        \int_{edges}{ alpha*phi*test } over all edges     #
+    #                                                                          #
+    #  Usage:    R = twod_assemble_robin(x, e_bnd, r, w, alpha)                #
+    #                                                                          #
+    #  Variables:     alpha                                                    #
+    #                        A constant or a callable alpha(x,y)               #
+    #                                                                          #
+    #                 R                                                        #
+    #                        CSR matrix (n_nodes, n_nodes), add it to the      #
+    #                        stiffness matrix for u_n + alpha*u = g            #
+    #--------------------------------------------------------------------------#
+    '''
+    x_g, w_g, phi, normal = twod_edge_shape_batch(x, e_bnd, r, w)
+    R_e = twod_bilinear_batch(_eval_edge(alpha, x_g, normal), phi[0], phi[0], w_g)
+    return twod_assemble_matrix(e_bnd, R_e, x.shape[0])
+
+
+def twod_rule(r, s, w, form, n_dof, kernel=None):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_rule - (r, s, w) unchanged if given, else the cheapest rule        #
+    #              (twod_gauss_degree) exact for the form on elements of       #
+    #              degree k:  2k-2 stiffness, 2k mass, 2k-1 advection, k load, #
+    #              plus k if the kernel (or source) is not constant            #
+    #                                                                          #
+    #  Usage:    r, s, w = twod_rule(r, s, w, form, n_dof, kernel)             #
+    #--------------------------------------------------------------------------#
+    '''
+    if r is not None:
+        return r, s, w
+    if n_dof not in _ORDER:
+        raise Exception('twod_rule: {} node elements are not supported'.format(n_dof))
+    k = _ORDER[n_dof]
+    degree = {'stiffness': 2*k-2, 'mass': 2*k, 'advection': 2*k-1, 'load': k}
+    if form not in degree:
+        raise Exception('twod_rule: {} is not a valid form'.format(form))
+    return twod_gauss_degree(degree[form] + (0 if _is_constant(kernel) else k))
+
+
+def twod_congruent(x, e_conn, tol=None):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_congruent - groups straight-sided elements that are translates     #
+    #                   of each other, i.e. have the same Jacobian             #
+    #                   (xr, xs, yr, ys) of the (r,s) -> (x,y) map             #
+    #                                                                          #
+    #  Usage:    rep, inv = twod_congruent(x, e_conn, tol)                     #
+    #                                                                          #
+    #  Variables:     tol                                                      #
+    #                        Jacobians are compared after rounding to tol      #
+    #                        relative to the largest entry (default: 1e4       #
+    #                        machine epsilons of x's float type), but never    #
+    #                        finer than the rounding error of the coordinates  #
+    #                                                                          #
+    #                 rep                                                      #
+    #                        index of one representative element per group     #
+    #                 inv                                                      #
+    #                        group of every element, e_conn[rep[inv]] has      #
+    #                        the same element matrices as e_conn               #
+    #--------------------------------------------------------------------------#
+    '''
+    eps = np.finfo(np.result_type(x.dtype, np.float32)).eps
+    if tol is None:
+        tol = 1e4*eps
+    x_v = x[e_conn[:,:3],:]
+    J   = np.concatenate((x_v[:,1,:] - x_v[:,0,:], x_v[:,2,:] - x_v[:,0,:]), axis=1)
+    scale = np.abs(J).max()
+    res = max(scale*tol, 64*eps*np.abs(x_v).max())
+    key = np.round(J/res) if scale > 0 else J
+    _, rep, inv = np.unique(key, axis=0, return_index=True, return_inverse=True)
+    return rep, inv.ravel()
+
+
+def twod_assemble_coo(e_conn, A_e):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_assemble_coo - COO triplets of the stacked element matrices        #
+    #                                                                          #
+    #  Usage:    rows, cols, vals = twod_assemble_coo(e_conn, A_e)             #
+    #                                                                          #
+    #  Variables:     A_e                                                      #
+    #                        Element matrices (dim: n_elem, n_dof, n_dof)      #
+    #--------------------------------------------------------------------------#
+    '''
+    n_elem, n_dof = e_conn.shape
+    rows = np.broadcast_to(e_conn[:,:,None], (n_elem, n_dof, n_dof)).ravel()
+    cols = np.broadcast_to(e_conn[:,None,:], (n_elem, n_dof, n_dof)).ravel()
+    vals = A_e.reshape(-1)
+    return rows, cols, vals
+
+
+def twod_assemble_matrix(e_conn, A_e, n_nodes):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_assemble_matrix - sums stacked element matrices into a global      #
+    #                         CSR matrix                                       #
+    #                                                                          #
+    #  Usage:    A = twod_assemble_matrix(e_conn, A_e, n_nodes)                #
+    #--------------------------------------------------------------------------#
+    '''
+    rows, cols, vals = twod_assemble_coo(e_conn, A_e)
+    # Sum in double precision, also for float32 element matrices
+    A = sp.coo_matrix((vals.astype(np.float64, copy=False), (rows, cols)),
+                      shape=(n_nodes, n_nodes))
+    return A.tocsr()
+
+
+def twod_assemble_vector(e_conn, F_e, n_nodes):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_assemble_vector - sums stacked element vectors into a global       #
+    #                         vector                                           #
+    #                                                                          #
+    #  Usage:    F = twod_assemble_vector(e_conn, F_e, n_nodes)                #
+    #                                                                          #
+    #  Variables:     F_e                                                      #
+    #                        Element vectors (dim: n_elem, n_dof), or blocks   #
+    #                        of n_rhs vectors (dim: n_elem, n_dof, n_rhs)      #
+    #--------------------------------------------------------------------------#
+    '''
+    if F_e.ndim == 2:
+        return np.bincount(e_conn.ravel(), weights=F_e.ravel(), minlength=n_nodes)
+
+    # One sparse (n_nodes, n_elem*n_dof) scatter applied to all columns
+    n_entries = e_conn.size
+    S = sp.csr_matrix((np.ones(n_entries), (e_conn.ravel(), np.arange(n_entries))),
+                      shape=(n_nodes, n_entries))
+    return S @ F_e.reshape(n_entries, -1)
+
+
+class AssemblyPlan:
+    '''
+    #--------------------------------------------------------------------------#
+    #  AssemblyPlan - precomputed CSR structure of a mesh and the map from     #
+    #                 every element matrix entry to its CSR nonzero, so that   #
+    #                 repeated assemblies on a fixed mesh only sum values      #
+    #                                                                          #
+    #  Usage:    plan = AssemblyPlan(e_conn, n_nodes)                          #
+    #            A    = plan.assemble(A_e)          new CSR matrix             #
+    #            A    = plan.assemble(A_e, out=A)   refill A.data in place     #
+    #                                                                          #
+    #  Variables:     e_conn                                                   #
+    #                        Element connectivity (dim: n_elem, n_dof)         #
+    #                 n_nodes                                                  #
+    #                        Number of global nodes                            #
+    #                                                                          #
+    #                 indptr, indices                                          #
+    #                        CSR structure shared by all assembled matrices    #
+    #                 scatter                                                  #
+    #                        position in data of every element matrix entry    #
+    #                        (dim: n_elem, n_dof, n_dof)                       #
+    #--------------------------------------------------------------------------#
+    '''
+    def __init__(self, e_conn, n_nodes):
+        n_elem, n_dof = e_conn.shape
+        e_conn = e_conn.astype(np.int64, copy=False)
+        key = (e_conn[:,:,None]*n_nodes + e_conn[:,None,:]).ravel()
+        key, inv = np.unique(key, return_inverse=True)
+
+        index_dtype  = np.int32 if max(len(key), n_nodes) < 2**31 else np.int64
+        self.shape   = (n_nodes, n_nodes)
+        self.nnz     = len(key)
+        self.indices = (key % n_nodes).astype(index_dtype)
+        self.indptr  = np.zeros(n_nodes+1, dtype=index_dtype)
+        np.cumsum(np.bincount(key // n_nodes, minlength=n_nodes), out=self.indptr[1:])
+        self.scatter = inv.astype(index_dtype).reshape(n_elem, n_dof, n_dof)
+
+    @classmethod
+    def from_arrays(cls, indptr, indices, scatter):
+        '''
+        Plan from stored indptr, indices and scatter arrays (e.g. memmaps
+        written by TwodStore.plan), without recomputing them.
+        '''
+        plan = cls.__new__(cls)
+        n_nodes = len(indptr) - 1
+        plan.shape   = (n_nodes, n_nodes)
+        plan.nnz     = len(indices)
+        plan.indices = indices
+        plan.indptr  = indptr
+        plan.scatter = scatter
+        return plan
+
+    def matrix(self, data=None):
+        '''
+        CSR matrix with the plan's structure and the given (or zero) data.
+        '''
+        if data is None:
+            data = np.zeros(self.nnz)
+        A = sp.csr_matrix((data, self.indices, self.indptr), shape=self.shape, copy=False)
+        A.has_sorted_indices = True
+        return A
+
+    def assemble(self, A_e, out=None):
+        '''
+        Sums the element matrices A_e into a CSR matrix, or into out.data.
+        '''
+        data = self.add(None, A_e)
+        if out is None:
+            return self.matrix(data)
+        out.data[:] = data
+        return out
+
+    def add(self, data, A_e, start=0):
+        '''
+        Adds the element matrices of elements start, start+1, ... to data
+        (a new array if data is None) and returns it.
+        '''
+        scatter = self.scatter[start:start+A_e.shape[0]]
+        part = np.bincount(scatter.ravel(), weights=A_e.ravel(), minlength=self.nnz)
+        if data is None:
+            return part
+        data += part
+        return data
+
+
+def _eval_kernel(kernel, x_g):
+    '''
+    Kernel values at the physical Gauss points (broadcastable to x_g[...,0]).
+    '''
+    if kernel is None:
+        return 1.
+    if callable(kernel):
+        return kernel(x_g[...,0], x_g[...,1])
+    return kernel
+
+
+def _eval_edge(g, x_g, normal):
+    '''
+    Boundary data at the edge Gauss points, g(x,y) or g(x,y,n_x,n_y).
+    '''
+    if callable(g):
+        if len(inspect.signature(g).parameters) >= 4:
+            return g(x_g[...,0], x_g[...,1], normal[:,None,0], normal[:,None,1])
+        return g(x_g[...,0], x_g[...,1])
+    return g
+
+
+def _is_constant(kernel):
+    '''
+    True if the kernel (or each component of a kernel pair) is a constant.
+    '''
+    if kernel is None:
+        return True
+    if callable(kernel):
+        return False
+    if isinstance(kernel, (tuple, list)):
+        return all(np.ndim(k) == 0 for k in kernel)
+    return np.ndim(kernel) == 0
+
+
+
+# Test twod_assemble
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'quadratic', 9, 9)
+    r, s, w = twod_gauss(7)
+
+    q = lambda x,y: 1 + x*y
+    A = twod_assemble(x, e_conn, r, s, w, 'stiffness', q)
+    M = twod_assemble(x, e_conn, r, s, w, 'mass')
+    F = twod_assemble_load(x, e_conn, r, s, w, lambda x,y: x+y)
+
+    # Stiffness annihilates constants, mass and load integrate over the domain
+    assert np.allclose(A @ np.ones(x.shape[0]), 0.)
+    assert np.isclose(M.sum(), 1.) and np.isclose(F.sum(), 1.)
+
+    # Without a rule the cheapest exact one is picked
+    assert np.allclose((twod_assemble(x, e_conn, form='mass') - M).toarray(), 0.)
+    assert np.allclose((twod_assemble(x, e_conn, kernel=q) - A).toarray(), 0.)
+    assert np.allclose(twod_assemble_load(x, e_conn, None, None, None, lambda x,y: x+y), F)
+
+    # Several sources at once give one column each
+    F_k = twod_assemble_load(x, e_conn, r, s, w, [lambda x,y: x+y, 2., None])
+    assert F_k.shape == (x.shape[0], 3) and np.allclose(F_k[:,0], F)
+    assert np.allclose(F_k[:,1], 2*F_k[:,2])
+
+    # The automatic rule follows any varying source, not just the first
+    f = lambda x,y: np.exp(3*x)*np.sin(4*y)
+    F_f = twod_assemble_load(x, e_conn, None, None, None, [f, 1.])
+    assert np.allclose(twod_assemble_load(x, e_conn, None, None, None, [1., f]), F_f[:,::-1])
+
+    # Advection with b = (1, 0) applied to u = x gives \int{ test }
+    B = twod_assemble(x, e_conn, r, s, w, 'advection', (1., 0.))
+    assert np.allclose(B @ x[:,0], twod_assemble_load(x, e_conn, r, s, w, 1.))
+
+    # A uniform grid has two distinct element shapes
+    rep, inv = twod_congruent(x, e_conn)
+    assert len(rep) == 2
+
+    # also in float32 (mixed precision meshes)
+    from twod_precision import twod_cast
+    x_32, e_32, _ = twod_cast(*twod_mesh(0, 1, 0, 1, 'linear', 201, 201))
+    assert len(twod_congruent(x_32, e_32)[0]) == 2
+    A1 = twod_assemble(x, e_conn, r, s, w, 'stiffness', 2., congruent=True)
+    A2 = twod_assemble(x, e_conn, r, s, w, 'stiffness', 2., congruent=False)
+    assert np.allclose((A1 - A2).toarray(), 0.)
+
+    # Reassembly on a fixed mesh only refills the data array
+    plan = AssemblyPlan(e_conn, x.shape[0])
+    A3 = twod_assemble(x, e_conn, r, s, w, 'stiffness', q, plan=plan)
+    A4 = twod_assemble(x, e_conn, r, s, w, 'stiffness', lambda x,y: 2*q(x,y), plan=plan, out=A3)
+    assert A4 is A3 and np.allclose((A4 - 2*A).toarray(), 0.)
+
+    # Boundary terms: \int{ u_n } = 0 for u = x^2 - y^2, and the Robin mass of 1
+    # is the perimeter
+    from oned_gauss import oned_gauss
+    from twod_mesh import twod_mesh_edges
+    e_bnd, e_tag = twod_mesh_edges('quadratic', 9, 9)
+    r_1, w_1 = oned_gauss(3)
+    G = twod_assemble_neumann(x, e_bnd, r_1, w_1, lambda x,y,n_x,n_y: 2*x*n_x - 2*y*n_y)
+    R = twod_assemble_robin(x, e_bnd, r_1, w_1)
+    assert np.isclose(G.sum(), 0.) and np.isclose(R.sum(), 4.)
+    assert np.isclose(twod_assemble_neumann(x, e_bnd[e_tag == 1], r_1, w_1, 1.).sum(), 1.)
@@ -0,0 +1,350 @@
+
+import json
+import time
+import platform
+import tracemalloc
+import numpy as np
+from twod_mesh import twod_mesh, twod_mesh_edges
+from twod_gauss import twod_gauss, twod_gauss_degree, _tabulated, _conical
+from twod_shape import twod_shape
+from twod_shape_batch import twod_shape_batch
+from twod_edge_shape_batch import twod_edge_shape_batch
+from twod_bilinear import twod_bilinear, twod_element_matrices
+from twod_f_int import twod_f_int, twod_f_int_batch
+from twod_assemble import twod_assemble, twod_assemble_load, AssemblyPlan
+from twod_solve import twod_solve
+from twod_profile import TwodProfile
+from oned_gauss import oned_gauss
+
+# Polynomial order by element type, and the number of elements the
+# per-element stages ('shape_loop', ...) are timed on
+_ORDER  = {'linear': 1, 'quadratic': 2, 'cubic': 3}
+_N_LOOP = 500
+
+TWOD_BENCH_STAGES = ['mesh', 'gauss', 'shape', 'shape_loop', 'bilinear', 'bilinear_loop',
+                     'f_int', 'f_int_loop', 'edge_shape', 'scatter', 'pipeline']
+
+def twod_bench(etypes=('linear', 'quadratic', 'cubic'), sizes=(16, 32, 64), rules=(7,),
+               stages=None, repeat=3, memory=True):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_bench.py - times the stages of the finite element pipeline over    #
+    #                  a sweep of mesh sizes, element types and quadrature     #
+    #                  rules on the unit square                                #
+    #                                                                          #
+    #  Usage:    results = twod_bench(etypes, sizes, rules, stages, repeat)    #
+    #            twod_bench_save(results, 'bench.json')                        #
+    #            twod_bench_plot(results, 'bench.png')                         #
+    #            slower  = twod_bench_compare(old, results, tol)               #
+    #                                                                          #
+    #  Variables:     etypes                                                   #
+    #                        'linear', 'quadratic' and/or 'cubic'              #
+    #                 sizes                                                    #
+    #                        element sides per mesh side                       #
+    #                 rules                                                    #
+    #                        twod_gauss rules (number of points)               #
+    #                 stages                                                   #
+    #                        subset of TWOD_BENCH_STAGES (default: all)        #
+    #                          mesh        twod_mesh                           #
+    #                          gauss       builds twod_gauss(rule) and         #
+    #                                      twod_gauss_degree(8) (n_items = 2   #
+    #                                      rules, so elements_per_s are        #
+    #                                      rules/s)                            #
+    #                          shape       twod_shape_batch                    #
+    #                          bilinear    stiffness + mass element matrices   #
+    #                          f_int       load element vectors                #
+    #                          edge_shape  twod_edge_shape_batch, boundary     #
+    #                          scatter     AssemblyPlan.assemble               #
+    #                          pipeline    mesh, assembly, load and solve,     #
+    #                                      with per-stage TwodProfile timings  #
+    #                        the *_loop stages time the per-element routines   #
+    #                        twod_shape, twod_bilinear and twod_f_int on the   #
+    #                        first 500 elements                                #
+    #                 repeat                                                   #
+    #                        runs per case, the fastest one is reported        #
+    #                 memory                                                   #
+    #                        if True measure the peak allocation of one extra  #
+    #                        run with tracemalloc                              #
+    #                                                                          #
+    #                 results                                                  #
+    #                        list of records with keys stage, etype, rule,     #
+    #                        n_elem, n_dof, n_items (elements or edges         #
+    #                        processed), time [s], elements_per_s,             #
+    #                        dofs_per_s, peak_mb (and profile for pipeline)    #
+    #--------------------------------------------------------------------------#
+    '''
+    stages = TWOD_BENCH_STAGES if stages is None else list(stages)
+    for stage in stages:
+        if stage not in TWOD_BENCH_STAGES:
+            raise Exception('twod_bench: {} is not a valid stage'.format(stage))
+
+    results = []
+    for etype in etypes:
+        for size in sizes:
+            n = _ORDER[etype]*size + 1
+            x, e_conn, index_b = twod_mesh(0, 1, 0, 1, etype, n, n)
+            for rule in rules:
+                case = _Case(etype, n, rule, x, e_conn, index_b)
+                for stage in stages:
+                    func, n_items = getattr(case, stage)()
+                    t, profile = _time(func, repeat)
+                    rec = {'stage': stage, 'etype': etype, 'rule': rule,
+                           'n_elem': e_conn.shape[0], 'n_dof': x.shape[0],
+                           'n_items': n_items, 'time': t,
+                           'elements_per_s': n_items/t,
+                           'dofs_per_s': x.shape[0]*n_items/e_conn.shape[0]/t,
+                           'peak_mb': _peak(func) if memory else None}
+                    if stage == 'pipeline':
+                        rec['profile'] = profile.as_dict()
+                    results.append(rec)
+    return results
+
+
+class _Case:
+    # Inputs of every stage on one mesh, each method returns the function to
+    # time and the number of elements (or edges) it processes
+    def __init__(self, etype, n, rule, x, e_conn, index_b):
+        self.etype, self.n, self.rule = etype, n, rule
+        self.x, self.e_conn, self.index_b = x, e_conn, index_b
+        self.r, self.s, self.w = twod_gauss(rule)
+        x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, e_conn, self.r, self.s, self.w)
+        self.batch = (w_g, phi, p_x, p_y)
+        self.Ff = np.sin(x_g[...,0])*x_g[...,1]
+
+    def mesh(self):
+        n = self.n
+        return lambda: twod_mesh(0, 1, 0, 1, self.etype, n, n), self.e_conn.shape[0]
+
+    def gauss(self):
+        # Rule construction: the caches are cleared so every run builds the
+        # tabulated rule and a conical one
+        rule = self.rule
+        def run():
+            _tabulated.cache_clear()
+            _conical.cache_clear()
+            return twod_gauss(rule), twod_gauss_degree(8)
+        return run, 2
+
+    def shape(self):
+        x, e_conn, r, s, w = self.x, self.e_conn, self.r, self.s, self.w
+        return lambda: twod_shape_batch(x, e_conn, r, s, w), e_conn.shape[0]
+
+    def shape_loop(self):
+        x, r, s, w = self.x, self.r, self.s, self.w
+        e_conn = self.e_conn[:_N_LOOP]
+        def run():
+            for conn in e_conn:
+                twod_shape(x[conn,:], r, s, w)
+        return run, e_conn.shape[0]
+
+    def bilinear(self):
+        w_g, phi, p_x, p_y = self.batch
+        def run():
+            twod_element_matrices('stiffness', 1., w_g, phi, p_x, p_y)
+            twod_element_matrices('mass', 1., w_g, phi, p_x, p_y)
+        return run, w_g.shape[0]
+
+    def bilinear_loop(self):
+        w_g, phi, p_x, p_y = [a[:_N_LOOP] for a in self.batch]
+        def run():
+            for k in range(w_g.shape[0]):
+                twod_bilinear(1., p_x[k], p_x[k], w_g[k]) + twod_bilinear(1., p_y[k], p_y[k], w_g[k])
+                twod_bilinear(1., phi[k], phi[k], w_g[k])
+        return run, w_g.shape[0]
+
+    def f_int(self):
+        w_g, phi = self.batch[:2]
+        Ff = self.Ff
+        return lambda: twod_f_int_batch(Ff, phi[0], w_g), w_g.shape[0]
+
+    def f_int_loop(self):
+        w_g, phi = [a[:_N_LOOP] for a in self.batch[:2]]
+        Ff = self.Ff[:_N_LOOP]
+        def run():
+            for k in range(w_g.shape[0]):
+                twod_f_int(Ff[k], phi[k], w_g[k])
+        return run, w_g.shape[0]
+
+    def edge_shape(self):
+        x = self.x
+        e_bnd, e_tag = twod_mesh_edges(self.etype, self.n, self.n)
+        r, w = oned_gauss(int(np.ceil((self.rule + 1)/2)))
+        return lambda: twod_edge_shape_batch(x, e_bnd, r, w), e_bnd.shape[0]
+
+    def scatter(self):
+        e_conn, n_nodes = self.e_conn, self.x.shape[0]
+        plan = AssemblyPlan(e_conn, n_nodes)
+        w_g, phi, p_x, p_y = self.batch
+        A_e = twod_element_matrices('stiffness', 1., w_g, phi, p_x, p_y)
+        A = plan.assemble(A_e)
+        return lambda: plan.assemble(A_e, out=A), e_conn.shape[0]
+
+    def pipeline(self):
+        etype, n, r, s, w = self.etype, self.n, self.r, self.s, self.w
+        f = lambda x,y: np.sin(np.pi*x)*y
+        def run():
+            x, e_conn, index_b = twod_mesh(0, 1, 0, 1, etype, n, n)
+            A = twod_assemble(x, e_conn, r, s, w, 'stiffness', lambda x,y: 1 + x*y)
+            F = twod_assemble_load(x, e_conn, r, s, w, f)
+            return twod_solve(A, F, index_b)
+        return run, self.e_conn.shape[0]
+
+
+def _time(func, repeat):
+    # Fastest of repeat runs, the pipeline runs record a profile
+    best, best_profile = np.inf, None
+    for k in range(repeat):
+        with TwodProfile() as profile:
+            t0 = time.perf_counter()
+            func()
+            t = time.perf_counter() - t0
+        if t < best:
+            best, best_profile = t, profile
+    return best, best_profile
+
+
+def _peak(func):
+    # Peak memory allocated during func (numpy reports to tracemalloc) in MB
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    if not was_tracing:
+        tracemalloc.stop()
+    return peak/2**20
+
+
+def twod_bench_save(results, fname):
+    '''
+    Writes the benchmark results and the machine they ran on to a JSON file.
+    '''
+    doc = {'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                       'platform': platform.platform(), 'processor': platform.processor()},
+           'results': results}
+    with open(fname, 'w') as fid:
+        json.dump(doc, fid, indent=1)
+
+
+def twod_bench_load(fname):
+    '''
+    Reads the results written by twod_bench_save.
+    '''
+    with open(fname) as fid:
+        return json.load(fid)['results']
+
+
+def twod_bench_compare(base, results, tol=0.2):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_bench_compare - cases of results more than a factor 1+tol slower   #
+    #                       than the same case (stage, etype, rule, n_elem)    #
+    #                       in base                                            #
+    #                                                                          #
+    #  Usage:    slower = twod_bench_compare(base, results, tol)               #
+    #                                                                          #
+    #  Variables:     slower                                                   #
+    #                        list of (stage, etype, rule, n_elem, ratio) with  #
+    #                        ratio = time/base time, worst first               #
+    #--------------------------------------------------------------------------#
+    '''
+    key = lambda rec: (rec['stage'], rec['etype'], rec['rule'], rec['n_elem'])
+    old = {key(rec): rec['time'] for rec in base}
+    slower = []
+    for rec in results:
+        t = old.get(key(rec))
+        if t is not None and rec['time'] > (1 + tol)*t:
+            slower.append(key(rec) + (rec['time']/t,))
+    return sorted(slower, key=lambda item: -item[-1])
+
+
+def twod_bench_plot(results, fname, rule=None):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_bench_plot - scaling plots: time and elements/s against the        #
+    #                    number of elements, one line per stage and element    #
+    #                    type, written headless (Agg) to fname                 #
+    #                                                                          #
+    #  Usage:    twod_bench_plot(results, fname, rule)                         #
+    #                                                                          #
+    #  Variables:     rule                                                     #
+    #                        quadrature rule to plot (default: the first one)  #
+    #--------------------------------------------------------------------------#
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    if rule is None:
+        rule = results[0]['rule']
+    fig = Figure(figsize=(12, 5))
+    FigureCanvasAgg(fig)
+    ax_t, ax_r = fig.subplots(1, 2)
+
+    cases = {}
+    for rec in results:
+        if rec['rule'] == rule:
+            cases.setdefault((rec['stage'], rec['etype']), []).append(rec)
+    for (stage, etype), recs in sorted(cases.items()):
+        recs = sorted(recs, key=lambda rec: rec['n_elem'])
+        n_elem = [rec['n_elem'] for rec in recs]
+        label = '{} ({})'.format(stage, etype)
+        ax_t.loglog(n_elem, [rec['time'] for rec in recs], '.-', label=label)
+        ax_r.semilogx(n_elem, [rec['elements_per_s'] for rec in recs], '.-', label=label)
+
+    ax_t.set_xlabel('elements');  ax_t.set_ylabel('time [s]')
+    ax_r.set_xlabel('elements');  ax_r.set_ylabel('elements/s');  ax_r.set_yscale('log')
+    ax_t.set_title('rule {}'.format(rule))
+    ax_r.legend(fontsize='x-small', ncol=2)
+    fig.tight_layout()
+    fig.savefig(fname)
+
+
+
+# Test twod_bench
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    results = twod_bench(etypes=('linear', 'cubic'), sizes=(8, 16), rules=(3, 7), repeat=2)
+    assert len(results) == 2*2*2*len(TWOD_BENCH_STAGES)
+    for rec in results:
+        assert rec['time'] > 0 and rec['elements_per_s'] > 0 and rec['peak_mb'] >= 0
+        assert rec['n_items'] <= rec['n_elem'] or rec['stage'] == 'edge_shape'
+        assert rec['stage'] != 'gauss' or rec['n_items'] == 2
+
+    # Every case is timed once per stage (timings themselves are not
+    # asserted), and the pipeline profile has the assembly and solve stages
+    cases = {(rec['stage'], rec['etype'], rec['rule'], rec['n_elem']) for rec in results}
+    assert len(cases) == len(results)
+    for rec in results:
+        if rec['stage'].endswith('_loop'):
+            assert rec['n_items'] == min(rec['n_elem'], _N_LOOP)
+    pipe = [rec for rec in results if rec['stage'] == 'pipeline']
+    for rec in pipe:
+        timers = rec['profile']['timers']
+        assert {'mesh', 'assemble.shape', 'assemble.element', 'assemble.scatter',
+                'load.element', 'solve.setup', 'solve.solve'} <= set(timers)
+        assert rec['profile']['counters']['assemble.elements'] == rec['n_elem']
+
+    # Memory grows with the mesh (allocation sizes are deterministic)
+    peak = {(rec['stage'], rec['etype'], rec['rule'], rec['n_elem']): rec['peak_mb']
+            for rec in results}
+    assert peak[('shape', 'cubic', 7, 512)] > 2*peak[('shape', 'cubic', 7, 128)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, 'bench.json')
+        twod_bench_save(results, fname)
+        base = twod_bench_load(fname)
+        assert base == json.loads(json.dumps(results))
+        assert twod_bench_compare(base, results) == []
+
+        # An artificial 2x slowdown of one case is flagged
+        slow = [dict(rec) for rec in results]
+        slow[0]['time'] *= 2
+        slower = twod_bench_compare(base, slow)
+        assert len(slower) == 1 and np.isclose(slower[0][-1], 2.)
+
+        twod_bench_plot(results, os.path.join(tmp, 'bench.png'))
+        assert os.path.getsize(os.path.join(tmp, 'bench.png')) > 0
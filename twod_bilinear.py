@@ -33,22 +33,96 @@ def twod_bilinear( kernel, phi, test, w_g ):
     #       M[i,j] = np.dot(( w_g.T    * test[:,i]' ),( kernel * phi[:,j] )) #
     #--------------------------------------------------------------------------#
     '''                                                        
-    M = np.dot( np.dot(test.T, np.diag( w_g*kernel )), phi)
+    M = np.dot( test.T*( w_g*kernel ), phi)
     return M
 
 
+def twod_bilinear_batch( kernel, phi, test, w_g ):
+
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_bilinear_batch - computes \int{ kernel*phi*test } on every element #
+    #                        at once                                           #
+    #                                                                          #
+    #  Usage:    M = twod_bilinear_batch(kernel, phi, test, w_g)               #
+    #                                                                          #
+    #  Variables:     kernel                                                   #
+    #                        Kernel evaluated at the Gauss points, a constant  #
+    #                        or an array broadcastable to w_g                  #
+    #                                                                          #
+    #                 phi                                                      #
+    #                 test                                                     #
+    #                        stacked trial/test functions at the Gauss points  #
+    #                        (dim: n_elem, n_gauss, n_dof), or a reference     #
+    #                        table (dim: n_gauss, n_dof) shared by all         #
+    #                        elements                                          #
+    #                                                                          #
+    #                 w_g                                                      #
+    #                        Gauss weights of every element                    #
+    #                        (dim: n_elem, n_gauss)                            #
+    #                                                                          #
+    #                 M                                                        #
+    #                        Element matrices (dim: n_elem, n_row, n_col)      #
+    #--------------------------------------------------------------------------#
+    '''
+    wk = w_g*kernel
+    if phi.ndim == 2 and test.ndim == 2:
+        # Shared tables: one (n_elem, n_gauss) x (n_gauss, n_row*n_col) product
+        n_gauss, n_row = test.shape
+        tp = (test[:,:,None]*phi[:,None,:]).reshape(n_gauss, -1)
+        return np.dot(wk, tp).reshape(wk.shape[0], n_row, -1)
+    return np.matmul(np.swapaxes(test*wk[...,None], -1, -2), phi)
 
-# Test twod_bilinear 
-x_local = x[e_conn[0,:],:]                   # The first element nodes
-#
-# x and e_conn are from 
-#
-# x, e_conn, _ = twod_mesh(x_l,x_r,y_l,y_r,etype,n_nodesx,n_nodesy, *args)
 
-q = lambda x,y:x+y
-x_g,w_g,phi,p_x,p_y = twod_shape(x_local, r, s, w)
-kernel = q(r,s)
-test = phi                                   # For Galerkin method
+def twod_element_matrices( form, kernel, w_g, phi, p_x, p_y ):
 
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_element_matrices - stacked element matrices of a standard form     #
+    #                                                                          #
+    #  Usage:    M = twod_element_matrices(form, kernel, w_g, phi, p_x, p_y)   #
+    #                                                                          #
+    #  Variables:     form                                                     #
+    #                        'stiffness'  \int{ kernel*grad(phi).grad(test) }  #
+    #                        'mass'       \int{ kernel*phi*test }              #
+    #                        'advection'  \int{ (b.grad(phi))*test },          #
+    #                                     kernel = (b_x, b_y)                  #
+    #                                                                          #
+    #                 w_g, phi, p_x, p_y                                       #
+    #                        as returned by twod_shape_batch                   #
+    #--------------------------------------------------------------------------#
+    '''
+    if phi.ndim == 3 and phi.strides[0] == 0:
+        phi = phi[0]                         # broadcast reference table
+    if form == 'stiffness':
+        M  = twod_bilinear_batch(kernel, p_x, p_x, w_g)
+        M += twod_bilinear_batch(kernel, p_y, p_y, w_g)
+    elif form == 'mass':
+        M  = twod_bilinear_batch(kernel, phi, phi, w_g)
+    elif form == 'advection':
+        b_x, b_y = [np.asarray(b) for b in kernel]
+        b_x = b_x[...,None] if b_x.ndim == 2 else b_x
+        b_y = b_y[...,None] if b_y.ndim == 2 else b_y
+        M  = twod_bilinear_batch(1., b_x*p_x + b_y*p_y, phi, w_g)
+    else:
+        raise Exception('twod_element_matrices: {} is not a valid form'.format(form))
+    return M
+
+
+
+# Test twod_bilinear 
 if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_shape import twod_shape
+
+    x, e_conn, _ = twod_mesh(0, 1, 0, 1, 'quadratic', 5, 3)
+    r, s, w = twod_gauss(7)
+    x_local = x[e_conn[0,:],:]               # The first element nodes
+
+    q = lambda x,y:x+y
+    x_g,w_g,phi,p_x,p_y = twod_shape(x_local, r, s, w)
+    kernel = q(r,s)
+    test = phi                               # For Galerkin method
+
     M = twod_bilinear( kernel, phi, test, w_g )
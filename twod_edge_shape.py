@@ -1,6 +1,6 @@
 
 import numpy as np
-from oned_gauss import oned_gauss 
+from twod_ref_basis import twod_ref_edge_basis
 
 def twod_edge_shape(x_local,r,w):
     '''
@@ -49,37 +49,21 @@ def twod_edge_shape(x_local,r,w):
     # Gauss weights
     w_g = 0.5*w*np.sqrt((x2-x1)**2 + (y2-y1)**2)
 
-    if n == 2:
-        # Linear element
-        phi = np.zeros((rule, n))
-        phi[:,0] = (1 - r)/2
-        phi[:,1] = (1 + r)/2
-       
-    elif n == 3:
-        # Quadratic element    
-        phi = np.zeros((rule, n)) 
-        phi[:,0] = 0.5*r*(r-1)
-        phi[:,1] = 0.5*r*(r+1)
-        phi[:,2] = -(r+1)*(r-1)
-    
-    elif n == 4:
-        # Cubic element
-        phi = np.zeros((rule,n))
-        phi[:,0] = -9/2*(r-1/3)*(r-2/3)*(r-1)
-        phi[:,1] =   9/2*r*(r-1/3)*(r-2/3)
-        phi[:,2] =  27/2*r*(r-2/3)*(r-1)
-        phi[:,3] = -27/2*r*(r-1/3)*(r-1)
+    # Shape functions come from the cached reference table
+    phi = twod_ref_edge_basis(n, r, w).phi
 
-    else:
-        raise Exception('Only linear, quadratic, and cubic elements are supported')
     return x_g, w_g, phi
 
 #
 # Test twod_edge_shape
 #
-n_dof = 2                                        # n_dof for quadratic element is 3
-x_local = x[index_b[:n_dof],:]                   # The first boundary element nodes
-r, w = oned_gauss(7)
-
 if __name__ == '__main__':
+    from oned_gauss import oned_gauss
+    from twod_mesh import twod_mesh
+
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'linear', 5, 3)
+    n_dof = 2                                    # n_dof for quadratic element is 3
+    x_local = x[index_b[:n_dof],:]               # The first boundary element nodes
+    r, w = oned_gauss(7)
+
     x_g, w_g, phi = twod_edge_shape(x_local,r,w)
@@ -0,0 +1,74 @@
+
+import numpy as np
+from twod_ref_basis import twod_ref_edge_basis
+
+def twod_edge_shape_batch(x, e_bnd, r, w):
+    '''
+    #---------------------------------------------------------------------------------#
+    # Description: Computes test functions on every boundary edge at once at Gauss    #
+    #              nodes (vectorized counterpart of twod_edge_shape).                 #
+    #                                                                                 #
+    # Usage: x_g,w_g,phi,normal = twod_edge_shape_batch(x,e_bnd,r,w)                  #
+    #                                                                                 #
+    #                                                                                 #
+    # Inputs:                                                                         #
+    #                                                                                 #
+    #   x: double, (n_nodes, 2) node coordinates of the mesh                          #
+    #                                                                                 #
+    #   e_bnd: int, (n_edges, n_dof) edge connectivity, e.g. from twod_mesh_edges     #
+    #                                                                                 #
+    #   r: double, (n_gauss,1) Gauss nodes on reference interval [-1,1]               #
+    #                                                                                 #
+    #   w: double, (n_gauss,1) Gauss weights on reference interval [-1,1]             #
+    #                                                                                 #
+    #                                                                                 #
+    # Outputs:                                                                        #
+    #                                                                                 #
+    #   x_g: double, (n_edges, n_gauss, 2) Gauss nodes on the edges                   #
+    #                                                                                 #
+    #   w_g: double >0, (n_edges, n_gauss) Gauss weights on the edges                 #
+    #                                                                                 #
+    #   phi: double, (n_edges, n_gauss, n_dof) basis functions at the Gauss nodes     #
+    #       (read-only view, phi does not depend on the edge)                         #
+    #                                                                                 #
+    #   normal: double, (n_edges, 2) unit normals, pointing outward for edges         #
+    #       running counterclockwise around the domain                                #
+    #                                                                                 #
+    # --------------------------------------------------------------------------------#
+    '''
+    n_edges, n = e_bnd.shape
+    r = np.asarray(r); w = np.asarray(w)
+    ref = twod_ref_edge_basis(n, r, w)
+
+    # Edge end points
+    x_1 = x[e_bnd[:,0],:]
+    x_2 = x[e_bnd[:,1],:]
+    d   = x_2 - x_1
+    length = np.sqrt(d[:,0]**2 + d[:,1]**2)
+
+    # Gauss nodes and weights
+    x_g = 0.5*(x_1 + x_2)[:,None,:] + 0.5*r[None,:,None]*d[:,None,:]
+    w_g = 0.5*length[:,None]*w[None,:]
+
+    normal = np.column_stack((d[:,1], -d[:,0]))/length[:,None]
+    phi = np.broadcast_to(ref.phi, (n_edges,) + ref.phi.shape)
+    return x_g, w_g, phi, normal
+
+
+
+# Test twod_edge_shape_batch
+if __name__ == '__main__':
+    from oned_gauss import oned_gauss
+    from twod_mesh import twod_mesh
+    from twod_edge_shape import twod_edge_shape
+
+    x, e_conn, index_b, e_bnd, e_tag = twod_mesh(0, 2, 0, 1, 'cubic', 7, 4, edges=True)
+    r, w = oned_gauss(4)
+    x_g, w_g, phi, normal = twod_edge_shape_batch(x, e_bnd, r, w)
+
+    # Perimeter, and the edge basis interpolates x along every edge
+    assert np.isclose(w_g.sum(), 6.)
+    assert np.allclose(np.einsum('egi,ei->eg', phi, x[e_bnd,0]), x_g[...,0])
+    for ie in range(e_bnd.shape[0]):
+        x_g1, w_g1, phi1 = twod_edge_shape(x[e_bnd[ie],:], r, w)
+        assert np.allclose(x_g[ie], x_g1) and np.allclose(w_g[ie], w_g1)
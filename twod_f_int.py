@@ -1,4 +1,6 @@
 
+import numpy as np
+
 def twod_f_int(Ff,test,w_g):
     '''
     #----------------------------------------------------------------------#
@@ -24,16 +26,59 @@ def twod_f_int(Ff,test,w_g):
     #                                                                      #
     #----------------------------------------------------------------------#
     '''
-    F = sum(np.dot(test.T, w_g*Ff))
+    F = np.dot(test.T, w_g*Ff)
     return F
 
 
+def twod_f_int_batch(Ff,test,w_g):
+    '''
+    #----------------------------------------------------------------------#
+    #  twod_f_int_batch - computes \int{ f*test } on every element at once #
+    #                     for one or several functions f                   #
+    #                                                                      #
+    #  Usage:    F = twod_f_int_batch( Ff, test, w_g )                     #
+    #                                                                      #
+    #  Variables:     Ff                                                   #
+    #                        Function values at the Gauss points           #
+    #                        (dim: n_elem, n_gauss) or, for n_rhs          #
+    #                        functions, (dim: n_elem, n_gauss, n_rhs)      #
+    #                                                                      #
+    #                 test                                                 #
+    #                        test functions at the Gauss points, shared    #
+    #                        (dim: n_gauss, n_dof) or stacked              #
+    #                        (dim: n_elem, n_gauss, n_dof)                 #
+    #                                                                      #
+    #                 w_g                                                  #
+    #                        Gauss weights (dim: n_elem, n_gauss)          #
+    #                                                                      #
+    #                 F                                                    #
+    #                        (dim: n_elem, n_dof) or (n_elem, n_dof, n_rhs)#
+    #----------------------------------------------------------------------#
+    '''
+    Ff = np.asarray(Ff)
+    wf = w_g*Ff if Ff.ndim == 2 else w_g[...,None]*Ff
+    if test.ndim == 2:
+        if wf.ndim == 2:
+            return np.dot(wf, test)
+        return np.einsum('egk,gi->eik', wf, test, optimize=True)
+    if wf.ndim == 2:
+        return np.einsum('eg,egi->ei', wf, test)
+    return np.matmul(np.swapaxes(test, 1, 2), wf)
+
 
-# Test twod_f_int 
-f = lambda x,y:x+y
-x_g,w_g,phi,p_x,p_y = twod_shape(x_local, r, s, w)
-Ff = f(r,s)
 
+# Test twod_f_int 
 if __name__ == '__main__':
-    F = twod_f_int(Ff, phi, w_g)
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_shape import twod_shape
+
+    x, e_conn, _ = twod_mesh(0, 1, 0, 1, 'quadratic', 5, 3)
+    r, s, w = twod_gauss(7)
+    x_local = x[e_conn[0,:],:]               # The first element nodes
 
+    f = lambda x,y:x+y
+    x_g,w_g,phi,p_x,p_y = twod_shape(x_local, r, s, w)
+    Ff = f(x_g[:,0],x_g[:,1])
+
+    F = twod_f_int(Ff, phi, w_g)
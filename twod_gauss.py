@@ -1,11 +1,17 @@
-
 import numpy as np
+from functools import lru_cache
+from scipy.special import roots_jacobi
+
+# Polynomial degree integrated exactly by each tabulated rule (keyed by the
+# number of points); the cheapest rule per degree is found in this order
+TWOD_GAUSS_RULES = {1: 1, 3: 2, 6: 4, 7: 5, 12: 6, 13: 7}
+_BY_DEGREE = [1, 3, 6, 7, 12]
 
 def twod_gauss(rule):
     '''
     -------------------------------------------------------------------------------
     #  twod_gauss.m - calculates Gauss integration points for triangular          #
-    #                 elements                                                    # 
+    #                 elements                                                    #
     #                                                                             #
     #  Copyright (c) 2001, Jeff Borggaard, Virginia Tech                          #
     #  Version: 1.0                                                               #
@@ -13,7 +19,8 @@ def twod_gauss(rule):
     #  Usage:    [r,s,w] = twod_gauss(rule)                                       #
     #                                                                             #
     #  Variables:     rule                                                        #
-    #                        Number of Gauss points:                              #
+    #                        Number of Gauss points: 1, 3, 6, 7, 12 or 13         #
+    #                        (exact for degree 1, 2, 4, 5, 6 and 7)               #
     #                 r                                                           #
     #                        xi coordinate of Gauss points                        #
     #                 s                                                           #
@@ -21,12 +28,40 @@ def twod_gauss(rule):
     #                 w                                                           #
     #                        Gauss weights corresponding to (r,s)                 #
     #                                                                             #
+    #  The rules are built once and returned as cached read-only arrays.          #
+    #  See twod_gauss_degree for the cheapest rule of a given degree.             #
+    ------------------------------------------------------------------------------
+    '''
+    if rule not in TWOD_GAUSS_RULES:
+        raise Exception('quadrature rules other than 1, 3, 6, 7, 12 or 13 are not supported')
+    return _tabulated(rule)
+
+
+def twod_gauss_degree(p):
+    '''
+    -------------------------------------------------------------------------------
+    #  twod_gauss_degree - cheapest rule exact for polynomials of degree p        #
+    #                                                                             #
+    #  Usage:    [r,s,w] = twod_gauss_degree(p)                                   #
+    #                                                                             #
+    #  Up to degree 6 the symmetric rules of twod_gauss are used (all weights     #
+    #  positive), above it conical Gauss-Jacobi product rules with                #
+    #  ceil((p+1)/2)^2 points.                                                    #
     ------------------------------------------------------------------------------
     '''
+    if p < 0:
+        raise Exception('twod_gauss_degree: degree must be nonnegative')
+    for rule in _BY_DEGREE:
+        if TWOD_GAUSS_RULES[rule] >= p:
+            return _tabulated(rule)
+    return _conical(int(np.ceil((p + 1)/2)))
+
 
+@lru_cache(maxsize=None)
+def _tabulated(rule):
     if rule == 1:
         # The trivial linear triangle case
-        pass
+        r = [1/3];  s = [1/3];  w = [1/2]
 
     elif rule == 3:
         # The following points correspond to a 3 point rule
@@ -34,19 +69,24 @@ def twod_gauss(rule):
         r[0] = 2/3;         s[0] = 1/6
         r[1] = 1/6;         s[1] = 2/3
         r[2] = 1/6;         s[2] = 1/6
-          
+
         w    = np.zeros(3)
         w[0] = 1/6;
         w[1] = w[0];
         w[2] = w[0];
-   
+
+    elif rule == 6:
+        # Degree 4, Dunavant, IJNME, v. 21, pp. 1129-1148, 1985
+        r, s, w = _symmetric(s21=[(0.4459484909159648, 0.22338158967801133),
+                                  (0.09157621350977078, 0.109951743655322)])
+
     elif rule == 7:
         # The following points correspond to a 7 point rule,
         # see Dunavant, IJNME, v. 21, pp. 1129-1148, 1995.
         # or Braess, p. 95.
 
         t1 = 1/3;    t2 = (6+np.sqrt(15))/21;   t3 = 4/7 - t2;
-   
+
         r    = np.zeros(7);  s    = np.zeros(7)
         r[0] = t1;          s[0] = t1
         r[1] = t2;          s[1] = t2
@@ -67,46 +107,87 @@ def twod_gauss(rule):
         w[5]  = t3;
         w[6]  = t3;
 
+    elif rule == 12:
+        # Degree 6, Dunavant
+        r, s, w = _symmetric(s21=[(0.2492867451708719, 0.11678627572644384),
+                                  (0.06308901449151003, 0.05084490637021794)],
+                             s111=[(0.053145049844790106, 0.31035245103381354,
+                                    0.08285107561833577)])
+
     elif rule == 13:
-        r     = np.zeros(13);      s     = np.zeros(13)
-        r[0]  = 0.0651301029022;  s[0]  = r[0]
-        r[1]  = 0.8697397941956;  s[1]  = r[0]
-        r[2]  = r[0];             s[2]  = r[1]
-        r[3]  = 0.3128654960049;  s[3]  = 0.0486903154253
-        r[4]  = 0.6384441885698;  s[4]  = r[3]
-        r[5]  = s[3];             s[5]  = r[4]
-        r[6]  = r[4];             s[6]  = r[5]
-        r[7]  = r[3];             s[7]  = r[4]
-        r[8]  = r[5];             s[8]  = r[3]
-        r[9] = 0.2603459660790;  s[9] = r[9]
-        r[10] = 0.4793080678419;  s[10] = r[9]
-        r[11] = r[9];            s[11] = r[10]
-        r[12] = 0.3333333333333;  s[12] = r[12]
-
-        w     = np.zeros(13)
-        w[0]  = 0.0533472356088
-        w[1]  = w[0]
-        w[2]  = w[0]
-        w[3]  = 0.0771137608903
-        w[4]  = w[3]
-        w[5]  = w[3]
-        w[6]  = w[3]
-        w[7]  = w[3]
-        w[8]  = w[3]
-        w[9] = 0.1756152574332
-        w[10] = w[9]
-        w[11] = w[9]
-        w[12] =-0.1495700444677
-    
-        w = w/2
-    else:
-        raise Exception('quadrature rules other than 1, 3, 7 or 13 are not supported')
-    return r,s,w
+        # Degree 7 (negative centroid weight), parameters solved to full
+        # precision from the moment equations
+        a  = 0.0651301029022139;   w_a = 0.053347235608835926
+        c  = 0.31286549600487;     d   = 0.04869031542532236
+        e  = 1 - c - d;            w_c = 0.07711376089026449
+        b  = 0.26034596607903454;  w_b = 0.17561525743314846
+        w_0 = -0.14957004446754
 
+        r = [a, 1-2*a, a, c, e, d, e, c, d, b, 1-2*b, b, 1/3]
+        s = [a, a, 1-2*a, d, c, e, d, e, c, b, b, 1-2*b, 1/3]
+        w = np.array([w_a]*3 + [w_c]*6 + [w_b]*3 + [w_0])/2
 
+    return _frozen(r, s, w)
+
+
+def _symmetric(s21=(), s111=()):
+    # Orbits (a,a,1-2a) and (a,b,1-a-b) of the barycentric coordinates, with
+    # weights summing to one (halved for the area of the unit triangle)
+    r = []; s = []; w = []
+    for a, w_a in s21:
+        r += [a, 1-2*a, a];  s += [a, a, 1-2*a];  w += [w_a]*3
+    for a, b, w_a in s111:
+        c = 1 - a - b
+        r += [a, b, a, c, b, c];  s += [b, a, c, a, c, b];  w += [w_a]*6
+    return r, s, np.array(w)/2
+
+
+@lru_cache(maxsize=None)
+def _conical(n):
+    # r = u, s = (1-u) v with Gauss-Jacobi in u (weight 1-u) and Gauss-Legendre
+    # in v, exact for degree 2n-1
+    t_u, w_u = roots_jacobi(n, 1., 0.)
+    t_v, w_v = np.polynomial.legendre.leggauss(n)
+    u = (1 + t_u)/2
+    v = (1 + t_v)/2
+    r = np.repeat(u, n)
+    s = np.outer(1 - u, v).ravel()
+    w = np.outer(w_u/4, w_v/2).ravel()
+    return _frozen(r, s, w)
 
-# Test twod_gauss
-rule = 13
 
+def _frozen(*arrays):
+    frozen = []
+    for a in arrays:
+        a = np.array(a, dtype=float)
+        a.flags.writeable = False
+        frozen.append(a)
+    return tuple(frozen)
+
+
+
+# Test twod_gauss
 if __name__ == '__main__':
-    r,s,w = twod_gauss(rule)
+    from math import factorial
+
+    def moment_error(r, s, w, p):
+        # \int r^a s^b over the unit triangle is a! b! / (a+b+2)!
+        err = 0.
+        for a in range(p+1):
+            for b in range(p+1-a):
+                exact = factorial(a)*factorial(b)/factorial(a+b+2)
+                err = max(err, abs(np.sum(w*r**a*s**b) - exact)/exact)
+        return err
+
+    for rule, p in TWOD_GAUSS_RULES.items():
+        r, s, w = twod_gauss(rule)
+        assert r.size == rule and moment_error(r, s, w, p) < 1e-13
+        assert moment_error(r, s, w, p+1) > 1e-8
+        assert rule == 13 or np.all(w > 0)
+
+    for p in range(21):
+        r, s, w = twod_gauss_degree(p)
+        assert moment_error(r, s, w, p) < 1e-12 and np.all(w > 0)
+        assert np.all(r >= 0) and np.all(s >= 0) and np.all(r + s <= 1)
+    assert twod_gauss_degree(3)[0].size == 6 and twod_gauss_degree(7)[0].size == 16
+    assert twod_gauss(7)[0] is twod_gauss(7)[0] and not twod_gauss(7)[0].flags.writeable
@@ -0,0 +1,178 @@
+
+import numpy as np
+from twod_ref_basis import twod_ref_eval
+from twod_profile import twod_timed
+
+class TwodLocator:
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_locate.py - point location and interpolation of finite element     #
+    #                   functions at arbitrary points                          #
+    #                                                                          #
+    #  TwodLocator - uniform bucket grid over the element bounding boxes.      #
+    #                Every point is only tested against the elements of its    #
+    #                bucket, all points at once                                #
+    #                                                                          #
+    #  Usage:    loc = TwodLocator(x, e_conn, n_buckets)                       #
+    #            elem, r, s = loc.locate(p)                                    #
+    #            u_p        = loc.interpolate(u, p)                            #
+    #            u_x, u_y   = loc.gradient(u, p)                               #
+    #                                                                          #
+    #  Variables:     n_buckets                                                #
+    #                        (optional) number of buckets, default n_elem      #
+    #                 p                                                        #
+    #                        points (dim: n_pts, 2)                            #
+    #                 elem                                                     #
+    #                        containing element, -1 outside the mesh           #
+    #                 (r, s)                                                   #
+    #                        reference coordinates of p in elem                #
+    #                 u                                                        #
+    #                        nodal values (dim: n_nodes or n_nodes, n_fields), #
+    #                        results are nan outside the mesh                  #
+    #                                                                          #
+    #  Elements are straight sided: (r, s) are found from the vertices.        #
+    #--------------------------------------------------------------------------#
+    '''
+    def __init__(self, x, e_conn, n_buckets=None, chunk_size=65536):
+        self.x      = x
+        self.e_conn = e_conn
+        self.chunk_size = chunk_size
+        n_elem = e_conn.shape[0]
+
+        # Affine maps x = c0 + c1 r + c2 s and their inverses
+        x_v = x[e_conn[:,:3],:]
+        self.c0 = x_v[:,0,:]
+        c1 = x_v[:,1,:] - self.c0
+        c2 = x_v[:,2,:] - self.c0
+        jac = c1[:,0]*c2[:,1] - c1[:,1]*c2[:,0]
+        self.inv = np.stack((np.column_stack(( c2[:,1], -c2[:,0])),
+                             np.column_stack((-c1[:,1],  c1[:,0]))), axis=1)/jac[:,None,None]
+
+        # Bucket grid over the mesh bounding box
+        lo, hi = x_v.min(axis=1), x_v.max(axis=1)
+        self.lo = lo.min(axis=0)
+        extent  = np.maximum(hi.max(axis=0) - self.lo, 1e-300)
+        n_buckets = n_elem if n_buckets is None else n_buckets
+        aspect = extent[0]/extent[1]
+        self.n = np.maximum(np.rint([np.sqrt(n_buckets*aspect),
+                                     np.sqrt(n_buckets/aspect)]), 1).astype(np.int64)
+        self.h = extent/self.n
+
+        # Elements of every bucket (CSR: ptr, elems)
+        i0 = self._cell(lo)
+        i1 = self._cell(hi)
+        width  = i1 - i0 + 1
+        counts = width[:,0]*width[:,1]
+        elems  = np.repeat(np.arange(n_elem), counts)
+        k  = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        wx = width[elems,0]
+        cell = (i0[elems,1] + k//wx)*self.n[0] + i0[elems,0] + k % wx
+        order = np.argsort(cell, kind='stable')
+        self.elems = elems[order]
+        self.ptr   = np.concatenate(([0], np.cumsum(np.bincount(cell, minlength=self.n.prod()))))
+
+    @twod_timed('locate')
+    def locate(self, p, tol=1e-10):
+        p = np.asarray(p, dtype=float).reshape(-1, 2)
+        elem = np.full(p.shape[0], -1, dtype=np.int64)
+        r = np.full(p.shape[0], np.nan)
+        s = np.full(p.shape[0], np.nan)
+        for k in range(0, p.shape[0], self.chunk_size):
+            sl = slice(k, k + self.chunk_size)
+            elem[sl], r[sl], s[sl] = self._locate(p[sl], tol)
+        return elem, r, s
+
+    def interpolate(self, u, p):
+        elem, phi, _, _ = self._basis(p, derivatives=False)
+        return self._combine(u, elem, phi)
+
+    def gradient(self, u, p):
+        elem, _, p_x, p_y = self._basis(p, derivatives=True)
+        return self._combine(u, elem, p_x), self._combine(u, elem, p_y)
+
+    def _cell(self, p):
+        i = np.floor((p - self.lo)/self.h).astype(np.int64)
+        return np.clip(i, 0, self.n - 1)
+
+    def _locate(self, p, tol):
+        n_pts = p.shape[0]
+        elem = np.full(n_pts, -1, dtype=np.int64)
+        r = np.full(n_pts, np.nan)
+        s = np.full(n_pts, np.nan)
+
+        ij = self._cell(p)
+        bucket = ij[:,1]*self.n[0] + ij[:,0]
+        counts = self.ptr[bucket+1] - self.ptr[bucket]
+
+        # All (point, candidate element) pairs
+        pt = np.repeat(np.arange(n_pts), counts)
+        k  = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cand = self.elems[self.ptr[bucket[pt]] + k]
+        d  = p[pt] - self.c0[cand]
+        inv = self.inv[cand]
+        r_c = inv[:,0,0]*d[:,0] + inv[:,0,1]*d[:,1]
+        s_c = inv[:,1,0]*d[:,0] + inv[:,1,1]*d[:,1]
+
+        # Keep the most interior candidate of every point
+        score = np.minimum(np.minimum(r_c, s_c), 1. - r_c - s_c)
+        inside = np.flatnonzero(score >= -tol)
+        best = inside[np.lexsort((-score[inside], pt[inside]))]
+        first = np.unique(pt[best], return_index=True)[1]
+        best = best[first]
+        elem[pt[best]] = cand[best]
+        r[pt[best]] = r_c[best]
+        s[pt[best]] = s_c[best]
+        return elem, r, s
+
+    def _basis(self, p, derivatives):
+        elem, r, s = self.locate(p)
+        found = elem >= 0
+        phi, p_r, p_s = twod_ref_eval(self.e_conn.shape[1], r[found], s[found])
+        if not derivatives:
+            return elem, phi, None, None
+        inv = self.inv[elem[found]]
+        p_x = p_r*inv[:,0,0,None] + p_s*inv[:,1,0,None]
+        p_y = p_r*inv[:,0,1,None] + p_s*inv[:,1,1,None]
+        return elem, phi, p_x, p_y
+
+    def _combine(self, u, elem, phi):
+        u = np.asarray(u)
+        found = elem >= 0
+        out = np.full((elem.size,) + u.shape[1:], np.nan)
+        u_e = u[self.e_conn[elem[found]]]
+        out[found] = np.einsum('pi,pi...->p...', phi, u_e)
+        return out
+
+
+
+# Test twod_locate
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+
+    x, e_conn, index_b = twod_mesh(-1, 2, 0, 1, 'quadratic', 121, 41)
+    loc = TwodLocator(x, e_conn)
+    rng = np.random.default_rng(0)
+    p = np.column_stack((rng.uniform(-1.5, 2.5, 200000), rng.uniform(-.2, 1.2, 200000)))
+    inside = (p[:,0] >= -1) & (p[:,0] <= 2) & (p[:,1] >= 0) & (p[:,1] <= 1)
+
+    # Located points are inside their element and map back onto themselves
+    elem, r, s = loc.locate(p)
+    assert np.array_equal(elem >= 0, inside)
+    assert np.all(np.minimum(np.minimum(r, s), 1 - r - s)[inside] >= -1e-10)
+    phi, _, _ = twod_ref_eval(3, r[inside], s[inside])
+    x_v = x[e_conn[elem[inside], :3]]
+    assert np.allclose(np.einsum('pi,pid->pd', phi, x_v), p[inside])
+
+    # Quadratic functions and their gradients are interpolated exactly
+    u = np.column_stack((x[:,0]**2 - x[:,0]*x[:,1], 3*x[:,1]**2 + 1))
+    u_p = loc.interpolate(u, p)
+    u_x, u_y = loc.gradient(u, p)
+    q = p[inside]
+    assert np.all(np.isnan(u_p[~inside]))
+    assert np.allclose(u_p[inside], np.column_stack((q[:,0]**2 - q[:,0]*q[:,1], 3*q[:,1]**2 + 1)))
+    assert np.allclose(u_x[inside], np.column_stack((2*q[:,0] - q[:,1], 0*q[:,0])))
+    assert np.allclose(u_y[inside], np.column_stack((-q[:,0], 6*q[:,1])))
+
+    # Nodes, including the corners, are found
+    elem, r, s = loc.locate(x)
+    assert np.all(elem >= 0)
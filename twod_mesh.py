@@ -1,7 +1,10 @@
 
 import numpy as np
+from twod_profile import twod_timed
 
-def twod_mesh(x_l,x_r,y_l,y_r,etype,n_nodesx,n_nodesy, *args):
+@twod_timed('mesh')
+def twod_mesh(x_l,x_r,y_l,y_r,etype,n_nodesx,n_nodesy, *args,
+              index_dtype=int, x_out=None, e_conn_out=None, edges=False):
     '''
     --------------------------------------------------------------------------------
     #  twod_mesh.m - Generate a rectangular mesh with a prescribed density.        #
@@ -26,6 +29,15 @@ def twod_mesh(x_l,x_r,y_l,y_r,etype,n_nodesx,n_nodesy, *args):
     #                 args                                                         #
     #                     add optional argument 'plot' to display plot             #
     #                                                                              #
+    #                 index_dtype                                                  #
+    #                        integer type of e_conn and index_b (e.g. np.int32)    #
+    #                 x_out, e_conn_out                                            #
+    #                        (optional) preallocated arrays of shape               #
+    #                        (n_nodes, 2) and (n_elements, n_dof) to fill          #
+    #                 edges                                                        #
+    #                        if True also return e_bnd and e_tag, see              #
+    #                        twod_mesh_edges                                       #
+    #                                                                              #
     #  Outputs:                                                                    #
     #                 x                                                            #
     #                        node coordinates of mesh                              #
@@ -35,80 +47,125 @@ def twod_mesh(x_l,x_r,y_l,y_r,etype,n_nodesx,n_nodesy, *args):
     #                        node numbers of boundary nodes                        #
     --------------------------------------------------------------------------------
     '''
+    # Local (i,j) grid offsets of the two triangles in each cell, the first
+    # three entries are the vertices, then edge nodes and interior nodes
     if etype == 'linear':
-        n_nodes = n_nodesx*n_nodesy
-        n_elements = 2*(n_nodesx-1)*(n_nodesy-1)
-        
-        # Generate node coordinates
-        dx = (x_r-x_l)/(n_nodesx-1)
-        dy = (y_r-y_l)/(n_nodesy-1)
-        
-        x = np.zeros((n_nodes,2))
-        for i in range(n_nodesx):
-            for j in range(n_nodesy):
-                k = i+j*n_nodesx;
-                x[k,0] = x_l + dx*i
-                x[k,1] = y_l + dy*j
-
-
-    # Generate element connectivity
-        e_conn = np.zeros((n_elements, 3)).astype(int);
-        ie     = -1
-        for j in range(n_nodesy-1):
-            for i in range(n_nodesx-1):
-                ie = ie + 1 
-                k = i + j*n_nodesx
-                e_conn[ie,:] = [k, k+1+n_nodesx, k+n_nodesx]
-                ie = ie + 1
-                e_conn[ie,:] = [k, k+1, k+1+n_nodesx]
+        p = 1
+        tri_1 = [(0,0), (1,1), (0,1)]
+        tri_2 = [(0,0), (1,0), (1,1)]
 
     elif etype == 'quadratic':
-        #  Generate a mesh with quadratic elements
-        n_nodes  = n_nodesx*n_nodesy;
-        n_elements = int(2*(n_nodesx-1)*(n_nodesy-1)/4)
-
-        dx = (x_r-x_l)/(n_nodesx-1)
-        dy = (y_r-y_l)/(n_nodesy-1)
-        
-        x = np.zeros((n_nodes,2))
-        for i in range(n_nodesx):
-            for j in range(n_nodesy):
-                k = i+j*n_nodesx;
-                x[k,0] = x_l + dx*i
-                x[k,1] = y_l + dy*j
-
-        #  Generate element connectivity
-        e_conn = np.zeros((n_elements, 6)).astype(int)
-        ie     = -1
-        for j in range(0,n_nodesy-1,2):
-            for i in range(0,n_nodesx-1,2):
-                ie = ie + 1
-                k = i + j*n_nodesx
-                e_conn[ie,:] = [k, k+2+2*n_nodesx, k+2*n_nodesx, 
-                                k + 1 + n_nodesx, k+1+2*n_nodesx, k+n_nodesx ]
-                ie = ie + 1
-                e_conn[ie,:] = [k, k+2, k+2+2*n_nodesx, 
-                                k+1, k+2+n_nodesx, k+1+n_nodesx ]
+        p = 2
+        tri_1 = [(0,0), (2,2), (0,2), (1,1), (1,2), (0,1)]
+        tri_2 = [(0,0), (2,0), (2,2), (1,0), (2,1), (1,1)]
 
     elif etype == 'cubic':
-        raise Exception('twod_mesh: cubic elements are not currently implemented')
+        p = 3
+        tri_1 = [(0,0), (3,3), (0,3), (1,1), (2,2), (2,3), (1,3), (0,2), (0,1), (1,2)]
+        tri_2 = [(0,0), (3,0), (3,3), (1,0), (2,0), (3,1), (3,2), (2,2), (1,1), (2,1)]
+
     else:
         raise Exception('twod_mesh: {} is not a valid element type'.format(etype))
-    
+
+    if (n_nodesx-1) % p or (n_nodesy-1) % p or n_nodesx < 2 or n_nodesy < 2:
+        raise Exception('twod_mesh: n_nodesx-1 and n_nodesy-1 must be positive '
+                        'multiples of {} for {} elements'.format(p, etype))
+
+    n_nodes    = n_nodesx*n_nodesy
+    n_elements = 2*((n_nodesx-1)//p)*((n_nodesy-1)//p)
+    n_dof      = len(tri_1)
+
+    # Generate node coordinates, numbered row by row
+    dx = (x_r-x_l)/(n_nodesx-1)
+    dy = (y_r-y_l)/(n_nodesy-1)
+
+    x = _buffer(x_out, (n_nodes, 2), float, 'x_out')
+    xy = x.reshape(n_nodesy, n_nodesx, 2)
+    xy[:,:,0] = x_l + dx*np.arange(n_nodesx)[None,:]
+    xy[:,:,1] = y_l + dy*np.arange(n_nodesy)[:,None]
+
+    # Generate element connectivity, two triangles per cell
+    k = (np.arange(0, n_nodesy-1, p, dtype=index_dtype)[:,None]*n_nodesx
+       + np.arange(0, n_nodesx-1, p, dtype=index_dtype)[None,:]).reshape(-1,1)
+    off_1 = np.array([i + j*n_nodesx for i,j in tri_1], dtype=index_dtype)
+    off_2 = np.array([i + j*n_nodesx for i,j in tri_2], dtype=index_dtype)
+
+    e_conn = _buffer(e_conn_out, (n_elements, n_dof), index_dtype, 'e_conn_out')
+    np.add(k, off_1, out=e_conn[0::2])
+    np.add(k, off_2, out=e_conn[1::2])
+
     # Get boundary indices
-    row_1 = np.arange(1,n_nodesx-1)
-    row_2 = np.arange(0,(n_nodesy-1)*n_nodesx, n_nodesx)
-    row_3 = np.arange(n_nodesx-1, n_nodesy*n_nodesx, n_nodesx)
-    row_4 = np.arange((n_nodesy-1)*n_nodesx, n_nodes-1)
+    row_1 = np.arange(1,n_nodesx-1, dtype=index_dtype)
+    row_2 = np.arange(0,(n_nodesy-1)*n_nodesx, n_nodesx, dtype=index_dtype)
+    row_3 = np.arange(n_nodesx-1, n_nodesy*n_nodesx, n_nodesx, dtype=index_dtype)
+    row_4 = np.arange((n_nodesy-1)*n_nodesx, n_nodes-1, dtype=index_dtype)
 
     index_b = np.concatenate((row_1, row_2, row_3, row_4), axis=0)
     
     if len(args) >= 1:
+        from twod_plotm2 import twod_plotm2
         twod_plotm2(x,e_conn,'ro')
-        
+
+    if edges:
+        e_bnd, e_tag = twod_mesh_edges(etype, n_nodesx, n_nodesy, index_dtype)
+        return x, e_conn, index_b, e_bnd, e_tag
     return x, e_conn, index_b
 
 
+def twod_mesh_edges(etype, n_nodesx, n_nodesy, index_dtype=int):
+    '''
+    --------------------------------------------------------------------------------
+    #  twod_mesh_edges - boundary edge connectivity of a twod_mesh grid            #
+    #                                                                              #
+    #  Usage:    e_bnd, e_tag = twod_mesh_edges(etype, n_nodesx, n_nodesy)         #
+    #                                                                              #
+    #  Outputs:                                                                    #
+    #                 e_bnd                                                        #
+    #                        edge connectivity (dim: n_edges, p+1) with 2, 3 or    #
+    #                        4 nodes for linear, quadratic and cubic elements,     #
+    #                        ordered end, end, interior nodes (as in               #
+    #                        twod_edge_shape).  Edges run counterclockwise         #
+    #                        around the domain                                     #
+    #                 e_tag                                                        #
+    #                        side of every edge: 0 bottom, 1 right, 2 top, 3 left  #
+    --------------------------------------------------------------------------------
+    '''
+    p = {'linear': 1, 'quadratic': 2, 'cubic': 3}.get(etype)
+    if p is None:
+        raise Exception('twod_mesh: {} is not a valid element type'.format(etype))
+    n_nodes = n_nodesx*n_nodesy
+
+    # Boundary nodes of every side, counterclockwise
+    sides = [np.arange(0, n_nodesx),
+             np.arange(n_nodesx-1, n_nodes, n_nodesx),
+             np.arange(n_nodes-1, n_nodes-n_nodesx-1, -1),
+             np.arange(n_nodes-n_nodesx, -1, -n_nodesx)]
+
+    e_bnd = []
+    e_tag = []
+    for tag, side in enumerate(sides):
+        start = np.arange(0, len(side)-1, p)
+        local = np.array([0, p] + list(range(1, p)))
+        e_bnd.append(side[start[:,None] + local[None,:]])
+        e_tag.append(np.full(len(start), tag))
+
+    e_bnd = np.concatenate(e_bnd).astype(index_dtype)
+    e_tag = np.concatenate(e_tag).astype(np.int8)
+    return e_bnd, e_tag
+
+
+def _buffer(out, shape, dtype, name):
+    '''
+    Returns out after checking it against shape and dtype, or a new array.
+    '''
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.shape != shape or out.dtype != np.dtype(dtype) or not out.flags.c_contiguous:
+        raise Exception('twod_mesh: {} must be a contiguous {} array of shape {}'
+                        .format(name, np.dtype(dtype), shape))
+    return out
+
+
 # Test twod_mesh
 x_min = 0; x_max = 1; nx = 5 
 y_min = 0; y_max = 1; ny = 3
@@ -117,4 +174,51 @@ etype = 'quadratic'
 if __name__ == '__main__':
     x,e_conn,index_b = twod_mesh(x_min,x_max,y_min,y_max,etype,
                                            nx,ny)
-  
+
+    # Small meshes written out by hand (nodes numbered row by row)
+    hand = {'linear'   : (3, 2, [[0, 4, 3], [0, 1, 4], [1, 5, 4], [1, 2, 5]]),
+            'quadratic': (5, 3, [[0, 12, 10, 6, 11, 5], [0, 2, 12, 1, 7, 6],
+                                 [2, 14, 12, 8, 13, 7], [2, 4, 14, 3, 9, 8]]),
+            'cubic'    : (4, 4, [[0, 15, 12, 5, 10, 14, 13, 8, 4, 9],
+                                 [0, 3, 15, 1, 2, 7, 11, 10, 5, 6]])}
+    for etype, (n_x, n_y, conn) in hand.items():
+        x, e_conn, index_b = twod_mesh(0, 1, 0, 1, etype, n_x, n_y)
+        assert np.array_equal(e_conn, conn)
+
+    for etype, n_x, n_y in [('linear', 7, 4), ('quadratic', 9, 5), ('cubic', 10, 7)]:
+        x, e_conn, index_b = twod_mesh(-1, 2, 0, 1.5, etype, n_x, n_y)
+
+        # Counterclockwise elements covering the domain
+        v0, v1, v2 = [x[e_conn[:,k]] for k in range(3)]
+        jac = (v1[:,0] - v0[:,0])*(v2[:,1] - v0[:,1]) - (v1[:,1] - v0[:,1])*(v2[:,0] - v0[:,0])
+        assert np.all(jac > 0) and np.isclose(jac.sum()/2, 4.5)
+
+        # Edge nodes at the edge midpoints / thirds, cubic centroid last
+        X = x[e_conn]
+        if etype == 'quadratic':
+            mid = [(v0 + v1)/2, (v1 + v2)/2, (v2 + v0)/2]
+            assert np.allclose(X[:,3:], np.stack(mid, axis=1))
+        if etype == 'cubic':
+            third = [(2*v0 + v1)/3, (v0 + 2*v1)/3, (2*v1 + v2)/3, (v1 + 2*v2)/3,
+                     (2*v2 + v0)/3, (v2 + 2*v0)/3, (v0 + v1 + v2)/3]
+            assert np.allclose(X[:,3:], np.stack(third, axis=1))
+
+        # Every node used, boundary nodes exactly those on the sides
+        assert np.array_equal(np.unique(e_conn), np.arange(n_x*n_y))
+        on_side = np.isclose(x[:,0], -1) | np.isclose(x[:,0], 2) | \
+                  np.isclose(x[:,1], 0) | np.isclose(x[:,1], 1.5)
+        assert len(index_b) == 2*(n_x + n_y) - 4
+        assert np.array_equal(np.sort(index_b), np.flatnonzero(on_side))
+
+        # Preallocated buffers are filled in place with the requested dtype
+        x_out = np.empty_like(x)
+        e_out = np.empty(e_conn.shape, dtype=np.int32)
+        x_1, e_1, index_1 = twod_mesh(-1, 2, 0, 1.5, etype, n_x, n_y, index_dtype=np.int32,
+                                      x_out=x_out, e_conn_out=e_out)
+        assert x_1 is x_out and e_1 is e_out and index_1.dtype == np.int32
+        assert np.array_equal(x_out, x) and np.array_equal(e_out, e_conn)
+        try:
+            twod_mesh(-1, 2, 0, 1.5, etype, n_x, n_y, e_conn_out=e_out)
+            raise AssertionError('int32 buffer accepted for int64 connectivity')
+        except Exception as err:
+            assert 'e_conn_out' in str(err)
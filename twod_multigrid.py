@@ -0,0 +1,247 @@
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from twod_mesh import twod_mesh
+from twod_ref_basis import twod_ref_eval
+
+def twod_mesh_hierarchy(x_l,x_r,y_l,y_r,etype,n_nodesx,n_nodesy,n_levels,
+                        index_dtype=int):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_multigrid.py - geometric multigrid on nested twod_mesh grids       #
+    #                                                                          #
+    #  twod_mesh_hierarchy - nested meshes and prolongation operators. Level   #
+    #                        0 is the n_nodesx x n_nodesy grid, every finer    #
+    #                        level refines an n grid into a 2n-1 grid          #
+    #                                                                          #
+    #  Usage:    meshes, P = twod_mesh_hierarchy(x_l,x_r,y_l,y_r,etype,        #
+    #                                   n_nodesx,n_nodesy,n_levels)            #
+    #                                                                          #
+    #  Variables:     etype                                                    #
+    #                        'linear' or 'quadratic'                           #
+    #                 n_levels                                                 #
+    #                        number of grids in the hierarchy                  #
+    #                                                                          #
+    #                 meshes                                                   #
+    #                        list of (x, e_conn, index_b), coarsest first      #
+    #                 P                                                        #
+    #                        list of sparse prolongations, P[k] interpolates   #
+    #                        level k onto level k+1 (n_nodes_k+1, n_nodes_k)   #
+    #--------------------------------------------------------------------------#
+    '''
+    if etype not in ('linear', 'quadratic'):
+        raise Exception('twod_mesh_hierarchy: {} elements are not supported'.format(etype))
+
+    meshes = []
+    P = []
+    nx, ny = n_nodesx, n_nodesy
+    for k in range(n_levels):
+        meshes.append(twod_mesh(x_l,x_r,y_l,y_r,etype,nx,ny, index_dtype=index_dtype))
+        if k > 0:
+            P.append(twod_prolongation(meshes[-2], meshes[-1][0], etype, (x_l,x_r,y_l,y_r)))
+        nx, ny = 2*nx - 1, 2*ny - 1
+    return meshes, P
+
+
+def twod_prolongation(mesh_c, x_f, etype, box):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_prolongation - interpolation of a twod_mesh function onto the      #
+    #                      nodes x_f, by evaluating the coarse element basis   #
+    #                                                                          #
+    #  Usage:    P = twod_prolongation(mesh_c, x_f, etype, box)                #
+    #                                                                          #
+    #  Variables:     mesh_c                                                   #
+    #                        (x, e_conn, index_b) of a coarse twod_mesh        #
+    #                 box                                                      #
+    #                        (x_l, x_r, y_l, y_r) of that mesh                 #
+    #--------------------------------------------------------------------------#
+    '''
+    x_c, e_conn, _ = mesh_c
+    x_l, x_r, y_l, y_r = box
+    p = 1 if etype == 'linear' else 2
+    n_dof = e_conn.shape[1]
+
+    # Cells of the coarse grid, two triangles each (see twod_mesh)
+    n_cx = int(round((np.unique(x_c[:,0]).size - 1)/p))
+    n_cy = int(round((np.unique(x_c[:,1]).size - 1)/p))
+    xi  = (x_f[:,0] - x_l)/(x_r - x_l)*n_cx
+    eta = (x_f[:,1] - y_l)/(y_r - y_l)*n_cy
+    c_i = np.clip(np.floor(xi ), 0, n_cx-1).astype(int)
+    c_j = np.clip(np.floor(eta), 0, n_cy-1).astype(int)
+    xi  = xi  - c_i
+    eta = eta - c_j
+
+    # First triangle (0,0),(1,1),(0,1) above the diagonal, second below
+    upper = eta >= xi
+    elem  = 2*(c_i + c_j*n_cx) + np.where(upper, 0, 1)
+    r = np.where(upper, xi, xi - eta)
+    s = np.where(upper, eta - xi, eta)
+
+    phi, _, _ = twod_ref_eval(n_dof, r, s)
+    phi[np.abs(phi) < 1e-12] = 0.
+    rows = np.repeat(np.arange(x_f.shape[0]), n_dof)
+    P = sp.csr_matrix((phi.ravel(), (rows, e_conn[elem].ravel())),
+                      shape=(x_f.shape[0], x_c.shape[0]))
+    P.eliminate_zeros()
+    return P
+
+
+class TwodMultigrid:
+    '''
+    #--------------------------------------------------------------------------#
+    #  TwodMultigrid - geometric multigrid solver / preconditioner for a       #
+    #                  system on the finest mesh of twod_mesh_hierarchy.       #
+    #                  Coarse operators are Galerkin products P^T A P on the   #
+    #                  interior nodes, the coarsest is solved by sparse LU     #
+    #                                                                          #
+    #  Usage:    mg = TwodMultigrid(A, P, index_b, cycle, smoother,            #
+    #                               n_smooth, omega)                           #
+    #            u  = mg.solve(b, tol, maxiter)       stand-alone iteration    #
+    #            M  = mg.aspreconditioner()           one cycle, e.g. for CG   #
+    #                                                                          #
+    #  Variables:     A                                                        #
+    #                        finest-level matrix with Dirichlet rows, e.g.     #
+    #                        from twod_dirichlet                               #
+    #                 P                                                        #
+    #                        prolongations from twod_mesh_hierarchy            #
+    #                 index_b                                                  #
+    #                        list of boundary nodes of every level             #
+    #                 cycle                                                    #
+    #                        'V', 'W' or 'F'                                   #
+    #                 smoother                                                 #
+    #                        'jacobi' (damped by omega) or 'gauss_seidel'      #
+    #                        (forward before, backward after the coarse        #
+    #                        correction, so the cycle stays symmetric)         #
+    #                 n_smooth                                                 #
+    #                        (pre, post) smoothing sweeps                      #
+    #                                                                          #
+    #                 residuals                                                #
+    #                        residual norms of the last solve()                #
+    #--------------------------------------------------------------------------#
+    '''
+    def __init__(self, A, P, index_b, cycle='V', smoother='jacobi',
+                 n_smooth=(2,2), omega=2/3):
+        if cycle not in ('V', 'W', 'F'):
+            raise Exception('TwodMultigrid: {} is not a valid cycle'.format(cycle))
+        if smoother not in ('jacobi', 'gauss_seidel'):
+            raise Exception('TwodMultigrid: {} is not a valid smoother'.format(smoother))
+
+        self.cycle    = cycle
+        self.smoother = smoother
+        self.n_smooth = n_smooth
+        self.omega    = omega
+
+        # Interior nodes of every level, prolongations between them
+        n_levels = len(P) + 1
+        free = []
+        for k in range(n_levels):
+            n = P[k].shape[1] if k < n_levels-1 else P[-1].shape[0]
+            mask = np.ones(n, dtype=bool)
+            mask[index_b[k]] = False
+            free.append(mask)
+
+        self.A = [None]*n_levels
+        self.P = [None]*(n_levels-1)
+        self.A[-1] = sp.csr_matrix(A)
+        for k in range(n_levels-2, -1, -1):
+            P_k = P[k][:, np.flatnonzero(free[k])]
+            if k < n_levels-2:
+                P_k = P_k[np.flatnonzero(free[k+1]), :]
+            else:
+                P_k = sp.diags(free[k+1].astype(float)) @ P_k
+            self.P[k] = P_k.tocsr()
+            self.A[k] = (self.P[k].T @ self.A[k+1] @ self.P[k]).tocsr()
+
+        self.lu = spla.splu(self.A[0].tocsc())
+        self.D  = [A_k.diagonal() for A_k in self.A]
+        self.L  = [sp.tril(A_k).tocsr() for A_k in self.A]
+        self.U  = [sp.triu(A_k).tocsr() for A_k in self.A]
+        self.residuals = []
+
+    def solve(self, b, u=None, tol=1e-10, maxiter=100):
+        b = np.asarray(b, dtype=float)
+        u = np.zeros_like(b) if u is None else np.array(u, dtype=float)
+        top = len(self.A) - 1
+        norm_b = np.linalg.norm(b) or 1.
+
+        self.residuals = [np.linalg.norm(b - self.A[top] @ u)]
+        for it in range(maxiter):
+            if self.residuals[-1] <= tol*norm_b:
+                break
+            u = self._cycle(top, b, u, self.cycle)
+            self.residuals.append(np.linalg.norm(b - self.A[top] @ u))
+        else:
+            if self.residuals[-1] > tol*norm_b:
+                raise Exception('TwodMultigrid: no convergence in {} cycles'.format(maxiter))
+        return u
+
+    def aspreconditioner(self):
+        top = len(self.A) - 1
+        n = self.A[top].shape[0]
+        return spla.LinearOperator((n, n), dtype=float,
+            matvec=lambda b: self._cycle(top, b.ravel(), np.zeros(n), self.cycle))
+
+    def _cycle(self, k, b, u, kind):
+        if k == 0:
+            return self.lu.solve(b)
+
+        u = self._smooth(k, b, u, self.n_smooth[0], forward=True)
+        r_c = self.P[k-1].T @ (b - self.A[k] @ u)
+
+        e_c = self._cycle(k-1, r_c, np.zeros_like(r_c), kind)
+        if kind == 'W':
+            e_c = self._cycle(k-1, r_c, e_c, 'W')
+        elif kind == 'F':
+            e_c = self._cycle(k-1, r_c, e_c, 'V')
+
+        u = u + self.P[k-1] @ e_c
+        return self._smooth(k, b, u, self.n_smooth[1], forward=False)
+
+    def _smooth(self, k, b, u, n_sweeps, forward):
+        A = self.A[k]
+        for _ in range(n_sweeps):
+            if self.smoother == 'jacobi':
+                u = u + self.omega*(b - A @ u)/self.D[k]
+            elif forward:
+                # (D + L) u_new = b - U_strict u
+                u = u + spla.spsolve_triangular(self.L[k], b - A @ u, lower=True)
+            else:
+                u = u + spla.spsolve_triangular(self.U[k], b - A @ u, lower=False)
+        return u
+
+
+
+# Test twod_multigrid
+if __name__ == '__main__':
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble, twod_assemble_load
+    from twod_solve import twod_dirichlet, TwodSolver
+
+    r, s, w = twod_gauss(7)
+    f = lambda x,y: 2*np.pi**2*np.sin(np.pi*x)*np.sin(np.pi*y)
+
+    for etype, n0 in [('linear', 5), ('quadratic', 5)]:
+        meshes, P = twod_mesh_hierarchy(0, 1, 0, 1, etype, n0, n0, 5)
+        x, e_conn, index_b = meshes[-1]
+
+        # Prolongation reproduces linear functions exactly
+        x_c = meshes[-2][0]
+        assert np.allclose(P[-1] @ (x_c[:,0] + 2*x_c[:,1]), x[:,0] + 2*x[:,1])
+
+        A = twod_assemble(x, e_conn, r, s, w, 'stiffness')
+        F = twod_assemble_load(x, e_conn, r, s, w, f)
+        A, F = twod_dirichlet(A, F, index_b)
+        u = TwodSolver(A).solve(F)
+
+        for cycle in ['V', 'W', 'F']:
+            mg = TwodMultigrid(A, P, [m[2] for m in meshes], cycle=cycle)
+            assert np.abs(mg.solve(F) - u).max() < 1e-8 and len(mg.residuals) < 25
+
+        mg = TwodMultigrid(A, P, [m[2] for m in meshes], smoother='gauss_seidel')
+        assert np.abs(mg.solve(F) - u).max() < 1e-8
+
+        mg = TwodMultigrid(A, P, [m[2] for m in meshes])
+        solver = TwodSolver(A, 'cg', mg.aspreconditioner())
+        assert np.abs(solver.solve(F) - u).max() < 1e-8 and solver.info[-1] < 15
@@ -0,0 +1,135 @@
+
+import numpy as np
+from twod_shape_batch import twod_shape_batch
+from twod_assemble import _eval_kernel
+from twod_profile import twod_timed
+
+@twod_timed('norm')
+def twod_norm(x, e_conn, u, r, s, w, norm='l2', exact=None, kernel=None):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_norms.py - norms and errors of finite element functions, over all  #
+    #                  elements at once                                        #
+    #                                                                          #
+    #  twod_norm - one norm of u, or of the error u - exact                    #
+    #                                                                          #
+    #     'l2'      ||u||^2   = \int{ u^2 }                                    #
+    #     'h1'      |u|_1^2   = \int{ grad(u).grad(u) }                        #
+    #     'energy'  ||u||_a^2 = \int{ kernel*grad(u).grad(u) }                 #
+    #                                                                          #
+    #  Usage:    total, eta = twod_norm(x, e_conn, u, r, s, w, norm, exact,    #
+    #                                   kernel)                                #
+    #                                                                          #
+    #  Variables:     u                                                        #
+    #                        nodal values (dim: n_nodes)                       #
+    #                 r, s, w                                                  #
+    #                        quadrature rule, may be of higher order than the  #
+    #                        rule used for assembly                            #
+    #                 exact                                                    #
+    #                        (optional) u(x,y) for 'l2', or the gradient       #
+    #                        (u_x(x,y), u_y(x,y)) as one callable returning a  #
+    #                        pair for 'h1' and 'energy'                        #
+    #                 kernel                                                   #
+    #                        constant or kernel(x,y) of the energy norm        #
+    #                                                                          #
+    #                 total                                                    #
+    #                        sqrt(sum(eta^2))                                  #
+    #                 eta                                                      #
+    #                        element contributions (dim: n_elem)               #
+    #--------------------------------------------------------------------------#
+    '''
+    geometry = twod_shape_batch(x, e_conn, r, s, w)
+    return _norm(geometry, e_conn, u, norm, exact, kernel)
+
+
+def twod_errors(x, e_conn, u, r, s, w, u_ex=None, grad_ex=None, kernel=None):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_errors - L2, H1-seminorm and energy errors from one evaluation of  #
+    #                the geometry and basis                                    #
+    #                                                                          #
+    #  Usage:    errors = twod_errors(x, e_conn, u, r, s, w, u_ex, grad_ex,    #
+    #                                 kernel)                                  #
+    #                                                                          #
+    #  Variables:     u_ex, grad_ex                                            #
+    #                        exact solution and gradient as in twod_norm.      #
+    #                        Without them the norms of u are returned          #
+    #                 errors                                                   #
+    #                        dict of (total, eta) for 'l2', and for 'h1' and   #
+    #                        'energy' unless only u_ex is given                #
+    #--------------------------------------------------------------------------#
+    '''
+    geometry = twod_shape_batch(x, e_conn, r, s, w)
+    errors = {'l2': _norm(geometry, e_conn, u, 'l2', u_ex, None)}
+    if grad_ex is not None or u_ex is None:
+        errors['h1']     = _norm(geometry, e_conn, u, 'h1', grad_ex, None)
+        errors['energy'] = _norm(geometry, e_conn, u, 'energy', grad_ex, kernel)
+    return errors
+
+
+def _norm(geometry, e_conn, u, norm, exact, kernel):
+    x_g, w_g, phi, p_x, p_y, jac = geometry
+    u_e = np.asarray(u)[e_conn]
+
+    if norm == 'l2':
+        e_g = np.einsum('ei,gi->eg', u_e, phi[0])
+        if exact is not None:
+            e_g = e_g - exact(x_g[...,0], x_g[...,1])
+        eta2 = np.sum(w_g*e_g**2, axis=1)
+
+    elif norm in ('h1', 'energy'):
+        e_x = np.einsum('ei,egi->eg', u_e, p_x)
+        e_y = np.einsum('ei,egi->eg', u_e, p_y)
+        if exact is not None:
+            g_x, g_y = exact(x_g[...,0], x_g[...,1])
+            e_x = e_x - g_x
+            e_y = e_y - g_y
+        k = _eval_kernel(kernel, x_g) if norm == 'energy' else 1.
+        eta2 = np.sum(w_g*k*(e_x**2 + e_y**2), axis=1)
+
+    else:
+        raise Exception('twod_norm: {} is not a valid norm'.format(norm))
+
+    eta = np.sqrt(np.maximum(eta2, 0.))
+    return np.sqrt(eta2.sum()), eta
+
+
+
+# Test twod_norms
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble, twod_assemble_load
+    from twod_solve import twod_solve
+
+    u_ex = lambda x,y: np.sin(np.pi*x)*np.sin(np.pi*y)
+    grad_ex = lambda x,y: (np.pi*np.cos(np.pi*x)*np.sin(np.pi*y),
+                           np.pi*np.sin(np.pi*x)*np.cos(np.pi*y))
+    f = lambda x,y: 2*np.pi**2*u_ex(x,y)
+    r, s, w = twod_gauss(7)
+    r_h, s_h, w_h = twod_gauss(13)
+
+    # Norms of u_h agree with the quadratic forms of the assembled matrices
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'quadratic', 9, 9)
+    u = np.cos(x[:,0])*x[:,1]
+    errors = twod_errors(x, e_conn, u, r, s, w, kernel=lambda x,y: 1 + x)
+    M = twod_assemble(x, e_conn, r, s, w, 'mass')
+    K = twod_assemble(x, e_conn, r, s, w, 'stiffness')
+    K_a = twod_assemble(x, e_conn, r, s, w, 'stiffness', lambda x,y: 1 + x)
+    assert np.isclose(errors['l2'][0]**2, u @ M @ u)
+    assert np.isclose(errors['h1'][0]**2, u @ K @ u)
+    assert np.isclose(errors['energy'][0]**2, u @ K_a @ u)
+
+    # Convergence rates: O(h^{p+1}) in L2, O(h^p) in H1
+    for etype, p in [('linear', 1), ('quadratic', 2)]:
+        err = []
+        for n in [8, 16, 32]:
+            x, e_conn, index_b = twod_mesh(0, 1, 0, 1, etype, p*n+1, p*n+1)
+            A = twod_assemble(x, e_conn, r, s, w)
+            F = twod_assemble_load(x, e_conn, r, s, w, f)
+            u = twod_solve(A, F, index_b)
+            errors = twod_errors(x, e_conn, u, r_h, s_h, w_h, u_ex, grad_ex)
+            err.append([errors['l2'][0], errors['h1'][0]])
+            assert errors['l2'][1].shape == (e_conn.shape[0],)
+        rate = np.log2(np.array(err[:-1])/np.array(err[1:]))
+        assert np.all(np.abs(rate - [p+1, p]) < 0.15)
@@ -0,0 +1,153 @@
+
+import numpy as np
+from scipy.sparse.linalg import LinearOperator
+from twod_ref_basis import twod_ref_basis
+
+def twod_operator(x, e_conn, r, s, w, form='stiffness', kernel=None):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_operator.py - matrix-free global operator of                       #
+    #                     \int{ kernel*grad(phi).grad(test) }  (stiffness)     #
+    #                     \int{ kernel*phi*test }              (mass)          #
+    #                     \int{ (b.grad(phi))*test }           (advection)     #
+    #                                                                          #
+    #  Usage:    A = twod_operator(x, e_conn, r, s, w, form, kernel)           #
+    #            y = A @ u                                                     #
+    #                                                                          #
+    #  Variables:     x, e_conn                                                #
+    #                        Node coordinates and element connectivity of a    #
+    #                        straight-sided mesh                               #
+    #                 (r,s), w                                                 #
+    #                        Gauss points and weights on the unit triangle     #
+    #                 form, kernel                                             #
+    #                        as in twod_assemble                               #
+    #                                                                          #
+    #                 A                                                        #
+    #                        scipy LinearOperator (n_nodes, n_nodes), storing  #
+    #                        only per-element geometry and kernel values       #
+    #--------------------------------------------------------------------------#
+    '''
+    return TwodOperator(x, e_conn, r, s, w, form, kernel)
+
+
+class TwodOperator(LinearOperator):
+    '''
+    Matrix-free operator built by twod_operator.  Each product gathers the
+    nodal values through e_conn, contracts them with the cached reference
+    basis and the element geometry, and scatter-adds the result.
+    '''
+    def __init__(self, x, e_conn, r, s, w, form='stiffness', kernel=None):
+        if form not in ('stiffness', 'mass', 'advection'):
+            raise Exception('twod_operator: {} is not a valid form'.format(form))
+
+        n_nodes = x.shape[0]
+        n_dof   = e_conn.shape[1]
+        super().__init__(dtype=np.float64, shape=(n_nodes, n_nodes))
+        self.form   = form
+        self.e_conn = e_conn
+        self.ref    = twod_ref_basis(n_dof, r, s, w)
+
+        # Element geometry of the (r,s) -> (x,y) map
+        x_v = x[e_conn[:,:3],:]
+        c0  = x_v[:,0,:]
+        c1  = x_v[:,1,:] - c0
+        c2  = x_v[:,2,:] - c0
+        xr, yr = c1[:,0], c1[:,1]
+        xs, ys = c2[:,0], c2[:,1]
+        jac = xr*ys - yr*xs
+        self.rx, self.sx = ( ys/jac)[:,None], (-yr/jac)[:,None]
+        self.ry, self.sy = (-xs/jac)[:,None], ( xr/jac)[:,None]
+
+        # Kernel at the physical Gauss points folded into the weights
+        w_g = jac[:,None]*self.ref.w[None,:]
+        if callable(kernel):
+            x_g = c0[:,None,:] + c1[:,None,:]*self.ref.r[None,:,None] \
+                               + c2[:,None,:]*self.ref.s[None,:,None]
+            kernel = kernel(x_g[...,0], x_g[...,1])
+        if form == 'advection':
+            b_x, b_y = kernel
+            self.b_x = w_g*b_x
+            self.b_y = w_g*b_y
+            self.w_k = None
+        else:
+            self.w_k = w_g if kernel is None else w_g*kernel
+
+    def _matvec(self, u):
+        u   = np.asarray(u).reshape(-1)
+        u_e = u[self.e_conn]
+        ref = self.ref
+
+        if self.form == 'mass':
+            y_e = np.dot(self.w_k*np.dot(u_e, ref.phi.T), ref.phi)
+        else:
+            u_r = np.dot(u_e, ref.p_r.T)
+            u_s = np.dot(u_e, ref.p_s.T)
+            u_x = self.rx*u_r + self.sx*u_s
+            u_y = self.ry*u_r + self.sy*u_s
+            if self.form == 'stiffness':
+                a = self.w_k*u_x
+                b = self.w_k*u_y
+                y_e = np.dot(a*self.rx + b*self.ry, ref.p_r) \
+                    + np.dot(a*self.sx + b*self.sy, ref.p_s)
+            else:
+                y_e = np.dot(self.b_x*u_x + self.b_y*u_y, ref.phi)
+
+        return np.bincount(self.e_conn.ravel(), weights=y_e.ravel(),
+                           minlength=self.shape[0])
+
+    def _rmatvec(self, u):
+        if self.form != 'advection':
+            return self._matvec(u)
+        # (b.grad(phi_j), test_i)^T u = \int{ (sum_i u_i test_i) b.grad(phi_j) }
+        u   = np.asarray(u).reshape(-1)
+        ref = self.ref
+        u_g = np.dot(u[self.e_conn], ref.phi.T)
+        a = self.b_x*u_g
+        b = self.b_y*u_g
+        y_e = np.dot(a*self.rx + b*self.ry, ref.p_r) \
+            + np.dot(a*self.sx + b*self.sy, ref.p_s)
+        return np.bincount(self.e_conn.ravel(), weights=y_e.ravel(),
+                           minlength=self.shape[0])
+
+    def diagonal(self):
+        '''
+        Diagonal of the operator, e.g. for Jacobi preconditioning.
+        '''
+        ref = self.ref
+        if self.form == 'mass':
+            d_e = np.dot(self.w_k, ref.phi**2)
+        elif self.form == 'stiffness':
+            # p_x^2 + p_y^2 expanded in the products of p_r and p_s
+            a = self.rx**2 + self.ry**2
+            b = self.rx*self.sx + self.ry*self.sy
+            c = self.sx**2 + self.sy**2
+            d_e = np.dot(self.w_k*a, ref.p_r**2) + 2*np.dot(self.w_k*b, ref.p_r*ref.p_s) \
+                + np.dot(self.w_k*c, ref.p_s**2)
+        else:
+            p_x = ref.p_r[None]*self.rx[...,None] + ref.p_s[None]*self.sx[...,None]
+            p_y = ref.p_r[None]*self.ry[...,None] + ref.p_s[None]*self.sy[...,None]
+            d_e = np.einsum('eg,egi,gi->ei', self.b_x, p_x, ref.phi) \
+                + np.einsum('eg,egi,gi->ei', self.b_y, p_y, ref.phi)
+        return np.bincount(self.e_conn.ravel(), weights=d_e.ravel(),
+                           minlength=self.shape[0])
+
+
+
+# Test twod_operator
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble
+
+    x, e_conn, index_b = twod_mesh(0, 2, 0, 1, 'quadratic', 9, 5)
+    r, s, w = twod_gauss(7)
+    u = np.sin(x[:,0]) + x[:,1]**2
+
+    q = lambda x,y: 1 + x*y
+    b = lambda x,y: (y, -x)
+    for form, kernel in [('stiffness', q), ('mass', q), ('advection', b)]:
+        A = twod_assemble(x, e_conn, r, s, w, form, kernel)
+        A_op = twod_operator(x, e_conn, r, s, w, form, kernel)
+        assert np.allclose(A_op @ u, A @ u)
+        assert np.allclose(A_op.rmatvec(u), A.T @ u)
+        assert np.allclose(A_op.diagonal(), A.diagonal())
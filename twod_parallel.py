@@ -0,0 +1,235 @@
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+from multiprocessing import shared_memory
+from twod_shape_batch import twod_shape_batch
+from twod_bilinear import twod_element_matrices
+from twod_f_int import twod_f_int_batch
+from twod_assemble import AssemblyPlan, _eval_kernel
+
+def twod_assemble_parallel(x, e_conn, r, s, w, form='stiffness', kernel=None,
+                           n_workers=None, chunk_size=None, executor='thread',
+                           deterministic=True, plan=None):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_parallel.py - assembles the global sparse matrix of a form (see    #
+    #                     twod_assemble) with element chunks computed on a     #
+    #                     thread or process pool                               #
+    #                                                                          #
+    #  Usage:    A = twod_assemble_parallel(x, e_conn, r, s, w, form, kernel,  #
+    #                     n_workers, chunk_size, executor, deterministic, plan)#
+    #                                                                          #
+    #  Variables:     n_workers                                                #
+    #                        pool size (default: number of CPUs)               #
+    #                 chunk_size                                               #
+    #                        number of elements per task                       #
+    #                 executor                                                 #
+    #                        'thread' or 'process'.  With 'process', x, e_conn #
+    #                        and the element matrices live in shared memory    #
+    #                        and kernel must be picklable (no lambdas)         #
+    #                 deterministic                                            #
+    #                        if True the element matrices are summed in        #
+    #                        element order once all chunks are done, giving    #
+    #                        bitwise reproducible results.  If False each      #
+    #                        chunk is summed as soon as it completes           #
+    #                 plan                                                     #
+    #                        (optional) AssemblyPlan of e_conn                 #
+    #                                                                          #
+    #                 A                                                        #
+    #                        Global matrix in CSR format (n_nodes, n_nodes)    #
+    #--------------------------------------------------------------------------#
+    '''
+    n_elem, n_dof = e_conn.shape
+    if plan is None:
+        plan = AssemblyPlan(e_conn, x.shape[0])
+
+    out_shape = (n_elem, n_dof, n_dof)
+    data = _run(_matrix_chunk, x, e_conn, out_shape, (r, s, w, form, kernel),
+                n_workers, chunk_size, executor, deterministic,
+                plan.add, lambda vals: plan.add(None, vals))
+    return plan.matrix(data)
+
+
+def twod_assemble_load_parallel(x, e_conn, r, s, w, f, n_workers=None,
+                                chunk_size=None, executor='thread', deterministic=True):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_assemble_load_parallel - parallel counterpart of                   #
+    #                                twod_assemble_load                        #
+    #                                                                          #
+    #  Usage:    F = twod_assemble_load_parallel(x, e_conn, r, s, w, f, ...)   #
+    #--------------------------------------------------------------------------#
+    '''
+    n_elem, n_dof = e_conn.shape
+    n_nodes = x.shape[0]
+
+    def add(data, part, start):
+        conn = e_conn[start:start+part.shape[0]]
+        part = np.bincount(conn.ravel(), weights=part.ravel(), minlength=n_nodes)
+        if data is None:
+            return part
+        data += part
+        return data
+
+    return _run(_load_chunk, x, e_conn, (n_elem, n_dof), (r, s, w, f),
+                n_workers, chunk_size, executor, deterministic,
+                add, lambda vals: add(None, vals, 0))
+
+
+def _run(work, x, e_conn, out_shape, args, n_workers, chunk_size, executor,
+         deterministic, add, reduce):
+    '''
+    Runs work over element chunks writing into a shared element array, and
+    reduces it in element order (deterministic) or in completion order.
+    '''
+    n_elem = e_conn.shape[0]
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1024, -(-n_elem // (4*n_workers)))
+    starts = range(0, n_elem, chunk_size)
+
+    if executor == 'thread':
+        pool_type = ThreadPoolExecutor
+        shared = _SharedArrays(None)
+    elif executor == 'process':
+        pool_type = ProcessPoolExecutor
+        shared = _SharedArrays(shared_memory)
+    else:
+        raise Exception('twod_assemble_parallel: {} is not a valid executor'
+                        .format(executor))
+
+    with shared:
+        shared.put('x', x)
+        shared.put('e_conn', e_conn)
+        vals = shared.empty('vals', out_shape)
+        spec = shared.spec()
+
+        data = None
+        with pool_type(max_workers=n_workers) as pool:
+            futures = {pool.submit(work, spec, args, a, min(a + chunk_size, n_elem)): a
+                       for a in starts}
+            if deterministic:
+                for future in wait(futures).done:
+                    future.result()
+                data = reduce(vals)
+            else:
+                for future in as_completed(futures):
+                    a, b = future.result()
+                    data = add(data, vals[a:b], a)
+        if data is None:
+            data = reduce(vals)
+        del vals                             # release the shared buffer
+    return data
+
+
+def _matrix_chunk(spec, args, a, b):
+    r, s, w, form, kernel = args
+    with _Attached(spec) as arrays:
+        x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(arrays['x'], arrays['e_conn'][a:b], r, s, w)
+        arrays['vals'][a:b] = twod_element_matrices(form, _eval_kernel(kernel, x_g),
+                                                    w_g, phi, p_x, p_y)
+    return a, b
+
+
+def _load_chunk(spec, args, a, b):
+    r, s, w, f = args
+    with _Attached(spec) as arrays:
+        x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(arrays['x'], arrays['e_conn'][a:b], r, s, w)
+        arrays['vals'][a:b] = twod_f_int_batch(_eval_kernel(f, x_g)*np.ones_like(w_g),
+                                               phi[0], w_g)
+    return a, b
+
+
+class _SharedArrays:
+    '''
+    Named arrays handed to the workers: plain arrays for threads, shared
+    memory blocks (referenced by name, never pickled) for processes.
+    '''
+    def __init__(self, shm):
+        self.shm    = shm
+        self.arrays = {}
+        self.blocks = {}
+
+    def empty(self, name, shape, dtype=np.float64):
+        if self.shm is None:
+            self.arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            size  = max(1, int(np.prod(shape))*np.dtype(dtype).itemsize)
+            block = self.shm.SharedMemory(create=True, size=size)
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return self.arrays[name]
+
+    def put(self, name, a):
+        if self.shm is None:
+            self.arrays[name] = a
+        else:
+            self.empty(name, a.shape, a.dtype)[...] = a
+
+    def spec(self):
+        if self.shm is None:
+            return self.arrays
+        return {name: (self.blocks[name].name, a.shape, a.dtype.str)
+                for name, a in self.arrays.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+
+
+class _Attached:
+    '''
+    Worker-side view of the arrays described by _SharedArrays.spec().
+    '''
+    def __init__(self, spec):
+        self.spec   = spec
+        self.blocks = []
+
+    def __enter__(self):
+        arrays = {}
+        for name, item in self.spec.items():
+            if isinstance(item, np.ndarray):
+                arrays[name] = item
+            else:
+                block_name, shape, dtype = item
+                block = shared_memory.SharedMemory(name=block_name)
+                self.blocks.append(block)
+                arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        self.arrays = arrays
+        return arrays
+
+    def __exit__(self, *exc):
+        self.arrays = None
+        for block in self.blocks:
+            block.close()
+
+
+
+# Test twod_parallel
+def _q(x, y):
+    return 1 + x*y
+
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble, twod_assemble_load
+
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'quadratic', 41, 41)
+    r, s, w = twod_gauss(7)
+    A = twod_assemble(x, e_conn, r, s, w, 'stiffness', _q)
+    F = twod_assemble_load(x, e_conn, r, s, w, _q)
+
+    for executor in ['thread', 'process']:
+        A_p = twod_assemble_parallel(x, e_conn, r, s, w, 'stiffness', _q, n_workers=4,
+                                     chunk_size=256, executor=executor)
+        F_p = twod_assemble_load_parallel(x, e_conn, r, s, w, _q, n_workers=4,
+                                          chunk_size=256, executor=executor,
+                                          deterministic=False)
+        assert np.allclose((A_p - A).toarray(), 0.) and np.allclose(F_p, F)
@@ -1,80 +1,254 @@
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.tri import Triangulation
+
+# Node loop around the element boundary and linear sub-triangles of the
+# node lattice, by number of element nodes
+_LOOP = {3 : [0, 1, 2],
+         6 : [0, 3, 1, 4, 2, 5],
+         10: [0, 3, 4, 1, 5, 6, 2, 7, 8]}
 
-import matplotlib.pyplot as plt
+_SUB  = {3 : [[0, 1, 2]],
+         6 : [[0, 3, 5], [3, 1, 4], [5, 4, 2], [3, 4, 5]],
+         10: [[0, 3, 8], [3, 4, 9], [4, 1, 5], [8, 9, 7], [9, 5, 6], [7, 6, 2],
+              [3, 9, 8], [4, 5, 9], [9, 6, 7]]}
 
-def twod_plotm2(x,e_conn,symbol):
+def twod_plotm2(x,e_conn,symbol='',ax=None,fname=None,max_elems=None,color='b'):
     '''
     #-----------------------------------------------------------------------#
     #  twod_plotm2.m - Plots linear triagular mesh                          #
-    #                  (also works for quadratic straight sided elements)   #
+    #                  (also works for quadratic and cubic straight sided   #
+    #                  elements)                                            #
     #                                                                       #
     #  Copyright (c) 2001, Jeff Borggaard, Virginia Tech                    #
     #  Version: 1.0                                                         #
     #                                                                       #
-    #  Usage:    [] = twod_plotm2(n_fig,x,e_conn,symbol)                    #
+    #  Usage:    ax = twod_plotm2(x,e_conn,symbol,ax,fname,max_elems)       #
     #                                                                       #
-    #  Variables:     n_fig                                                 #
-    #                        Makes figure n_fig active                      #
-    #                 x                                                     #
+    #  Variables:     x                                                     #
     #                        Nodal coordinates                              #
     #                 e_conn                                                #
     #                        Element connectivity                           #
     #                 symbol                                                #
     #                        (optional) symbol for the nodes                #
+    #                 ax                                                    #
+    #                        (optional) axes to draw into                   #
+    #                 fname                                                 #
+    #                        (optional) file to write, without a display    #
+    #                 max_elems                                             #
+    #                        (optional) on larger meshes draw one element   #
+    #                        per cell of a grid of about max_elems cells    #
+    #                        over the domain, plus the mesh boundary (no    #
+    #                        nodes), i.e. a spatially even sample          #
     #                                                                       #
-    #  See twod_plotm1 for linear elements                                  #
+    #  All edges are drawn as one LineCollection, each shared edge once.    #
+    #  Without ax and fname the figure is shown with pyplot.                #
     #-----------------------------------------------------------------------#
     '''
     n_elems,ndof = e_conn.shape
-  
-    if ndof==6:
-        for i in range(n_elems):
-            plt.plot([x[e_conn[i,0],0], x[e_conn[i,3],0], x[e_conn[i,1],0],
-                 x[e_conn[i,4],0], x[e_conn[i,2],0], x[e_conn[i,5],0],x[e_conn[i,0],0]],
-                    [x[e_conn[i,0],1], x[e_conn[i,3],1], x[e_conn[i,1],1],
-                      x[e_conn[i,4],1], x[e_conn[i,2],1], x[e_conn[i,5],1],
-                        x[e_conn[i,0],1]],'b')
-
-    elif ndof==3:
-        for i in range(n_elems):
-            plt.plot([x[e_conn[i,0],0], x[e_conn[i,1],0],
-            x[e_conn[i,2],0], x[e_conn[i,0],0]],
-            [x[e_conn[i,0],1], x[e_conn[i,1],1], 
-            x[e_conn[i,2],1], x[e_conn[i,0],1]],'b')
-
-    n_nodes = max( x.shape );
-    for i in range(n_nodes):
-        plt.plot(x[i,0],x[i,1],symbol)
-        
-    plt.show()
+    if ndof not in _LOOP:
+        raise Exception('twod_plotm2: {} node elements are not supported'.format(ndof))
 
+    ax, fig = _axes(ax, fname)
+    sample = max_elems is not None and n_elems > max_elems
+    if sample:
+        # Sampled elements and the segments on the mesh boundary (used once)
+        seg, count = np.unique(_segments(e_conn, ndof), axis=0, return_counts=True)
+        seg = np.unique(np.concatenate((_segments(e_conn[_spread(x, e_conn, max_elems)], ndof),
+                                        seg[count == 1])), axis=0)
+    else:
+        seg = np.unique(_segments(e_conn, ndof), axis=0)
+    ax.add_collection(LineCollection(x[seg], colors=color, linewidths=0.5))
 
-# Test twod_plotm2
-import numpy as np
+    if symbol and not sample:
+        ax.plot(x[:,0], x[:,1], symbol, linestyle='none')
+
+    ax.autoscale_view()
+    ax.set_aspect('equal')
+    return _finish(ax, fig, fname)
+
+
+def twod_plotf(x,e_conn,u,kind='tripcolor',ax=None,fname=None,max_elems=None,
+               levels=20,cmap='viridis',mesh=False):
+    '''
+    #-----------------------------------------------------------------------#
+    #  twod_plotf - Plots a nodal solution field, quadratic and cubic       #
+    #               elements are split into linear sub-triangles through    #
+    #               their nodes                                             #
+    #                                                                       #
+    #  Usage:    ax = twod_plotf(x,e_conn,u,kind,ax,fname,max_elems)        #
+    #                                                                       #
+    #  Variables:     u                                                     #
+    #                        nodal values (dim: n_nodes)                    #
+    #                 kind                                                  #
+    #                        'tripcolor' (Gouraud shaded) or 'tricontourf'  #
+    #                 max_elems                                             #
+    #                        (optional) limit on drawn triangles, above it  #
+    #                        u is interpolated to a regular grid of at      #
+    #                        most max_elems triangles over the domain       #
+    #                 mesh                                                  #
+    #                        if True overlay the element edges              #
+    #-----------------------------------------------------------------------#
+    '''
+    n_elems,ndof = e_conn.shape
+    if ndof not in _SUB:
+        raise Exception('twod_plotf: {} node elements are not supported'.format(ndof))
+
+    ax, fig = _axes(ax, fname)
+    T, u = _field_tri(x, e_conn, u, max_elems)
+
+    if kind == 'tripcolor':
+        im = ax.tripcolor(T, u, shading='gouraud', cmap=cmap)
+    elif kind == 'tricontourf':
+        im = ax.tricontourf(T, u, levels=levels, cmap=cmap)
+    else:
+        raise Exception('twod_plotf: {} is not a valid plot kind'.format(kind))
+    ax.figure.colorbar(im, ax=ax)
+
+    if mesh:
+        twod_plotm2(x, e_conn, ax=ax, max_elems=max_elems, color='k')
+    ax.set_aspect('equal')
+    return _finish(ax, fig, fname)
+
+
+def _field_tri(x, e_conn, u, max_elems):
+    # Triangulation of the field: the linear sub-triangles, or a regular
+    # grid of at most max_elems triangles with u interpolated to its nodes
+    # (triangles with a node outside the mesh are masked)
+    n_elems, ndof = e_conn.shape
+    if max_elems is None or n_elems*len(_SUB[ndof]) <= max_elems:
+        return Triangulation(x[:,0], x[:,1], e_conn[:, _SUB[ndof]].reshape(-1, 3)), u
 
-x = np.array([[0.  , 0.  ],
-               [0.25, 0.  ],
-               [0.5 , 0.  ],
-               [0.75, 0.  ],
-               [1.  , 0.  ],
-               [0.  , 0.5 ],
-               [0.25, 0.5 ],
-               [0.5 , 0.5 ],
-               [0.75, 0.5 ],
-               [1.  , 0.5 ],
-               [0.  , 1.  ],
-               [0.25, 1.  ],
-               [0.5 , 1.  ],
-               [0.75, 1.  ],
-               [1.  , 1.  ]])
-
-e_conn = np.array([[ 0, 12, 10,  6, 11,  5],
-                   [ 0,  2, 12,  1,  7,  6],
-                   [ 2, 14, 12,  8, 13,  7],
-                   [ 2,  4, 14,  3,  9,  8]])
-
-    
+    from twod_locate import TwodLocator
+    lo = x.min(axis=0)
+    extent = x.max(axis=0) - lo
+    # 2 (n_x - 1)(n_y - 1) <= max_elems with cells about square
+    h = np.sqrt(2*extent[0]*extent[1]/max_elems) if extent.min() > 0 else extent.max()
+    n_x, n_y = [max(2, int(e/h) + 1) for e in extent]
+    while 2*(n_x - 1)*(n_y - 1) > max_elems and max(n_x, n_y) > 2:
+        n_x, n_y = max(2, n_x - 1), max(2, n_y - 1)
+    g_x, g_y = np.meshgrid(np.linspace(lo[0], lo[0] + extent[0], n_x),
+                           np.linspace(lo[1], lo[1] + extent[1], n_y))
+    p = np.column_stack((g_x.ravel(), g_y.ravel()))
+    v = TwodLocator(x, e_conn).interpolate(u, p)
 
+    k = (np.arange(n_y - 1)[:,None]*n_x + np.arange(n_x - 1)[None,:]).ravel()
+    tri = np.concatenate((np.column_stack((k, k + 1, k + n_x + 1)),
+                          np.column_stack((k, k + n_x + 1, k + n_x))))
+    T = Triangulation(p[:,0], p[:,1], tri)
+    outside = np.isnan(v)
+    if outside.any():
+        T.set_mask(outside[tri].any(axis=1))
+        v = np.where(outside, 0., v)
+    return T, v
+
+
+def _axes(ax, fname):
+    # Headless Agg figure when writing to a file, pyplot otherwise
+    if ax is not None:
+        return ax, None
+    if fname is not None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        return fig.add_subplot(), fig
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    return fig.add_subplot(), fig
+
+
+def _segments(e_conn, ndof):
+    # Edge segments (lower node first) between consecutive boundary loop
+    # nodes of every element
+    loop = e_conn[:, _LOOP[ndof]]
+    a = loop.ravel()
+    b = np.roll(loop, -1, axis=1).ravel()
+    return np.column_stack((np.minimum(a, b), np.maximum(a, b)))
+
+
+def _spread(x, e_conn, max_elems):
+    # One element per cell of a k x k grid (k^2 <= max_elems) over the
+    # bounding box, binned by centroid
+    k = max(1, int(np.sqrt(max_elems)))
+    c = x[e_conn[:,:3],:].mean(axis=1)
+    lo = c.min(axis=0)
+    extent = np.maximum(c.max(axis=0) - lo, np.finfo(float).tiny)
+    ij = np.minimum(((c - lo)/extent*k).astype(np.int64), k - 1)
+    _, keep = np.unique(ij[:,0]*k + ij[:,1], return_index=True)
+    return keep
+
+
+def _finish(ax, fig, fname):
+    if fig is None:
+        return ax
+    if fname is not None:
+        fig.savefig(fname, dpi=200)
+    else:
+        import matplotlib.pyplot as plt
+        plt.show()
+    return ax
+
+
+
+# Test twod_plotm2
 if __name__ == '__main__':
-    twod_plotm2(x, e_conn, 'go')
-    
-    
+    import os, tempfile
+    from twod_mesh import twod_mesh
+
+    x = np.array([[0.  , 0.  ],
+                   [0.25, 0.  ],
+                   [0.5 , 0.  ],
+                   [0.75, 0.  ],
+                   [1.  , 0.  ],
+                   [0.  , 0.5 ],
+                   [0.25, 0.5 ],
+                   [0.5 , 0.5 ],
+                   [0.75, 0.5 ],
+                   [1.  , 0.5 ],
+                   [0.  , 1.  ],
+                   [0.25, 1.  ],
+                   [0.5 , 1.  ],
+                   [0.75, 1.  ],
+                   [1.  , 1.  ]])
+
+    e_conn = np.array([[ 0, 12, 10,  6, 11,  5],
+                       [ 0,  2, 12,  1,  7,  6],
+                       [ 2, 14, 12,  8, 13,  7],
+                       [ 2,  4, 14,  3,  9,  8]])
+
+    path = tempfile.mkdtemp()
+    ax = twod_plotm2(x, e_conn, 'go', fname=os.path.join(path, 'mesh.png'))
+    # 4 elements with 6 segments each, 3 edges of 2 segments shared
+    assert len(ax.collections[0].get_segments()) == 18
+
+    for etype, n in [('linear', 201), ('quadratic', 101), ('cubic', 31)]:
+        x, e_conn, index_b = twod_mesh(0, 1, 0, 1, etype, n, n)
+        u = np.sin(np.pi*x[:,0])*np.cos(np.pi*x[:,1])
+        twod_plotm2(x, e_conn, fname=os.path.join(path, etype + '_mesh.png'),
+                    max_elems=20000)
+        for kind in ['tripcolor', 'tricontourf']:
+            twod_plotf(x, e_conn, u, kind, fname=os.path.join(path, etype + kind + '.png'))
+        assert os.path.getsize(os.path.join(path, etype + '_mesh.png')) > 0
+
+    # Sampled meshes are spread over the domain, with the whole boundary
+    x, e_conn, index_b = twod_mesh(0, 2, 0, 1, 'quadratic', 201, 101)
+    keep = _spread(x, e_conn, 400)
+    c = x[e_conn[keep,:3]].mean(axis=1)
+    assert len(keep) <= 400 and len(keep) > 300
+    assert np.all(c.min(axis=0) < [0.1, 0.05]) and np.all(c.max(axis=0) > [1.9, 0.95])
+    ax = twod_plotm2(x, e_conn, 'go', fname=os.path.join(path, 'sample.png'), max_elems=400)
+    seg = ax.collections[0].get_segments()
+    assert len(seg) <= 6*len(keep) + 2*len(index_b) and len(ax.lines) == 0
+    on_bnd = lambda p: np.isclose(p[:,0], 0) | np.isclose(p[:,0], 2) | \
+                       np.isclose(p[:,1], 0) | np.isclose(p[:,1], 1)
+    bnd = [s for s in seg if on_bnd(s).all() and (np.isclose(s[0], s[1]).any())]
+    assert np.isclose(sum(np.linalg.norm(s[1] - s[0]) for s in bnd), 6.)
+
+    # Field plots of large meshes draw at most max_elems triangles
+    x, e_conn, index_b = twod_mesh(0, 2, 0, 1, 'linear', 201, 101)
+    u = np.sin(np.pi*x[:,0])*x[:,1]
+    T, v = _field_tri(x, e_conn, u, 5000)
+    assert len(T.triangles) <= 5000 and len(T.triangles) > 4000
+    assert np.allclose(v, np.sin(np.pi*T.x)*T.y, atol=1e-3)
+    twod_plotf(x, e_conn, u, fname=os.path.join(path, 'coarse.png'), max_elems=5000)
@@ -0,0 +1,120 @@
+
+import numpy as np
+from collections import namedtuple
+
+TwodPrecision = namedtuple('TwodPrecision', ['index', 'geometry'])
+TwodPrecision.__doc__ = '''
+    Mesh storage precision: integer type of e_conn/index_b and float type of
+    the node coordinates x.
+    '''
+
+PRECISIONS = {'double': TwodPrecision(np.int64, np.float64),
+              'mixed' : TwodPrecision(np.int32, np.float32)}
+
+def twod_precision(policy='mixed'):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_precision.py - storage precision of meshes                         #
+    #                                                                          #
+    #  twod_precision - the TwodPrecision of a policy name                     #
+    #                                                                          #
+    #     'double'  int64 indices, float64 coordinates                         #
+    #     'mixed'   int32 indices, float32 coordinates                         #
+    #                                                                          #
+    #  Usage:    prec = twod_precision(policy)                                 #
+    #                                                                          #
+    #  The policy only sets how twod_cast stores the mesh.  Downstream, the    #
+    #  batched routines (twod_shape_batch, twod_element_matrices,              #
+    #  twod_f_int_batch) compute in the precision of x, and the assembly       #
+    #  routines always sum into float64 global matrices and load vectors, so   #
+    #  a float32 mesh gives float32 element data and a float64 system.         #
+    #  float32 coordinates carry an absolute error of about 6e-8 |x|, i.e. a   #
+    #  relative error of 6e-8 |x|/h in the element Jacobians, which must stay  #
+    #  below the discretization error.                                         #
+    #--------------------------------------------------------------------------#
+    '''
+    if isinstance(policy, TwodPrecision):
+        return policy
+    if policy not in PRECISIONS:
+        raise Exception('twod_precision: {} is not a valid policy'.format(policy))
+    return PRECISIONS[policy]
+
+
+def twod_cast(x, e_conn, index_b=None, policy='mixed', *arrays):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_cast - casts a mesh to a precision policy                          #
+    #                                                                          #
+    #  Usage:    x, e_conn, index_b = twod_cast(x, e_conn, index_b, policy)    #
+    #            x, e_conn, index_b, e_bnd = twod_cast(x, e_conn, index_b,     #
+    #                                                  policy, e_bnd)          #
+    #                                                                          #
+    #  Variables:     arrays                                                   #
+    #                        further index arrays (e.g. e_bnd) to cast         #
+    #                                                                          #
+    #  Indices stay int64 if the mesh has 2^31 or more nodes.                  #
+    #--------------------------------------------------------------------------#
+    '''
+    prec = twod_precision(policy)
+    index = prec.index
+    if np.iinfo(index).max < x.shape[0]:
+        index = np.int64
+    out = [np.asarray(x).astype(prec.geometry, copy=False),
+           np.asarray(e_conn).astype(index, copy=False),
+           None if index_b is None else np.asarray(index_b).astype(index, copy=False)]
+    out += [np.asarray(a).astype(index, copy=False) for a in arrays]
+    return tuple(out)
+
+
+def twod_nbytes(*arrays):
+    '''
+    Total memory of the given arrays in bytes (None entries are skipped).
+    '''
+    return sum(a.nbytes for a in arrays if a is not None)
+
+
+
+# Test twod_precision
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_shape_batch import twod_shape_batch
+    from twod_bilinear import twod_element_matrices
+    from twod_assemble import twod_assemble, twod_assemble_load, AssemblyPlan
+    from twod_solve import twod_solve
+    from twod_norms import twod_norm
+
+    u_ex = lambda x,y: np.sin(np.pi*x)*np.sin(np.pi*y)
+    q    = lambda x,y: 1 + x*y
+    # -div(q grad u) with grad q = (y, x)
+    f    = lambda x,y: (2*np.pi**2*q(x,y)*u_ex(x,y)
+                        - np.pi*(y*np.cos(np.pi*x)*np.sin(np.pi*y)
+                                 + x*np.sin(np.pi*x)*np.cos(np.pi*y)))
+    r, s, w = twod_gauss(7)
+
+    for etype, n in [('linear', 129), ('quadratic', 33)]:
+        mesh = {p: twod_cast(*twod_mesh(0, 1, 0, 1, etype, n, n), policy=p)
+                for p in PRECISIONS}
+        x, e_conn, index_b = mesh['mixed']
+        assert x.dtype == np.float32 and e_conn.dtype == np.int32
+        assert 2*twod_nbytes(*mesh['mixed']) == twod_nbytes(*mesh['double'])
+
+        # float32 element data, float64 global system
+        x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, e_conn, r, s, w)
+        A_e = twod_element_matrices('stiffness', q(x_g[...,0], x_g[...,1]), w_g, phi, p_x, p_y)
+        assert p_x.dtype == np.float32 and A_e.dtype == np.float32
+        assert AssemblyPlan(e_conn, x.shape[0]).assemble(A_e).dtype == np.float64
+
+        u = {}
+        for p, (x, e_conn, index_b) in mesh.items():
+            A = twod_assemble(x, e_conn, r, s, w, 'stiffness', q)
+            F = twod_assemble_load(x, e_conn, r, s, w, f)
+            assert A.dtype == np.float64 and F.dtype == np.float64
+            u[p] = twod_solve(A, F, index_b)
+
+        # The mixed solution differs from the double one far below the
+        # discretization error
+        x, e_conn, index_b = mesh['double']
+        err, _  = twod_norm(x, e_conn, u['double'], r, s, w, 'l2', u_ex)
+        diff, _ = twod_norm(x, e_conn, u['mixed'] - u['double'], r, s, w, 'l2')
+        assert diff < 1e-2*err
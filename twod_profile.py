@@ -0,0 +1,185 @@
+
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Profile receiving the timings, None while profiling is off
+_ACTIVE = None
+_NULL   = nullcontext()
+
+class TwodProfile:
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_profile.py - opt-in per-stage timers and counters.  Library        #
+    #                    routines wrap their stages in twod_timer(name) and    #
+    #                    report sizes with twod_count(name, n); both do        #
+    #                    nothing unless a TwodProfile is active                #
+    #                                                                          #
+    #  Usage:    with TwodProfile() as prof:                                   #
+    #                A = twod_assemble(x, e_conn, r, s, w)                     #
+    #            print(prof.report())                                          #
+    #                                                                          #
+    #            prof = twod_profile_enable()      (whole run)                 #
+    #            ...                                                           #
+    #            twod_profile_disable()                                        #
+    #                                                                          #
+    #  Variables:     timers                                                   #
+    #                        name -> [calls, total seconds, max seconds]       #
+    #                 counters                                                 #
+    #                        name -> accumulated count                         #
+    #                                                                          #
+    #  Stage names are dotted, e.g. 'assemble.shape', 'assemble.scatter',      #
+    #  'solve.setup'.  Whole routines are timed with the twod_timed            #
+    #  decorator: 'mesh', 'reorder', 'locate', 'norm', 'adapt.estimate' and    #
+    #  'adapt.refine'.  Timers nest, a stage's time includes its children.     #
+    #--------------------------------------------------------------------------#
+    '''
+    def __init__(self):
+        self.timers   = {}
+        self.counters = {}
+        self._outer   = None
+
+    def __enter__(self):
+        self._outer = twod_profile_enable(self)
+        return self
+
+    def __exit__(self, *exc):
+        global _ACTIVE
+        _ACTIVE = self._outer
+        self._outer = None
+        return False
+
+    def add(self, name, seconds):
+        t = self.timers.get(name)
+        if t is None:
+            self.timers[name] = [1, seconds, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            t[2]  = max(t[2], seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        '''
+        Timings and counters as plain (JSON serializable) dictionaries.
+        '''
+        return {'timers'  : {k: {'calls': c, 'total': t, 'max': m}
+                             for k, (c, t, m) in self.timers.items()},
+                'counters': dict(self.counters)}
+
+    def report(self):
+        '''
+        Table of the timers (sorted by name, so children follow their
+        parent) and counters.
+        '''
+        lines = ['{:<28s} {:>8s} {:>12s} {:>12s}'.format('stage', 'calls', 'total [s]', 'max [s]')]
+        for name in sorted(self.timers):
+            c, t, m = self.timers[name]
+            lines.append('{:<28s} {:>8d} {:>12.6f} {:>12.6f}'.format(name, c, t, m))
+        for name in sorted(self.counters):
+            lines.append('{:<28s} {:>8d}'.format(name, self.counters[name]))
+        return '\n'.join(lines)
+
+
+def twod_profile_enable(profile=None):
+    '''
+    Makes profile (a new TwodProfile if None) the active profile and returns
+    the previously active one (None if profiling was off).
+    '''
+    global _ACTIVE
+    outer = _ACTIVE
+    _ACTIVE = TwodProfile() if profile is None else profile
+    return outer
+
+
+def twod_profile_disable():
+    '''
+    Turns profiling off and returns the profile that was active.
+    '''
+    global _ACTIVE
+    profile, _ACTIVE = _ACTIVE, None
+    return profile
+
+
+def twod_profile():
+    '''
+    The active TwodProfile, or None.
+    '''
+    return _ACTIVE
+
+
+def twod_timer(name):
+    '''
+    Context manager adding the wall time of its block to stage name of the
+    active profile (a shared no-op context when profiling is off).
+    '''
+    if _ACTIVE is None:
+        return _NULL
+    return _timed(_ACTIVE, name)
+
+
+@contextmanager
+def _timed(profile, name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - t0)
+
+
+def twod_count(name, n=1):
+    '''
+    Adds n to counter name of the active profile.
+    '''
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, n)
+
+
+def twod_timed(name):
+    '''
+    Decorator timing every call of a function as stage name.
+    '''
+    def decorate(func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            with twod_timer(name):
+                return func(*args, **kwargs)
+        return timed
+    return decorate
+
+
+
+# Test twod_profile
+if __name__ == '__main__':
+    import json
+
+    @twod_timed('outer')
+    def work(n):
+        with twod_timer('outer.inner'):
+            time.sleep(1e-3)
+        twod_count('items', n)
+
+    # Off by default: nothing is recorded
+    assert twod_profile() is None and twod_timer('x') is _NULL
+    work(3)
+
+    with TwodProfile() as prof:
+        for k in range(4):
+            work(k)
+        with TwodProfile() as inner:
+            work(10)
+        assert twod_profile() is prof
+    assert twod_profile() is None
+
+    assert prof.timers['outer'][0] == 4 and prof.counters['items'] == 6
+    assert prof.timers['outer'][1] >= prof.timers['outer.inner'][1] >= 4e-3
+    assert inner.counters['items'] == 10 and inner.timers['outer'][0] == 1
+    assert json.loads(json.dumps(prof.as_dict()))['timers']['outer']['calls'] == 4
+    assert prof.report().splitlines()[1].startswith('outer ')
+
+    prof = TwodProfile()
+    assert twod_profile_enable(prof) is None
+    work(1)
+    assert twod_profile_disable() is prof and prof.counters['items'] == 1
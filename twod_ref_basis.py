@@ -0,0 +1,343 @@
+
+import numpy as np
+from collections import OrderedDict, namedtuple
+
+RefBasis = namedtuple('RefBasis', ['n_dof', 'r', 's', 'w', 'phi', 'p_r', 'p_s'])
+RefBasis.__doc__ = '''
+    Reference-element basis table: shape functions phi and their (r,s)
+    derivatives p_r, p_s at the Gauss points (r,s) with weights w, each
+    of dim (n_gauss, n_dof).  Edge tables have s, p_r and p_s set to None.
+    All arrays are read-only.
+    '''
+
+
+class RefBasisCache:
+    '''
+    #-----------------------------------------------------------------------------#
+    #  RefBasisCache - least-recently-used cache of reference basis tables,       #
+    #                  keyed by (element type, quadrature rule).                  #
+    #                                                                             #
+    #  Usage:    cache = RefBasisCache(maxsize)                                   #
+    #            ref   = cache.tri(n_dof, r, s, w, dtype)                         #
+    #            ref   = cache.edge(n_dof, r, w)                                  #
+    #            cache.evict(kind, n_dof)                                         #
+    #            cache.clear()                                                    #
+    #                                                                             #
+    #  Variables:     maxsize                                                     #
+    #                        Number of tables kept before the least recently      #
+    #                        used one is evicted (None for unbounded)             #
+    #                 kind                                                        #
+    #                        'tri' or 'edge' (None matches both)                  #
+    #                 n_dof                                                       #
+    #                        Number of element nodes (None matches all)           #
+    #                 dtype                                                       #
+    #                        float type of the table, float32 tables are cast     #
+    #                        once from the cached float64 one                     #
+    #-----------------------------------------------------------------------------#
+    '''
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits    = 0
+        self.misses  = 0
+        self._tables = OrderedDict()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def tri(self, n_dof, r, s, w, dtype=np.float64):
+        r = np.asarray(r, dtype=float)
+        s = np.asarray(s, dtype=float)
+        w = np.asarray(w, dtype=float)
+        dtype = np.dtype(dtype)
+        key = ('tri', n_dof, r.tobytes(), s.tobytes(), w.tobytes(), dtype.str)
+        ref = self._lookup(key)
+        if ref is None:
+            if dtype == np.float64:
+                phi, p_r, p_s = _tri_shape(r, s, n_dof)
+                ref = RefBasis(n_dof, *_frozen(r, s, w, phi, p_r, p_s))
+            else:
+                ref = self.tri(n_dof, r, s, w)
+                ref = RefBasis(n_dof, *_frozen(*ref[1:], dtype=dtype))
+            ref = self._insert(key, ref)
+        return ref
+
+    def edge(self, n_dof, r, w):
+        r = np.asarray(r, dtype=float)
+        w = np.asarray(w, dtype=float)
+        key = ('edge', n_dof, r.tobytes(), w.tobytes())
+        ref = self._lookup(key)
+        if ref is None:
+            r, w, phi = _frozen(r, w, _edge_shape(r, n_dof))
+            ref = self._insert(key, RefBasis(n_dof, r, None, w, phi, None, None))
+        return ref
+
+    def evict(self, kind=None, n_dof=None):
+        '''
+        Drop every table matching kind and n_dof, return the number dropped.
+        '''
+        keys = [key for key in self._tables
+                if (kind is None or key[0] == kind) and (n_dof is None or key[1] == n_dof)]
+        for key in keys:
+            del self._tables[key]
+        return len(keys)
+
+    def clear(self):
+        self._tables.clear()
+        self.hits   = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        ref = self._tables.get(key)
+        if ref is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._tables.move_to_end(key)
+        return ref
+
+    def _insert(self, key, ref):
+        self._tables[key] = ref
+        if self.maxsize is not None:
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+        return ref
+
+
+# Module-wide cache shared by twod_shape, twod_shape_batch and twod_edge_shape
+ref_cache = RefBasisCache()
+
+def twod_ref_basis(n_dof, r, s, w, dtype=np.float64):
+    '''
+    #-----------------------------------------------------------------------------#
+    #  twod_ref_basis.py - returns the (cached) table of shape functions and      #
+    #                      their (r,s) derivatives on the unit triangle           #
+    #                                                                             #
+    #  Usage:    ref = twod_ref_basis(n_dof, r, s, w, dtype)                      #
+    #                                                                             #
+    #  Variables:     n_dof                                                       #
+    #                        Number of element nodes (3, 6, 7 or 10)              #
+    #                 (r,s)                                                       #
+    #                        Coordinates of Gauss points in unit triangle         #
+    #                 w                                                           #
+    #                        Gauss weights associated with (r,s)                  #
+    #                 dtype                                                       #
+    #                        float type of the table (e.g. np.float32)            #
+    #                                                                             #
+    #                 ref                                                         #
+    #                        RefBasis with read-only phi, p_r, p_s                #
+    #                        (dim: n_gauss, n_dof)                                #
+    #-----------------------------------------------------------------------------#
+    '''
+    return ref_cache.tri(n_dof, r, s, w, dtype)
+
+
+def twod_ref_edge_basis(n_dof, r, w):
+    '''
+    #-----------------------------------------------------------------------------#
+    #  twod_ref_edge_basis - returns the (cached) table of edge shape functions   #
+    #                        on the reference interval [-1,1]                     #
+    #                                                                             #
+    #  Usage:    ref = twod_ref_edge_basis(n_dof, r, w)                           #
+    #                                                                             #
+    #  Variables:     n_dof                                                       #
+    #                        Number of edge nodes (2, 3 or 4)                     #
+    #                 r, w                                                        #
+    #                        Gauss nodes and weights on [-1,1]                    #
+    #-----------------------------------------------------------------------------#
+    '''
+    return ref_cache.edge(n_dof, r, w)
+
+
+def twod_ref_eval(n_dof, r, s):
+    '''
+    #-----------------------------------------------------------------------------#
+    #  twod_ref_eval - shape functions and their (r,s) derivatives at arbitrary   #
+    #                  points of the unit triangle (not cached)                   #
+    #                                                                             #
+    #  Usage:    phi, p_r, p_s = twod_ref_eval(n_dof, r, s)                       #
+    #                                                                             #
+    #  Variables:     (r,s)                                                       #
+    #                        Reference coordinates of the points (dim: n_pts)     #
+    #                 phi, p_r, p_s                                               #
+    #                        (dim: n_pts, n_dof)                                  #
+    #-----------------------------------------------------------------------------#
+    '''
+    r = np.asarray(r, dtype=float).ravel()
+    s = np.asarray(s, dtype=float).ravel()
+    return _tri_shape(r, s, n_dof)
+
+
+def _frozen(*arrays, dtype=float):
+    frozen = []
+    for a in arrays:
+        a = np.array(a, dtype=dtype)
+        a.flags.writeable = False
+        frozen.append(a)
+    return frozen
+
+
+def _tri_shape(r, s, n):
+    '''
+    Shape functions and their (r,s) derivatives on the unit triangle,
+    each of dim (n_gauss, n).
+    '''
+    rule = len(r)
+    if n == 3:
+        phi = np.zeros((rule,n))
+        phi[:,0] = 1. - r  - s
+        phi[:,1] =      r
+        phi[:,2] =           s
+
+        p_r = np.zeros((rule,n))
+        p_r[:,0] = -1.
+        p_r[:,1] =  1.
+
+        p_s = np.zeros((rule,n))
+        p_s[:,0] = -1.
+        p_s[:,2] =  1.
+
+    elif n == 6:
+        phi = np.zeros((rule,n))
+        phi[:,0] = 1. - 3.*r - 3.*s + 2.*r*r + 4.*r*s + 2.*s*s
+        phi[:,1] =    - 1.*r        + 2.*r*r
+        phi[:,2] =           - 1.*s                     + 2.*s*s
+        phi[:,3] =      4.*r        - 4.*r*r - 4.*r*s
+        phi[:,4] =                              4.*r*s
+        phi[:,5] =             4.*s           - 4.*r*s - 4.*s*s
+
+        p_r = np.zeros((rule,n))
+        p_r[:,0] = -3. + 4.*r + 4.*s
+        p_r[:,1] = -1. + 4.*r
+        p_r[:,3] =  4. - 8.*r - 4.*s
+        p_r[:,4] =              4.*s
+        p_r[:,5] =            - 4.*s
+
+        p_s = np.zeros((rule,n))
+        p_s[:,0] = -3. + 4.*r + 4.*s
+        p_s[:,2] = -1.        + 4.*s
+        p_s[:,3] =     - 4.*r
+        p_s[:,4] =       4.*r
+        p_s[:,5] =  4. - 4.*r - 8.*s
+
+    elif n == 7:
+        phi = np.zeros((rule,n))
+        phi[:,0] = (1-r-s)*(2.*(1-r-s)-1) +  3.*(1.-r-s)*r*s
+        phi[:,1] = r*(2.*r-1)             +  3.*(1.-r-s)*r*s
+        phi[:,2] = s*(2.*s-1)             +  3.*(1.-r-s)*r*s
+        phi[:,3] = 4.*(1-r-s)*r           - 12.*(1.-r-s)*r*s
+        phi[:,4] = 4.*r*s                 - 12.*(1.-r-s)*r*s
+        phi[:,5] = 4.*s*(1-r-s)           - 12.*(1.-r-s)*r*s
+        phi[:,6] = 27.*(1-r-s)*r*s
+
+        p_r = np.zeros((rule,n))
+        p_r[:,0] = -3 + 4.*r + 7.*s - 6.*r*s - 3.*(s**2)
+        p_r[:,1] = -1 + 4.*r + 3.*s - 6.*r*s - 3.*(s**2)
+        p_r[:,2] =             3.*s - 6.*r*s - 3.*(s**2)
+        p_r[:,3] =  4 - 8.*r -16.*s +24.*r*s +12.*(s**2)
+        p_r[:,4] =           - 8.*s +24.*r*s +12.*(s**2)
+        p_r[:,5] =           -16.*s +24.*r*s +12.*(s**2)
+        p_r[:,6] =            27.*s -54.*r*s -27.*(s**2)
+
+        p_s = np.zeros((rule,n))
+        p_s[:,0] = -3 + 7.*r + 4.*s - 6.*r*s - 3.*(r**2)
+        p_s[:,1] =      3.*r        - 6.*r*s - 3.*(r**2)
+        p_s[:,2] = -1 + 3.*r + 4.*s - 6.*r*s - 3.*(r**2)
+        p_s[:,3] =    -16.*r        +24.*r*s +12.*(r**2)
+        p_s[:,4] =    - 8.*r        +24.*r*s +12.*(r**2)
+        p_s[:,5] =  4 -16.*r - 8.*s +24.*r*s +12.*(r**2)
+        p_s[:,6] =     27.*r        -54.*r*s -27.*(r**2)
+
+    elif n == 10:
+        # Cubic element in barycentric coordinates l1, l2, l3: vertices,
+        # two nodes on each edge 0-1, 1-2, 2-0 (nearest the first vertex
+        # first), centroid
+        l1 = 1. - r - s;  l2 = r;  l3 = s
+
+        phi = np.zeros((rule,n))
+        phi[:,0] = 0.5*l1*(3.*l1-1.)*(3.*l1-2.)
+        phi[:,1] = 0.5*l2*(3.*l2-1.)*(3.*l2-2.)
+        phi[:,2] = 0.5*l3*(3.*l3-1.)*(3.*l3-2.)
+        phi[:,3] = 4.5*l1*l2*(3.*l1-1.)
+        phi[:,4] = 4.5*l1*l2*(3.*l2-1.)
+        phi[:,5] = 4.5*l2*l3*(3.*l2-1.)
+        phi[:,6] = 4.5*l2*l3*(3.*l3-1.)
+        phi[:,7] = 4.5*l3*l1*(3.*l3-1.)
+        phi[:,8] = 4.5*l3*l1*(3.*l1-1.)
+        phi[:,9] = 27.*l1*l2*l3
+
+        # Derivatives with respect to l1, l2, l3
+        d1 = np.zeros((rule,n));  d2 = np.zeros((rule,n));  d3 = np.zeros((rule,n))
+        d1[:,0] = 0.5*(27.*l1**2 - 18.*l1 + 2.)
+        d2[:,1] = 0.5*(27.*l2**2 - 18.*l2 + 2.)
+        d3[:,2] = 0.5*(27.*l3**2 - 18.*l3 + 2.)
+        d1[:,3] = 4.5*l2*(6.*l1-1.);  d2[:,3] = 4.5*l1*(3.*l1-1.)
+        d1[:,4] = 4.5*l2*(3.*l2-1.);  d2[:,4] = 4.5*l1*(6.*l2-1.)
+        d2[:,5] = 4.5*l3*(6.*l2-1.);  d3[:,5] = 4.5*l2*(3.*l2-1.)
+        d2[:,6] = 4.5*l3*(3.*l3-1.);  d3[:,6] = 4.5*l2*(6.*l3-1.)
+        d3[:,7] = 4.5*l1*(6.*l3-1.);  d1[:,7] = 4.5*l3*(3.*l3-1.)
+        d3[:,8] = 4.5*l1*(3.*l1-1.);  d1[:,8] = 4.5*l3*(6.*l1-1.)
+        d1[:,9] = 27.*l2*l3;  d2[:,9] = 27.*l1*l3;  d3[:,9] = 27.*l1*l2
+
+        p_r = d2 - d1
+        p_s = d3 - d1
+
+    else:
+        raise Exception('Elements with {} interior nodes are not currently supported'
+                       .format(n))
+    return phi, p_r, p_s
+
+
+def _edge_shape(r, n):
+    '''
+    Shape functions on the reference edge, dim (n_gauss, n).
+    '''
+    rule = len(r)
+    if n == 2:
+        # Linear element
+        phi = np.zeros((rule, n))
+        phi[:,0] = (1 - r)/2
+        phi[:,1] = (1 + r)/2
+
+    elif n == 3:
+        # Quadratic element
+        phi = np.zeros((rule, n))
+        phi[:,0] = 0.5*r*(r-1)
+        phi[:,1] = 0.5*r*(r+1)
+        phi[:,2] = -(r+1)*(r-1)
+
+    elif n == 4:
+        # Cubic element, nodes at r = -1, 1, -1/3, 1/3
+        phi = np.zeros((rule,n))
+        phi[:,0] =  -9/16*(r+1/3)*(r-1/3)*(r-1)
+        phi[:,1] =   9/16*(r+1)*(r+1/3)*(r-1/3)
+        phi[:,2] =  27/16*(r+1)*(r-1/3)*(r-1)
+        phi[:,3] = -27/16*(r+1)*(r+1/3)*(r-1)
+
+    else:
+        raise Exception('Only linear, quadratic, and cubic elements are supported')
+    return phi
+
+
+
+# Test twod_ref_basis
+if __name__ == '__main__':
+    from twod_gauss import twod_gauss
+
+    r, s, w = twod_gauss(7)
+    ref = twod_ref_basis(6, r, s, w)
+    assert twod_ref_basis(6, r, s, w) is ref and ref_cache.hits == 1
+    assert np.allclose(ref.phi.sum(axis=1), 1.) and np.allclose(ref.p_r.sum(axis=1), 0.)
+
+    # Cubic element: nodal basis
+    r_n = [0, 1, 0, 1/3, 2/3, 2/3, 1/3, 0, 0, 1/3]
+    s_n = [0, 0, 1, 0, 0, 1/3, 2/3, 2/3, 1/3, 1/3]
+    phi, p_r, p_s = twod_ref_eval(10, r_n, s_n)
+    assert np.allclose(phi, np.eye(10)) and np.allclose(p_r.sum(axis=1), 0.)
+
+    # float32 tables are cached separately, cast from the float64 one
+    ref_32 = twod_ref_basis(6, r, s, w, np.float32)
+    assert ref_32.phi.dtype == np.float32 and np.allclose(ref_32.phi, ref.phi)
+    assert twod_ref_basis(6, r, s, w, np.float32) is ref_32 and len(ref_cache) == 2
+
+    ref_cache.evict(n_dof=6)
+    assert len(ref_cache) == 0
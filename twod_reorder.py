@@ -0,0 +1,162 @@
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from twod_profile import twod_timed
+
+@twod_timed('reorder')
+def twod_reorder(x, e_conn, index_b, method='rcm', e_bnd=None, bits=16):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_reorder.py - renumbers nodes and elements for a small matrix       #
+    #                    bandwidth (less fill-in) and local gather/scatter     #
+    #                                                                          #
+    #  Usage:    x, e_conn, index_b, perm, iperm, e_perm = twod_reorder(x,     #
+    #                                         e_conn, index_b, method)         #
+    #            x, e_conn, index_b, e_bnd, perm, iperm, e_perm =              #
+    #                                         twod_reorder(..., e_bnd=e_bnd)   #
+    #                                                                          #
+    #  Variables:     method                                                   #
+    #                        'rcm'      reverse Cuthill-McKee on the node      #
+    #                                   graph                                  #
+    #                        'hilbert'  Hilbert curve through the nodes        #
+    #                        'morton'   Morton (Z-order) curve                 #
+    #                 e_bnd                                                    #
+    #                        (optional) boundary edges, renumbered as well     #
+    #                 bits                                                     #
+    #                        resolution of the space-filling curves            #
+    #                                                                          #
+    #                 perm                                                     #
+    #                        old node numbers in new order, x_new = x[perm]    #
+    #                 iperm                                                    #
+    #                        new number of every old node, a solution on the   #
+    #                        reordered mesh is restored by u_old = u[iperm]    #
+    #                 e_perm                                                   #
+    #                        old element numbers in new order, per-element     #
+    #                        data (e.g. kernel samples at the Gauss points or  #
+    #                        error indicators) moves by                        #
+    #                        data_new = data[e_perm]                           #
+    #                                                                          #
+    #  Elements are sorted by their smallest new node number.                  #
+    #--------------------------------------------------------------------------#
+    '''
+    perm  = twod_node_order(x, e_conn, method, bits)
+    iperm = np.empty_like(perm)
+    iperm[perm] = np.arange(perm.size, dtype=perm.dtype)
+
+    dtype   = e_conn.dtype
+    e_new   = iperm[e_conn].astype(dtype)
+    e_perm  = np.argsort(e_new.min(axis=1), kind='stable')
+    e_new   = e_new[e_perm]
+    index_b = np.sort(iperm[index_b]).astype(dtype)
+
+    if e_bnd is None:
+        return x[perm], e_new, index_b, perm, iperm, e_perm
+    return x[perm], e_new, index_b, iperm[e_bnd].astype(e_bnd.dtype), perm, iperm, e_perm
+
+
+def twod_node_order(x, e_conn, method='rcm', bits=16):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_node_order - node permutation of twod_reorder (perm, old numbers   #
+    #                    in new order)                                         #
+    #                                                                          #
+    #  Usage:    perm = twod_node_order(x, e_conn, method, bits)               #
+    #--------------------------------------------------------------------------#
+    '''
+    n_nodes = x.shape[0]
+    if method == 'rcm':
+        # Node graph: nodes sharing an element are connected
+        n = e_conn.shape[1]
+        rows = np.repeat(e_conn, n, axis=1).ravel()
+        cols = np.tile(e_conn, (1, n)).ravel()
+        G = sp.csr_matrix((np.ones(rows.size, dtype=np.int8), (rows, cols)),
+                          shape=(n_nodes, n_nodes))
+        return reverse_cuthill_mckee(G, symmetric_mode=True).astype(np.int64)
+
+    if method not in ('hilbert', 'morton'):
+        raise Exception('twod_node_order: {} is not a valid method'.format(method))
+
+    # Integer coordinates on a 2^bits x 2^bits grid over the bounding box
+    lo = x.min(axis=0)
+    extent = (x.max(axis=0) - lo).max() or 1.
+    m  = (1 << bits) - 1
+    ij = np.rint((x - lo)/extent*m).astype(np.int64)
+    if method == 'hilbert':
+        key = _hilbert(ij[:,0], ij[:,1], bits)
+    else:
+        key = _morton(ij[:,0], ij[:,1], bits)
+    return np.argsort(key, kind='stable')
+
+
+def twod_bandwidth(e_conn):
+    '''
+    Largest |i - j| over all node pairs sharing an element.
+    '''
+    return int((e_conn.max(axis=1) - e_conn.min(axis=1)).max())
+
+
+def _morton(i, j, bits):
+    key = np.zeros_like(i)
+    for b in range(bits):
+        key |= ((i >> b) & 1) << (2*b) | ((j >> b) & 1) << (2*b + 1)
+    return key
+
+
+def _hilbert(i, j, bits):
+    # Vectorized xy -> d of the Hilbert curve on a 2^bits grid
+    n = 1 << bits
+    i = i.copy(); j = j.copy()
+    key = np.zeros_like(i)
+    s = n >> 1
+    while s > 0:
+        r_i = (i & s) > 0
+        r_j = (j & s) > 0
+        key += s*s*((3*r_i) ^ r_j)
+        # Rotate the quadrant
+        flip = ~r_j & r_i
+        i = np.where(flip, n-1 - i, i)
+        j = np.where(flip, n-1 - j, j)
+        swap = ~r_j
+        i, j = np.where(swap, j, i), np.where(swap, i, j)
+        s >>= 1
+    return key
+
+
+
+# Test twod_reorder
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble, twod_assemble_load
+    from twod_solve import twod_dirichlet
+    import scipy.sparse.linalg as spla
+
+    # Long thin domain numbered along its long side
+    x, e_conn, index_b, e_bnd, e_tag = twod_mesh(0, 40, 0, 1, 'quadratic', 401, 21, edges=True)
+    r, s, w = twod_gauss(7)
+    f = lambda x,y: np.sin(x)*np.cos(y)
+
+    A = twod_assemble(x, e_conn, r, s, w)
+    F = twod_assemble_load(x, e_conn, r, s, w, f)
+    A, F = twod_dirichlet(A, F, index_b)
+    lu = spla.splu(A.tocsc(), permc_spec='NATURAL')
+    u = lu.solve(F)
+
+    for method in ['rcm', 'hilbert', 'morton']:
+        x_p, e_p, index_p, e_bnd_p, perm, iperm, e_perm = twod_reorder(x, e_conn, index_b,
+                                                                       method, e_bnd=e_bnd)
+        assert np.array_equal(np.sort(perm), np.arange(x.shape[0]))
+        assert np.array_equal(e_p, iperm[e_conn[e_perm]])
+        assert np.allclose(x_p[e_p].sum(axis=(0,1)), x[e_conn].sum(axis=(0,1)))
+        assert np.array_equal(np.sort(x_p[e_bnd_p].reshape(-1, 2), axis=0),
+                              np.sort(x[e_bnd].reshape(-1, 2), axis=0))
+
+        A_p = twod_assemble(x_p, e_p, r, s, w)
+        F_p = twod_assemble_load(x_p, e_p, r, s, w, f)
+        A_p, F_p = twod_dirichlet(A_p, F_p, index_p)
+        lu_p = spla.splu(A_p.tocsc(), permc_spec='NATURAL')
+        assert np.allclose(lu_p.solve(F_p)[iperm], u)
+        if method == 'rcm':
+            assert twod_bandwidth(e_p) < twod_bandwidth(e_conn)/5
+            assert lu_p.L.nnz + lu_p.U.nnz < (lu.L.nnz + lu.U.nnz)/2
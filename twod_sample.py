@@ -0,0 +1,143 @@
+
+import numpy as np
+from twod_shape_batch import twod_shape_batch
+from twod_bilinear import twod_element_matrices
+from twod_f_int import twod_f_int_batch
+from twod_assemble import AssemblyPlan, twod_assemble_vector, _eval_kernel
+from twod_solve import twod_dirichlet, twod_lift, TwodSolver
+
+def twod_sample_solve(x, e_conn, r, s, w, index_b, kernels=None, sources=1., g=0.,
+                      form='stiffness', out=None, batch=64, method='direct', **kwargs):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_sample.py - solves  \int{ kernel_k*grad(u_k).grad(test) } =        #
+    #                           \int{ f_k*test },  u_k = g on index_b          #
+    #                   for many samples k of random coefficient fields        #
+    #                   given at the Gauss points of a fixed mesh              #
+    #                                                                          #
+    #  Usage:    U = twod_sample_solve(x, e_conn, r, s, w, index_b, kernels,   #
+    #                                  sources, g, form, out, batch, method)   #
+    #                                                                          #
+    #  Variables:     kernels                                                  #
+    #                        None (=1, or a constant/callable) or kernel       #
+    #                        samples at the Gauss points                       #
+    #                        (dim: n_samples, n_elem, n_gauss)                 #
+    #                 sources                                                  #
+    #                        a constant/callable f(x,y) shared by all samples, #
+    #                        or source samples at the Gauss points             #
+    #                        (dim: n_samples, n_elem, n_gauss)                 #
+    #                 g                                                        #
+    #                        Dirichlet values on index_b                       #
+    #                 form                                                     #
+    #                        element form of the operator (twod_assemble)      #
+    #                 out                                                      #
+    #                        (optional) .npy file the solutions are streamed   #
+    #                        to, one row per sample                            #
+    #                 batch                                                    #
+    #                        samples solved together when only the right      #
+    #                        hand side changes                                 #
+    #                 method, kwargs                                           #
+    #                        passed to TwodSolver                              #
+    #                                                                          #
+    #                 U                                                        #
+    #                        solutions (dim: n_samples, n_nodes), a memmap of  #
+    #                        out if given                                      #
+    #--------------------------------------------------------------------------#
+    '''
+    n_nodes = x.shape[0]
+    fields  = not (kernels is None or callable(kernels) or np.ndim(kernels) == 0)
+    rhs     = not (callable(sources) or np.ndim(sources) == 0)
+    if fields:
+        n_samples = len(kernels)
+    elif rhs:
+        n_samples = len(sources)
+    else:
+        n_samples = 1
+    if fields and rhs and len(sources) != n_samples:
+        raise Exception('twod_sample_solve: kernels and sources differ in length')
+
+    # Geometry, basis tables and sparsity pattern are shared by all samples
+    x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, e_conn, r, s, w)
+    plan = AssemblyPlan(e_conn, n_nodes)
+
+    if out is None:
+        U = np.empty((n_samples, n_nodes))
+    else:
+        U = np.lib.format.open_memmap(out, mode='w+', dtype=np.float64,
+                                      shape=(n_samples, n_nodes))
+
+    def load(k0, k1):
+        if rhs:
+            Ff = np.moveaxis(np.asarray(sources[k0:k1]), 0, -1)
+            return twod_assemble_vector(e_conn, twod_f_int_batch(Ff, phi[0], w_g), n_nodes)
+        F = twod_assemble_vector(e_conn, twod_f_int_batch(
+                _eval_kernel(sources, x_g)*np.ones_like(w_g), phi[0], w_g), n_nodes)
+        return np.repeat(F[:,None], k1 - k0, axis=1)
+
+    if not fields:
+        # One operator: factorize once, solve blocks of right hand sides
+        A_e = twod_element_matrices(form, _eval_kernel(kernels, x_g), w_g, phi, p_x, p_y)
+        A = plan.assemble(A_e)
+        A_D, _ = twod_dirichlet(A, np.zeros(n_nodes), index_b)
+        solver = TwodSolver(A_D, method, **kwargs)
+        for k0 in range(0, n_samples, batch):
+            k1 = min(k0 + batch, n_samples)
+            F_D = twod_lift(A, load(k0, k1), index_b, g)
+            U[k0:k1] = np.reshape(solver.solve(F_D), (n_nodes, -1)).T
+    else:
+        # New operator per sample, refilled in place on the fixed pattern
+        A = None
+        F = None if rhs else load(0, 1)[:,0]
+        for k in range(n_samples):
+            A_e = twod_element_matrices(form, np.asarray(kernels[k]), w_g, phi, p_x, p_y)
+            A = plan.assemble(A_e, out=A)
+            F_k = load(k, k+1)[:,0] if rhs else F
+            A_D, F_D = twod_dirichlet(A, F_k, index_b, g)
+            U[k] = TwodSolver(A_D, method, **kwargs).solve(F_D)
+
+    if out is not None:
+        U.flush()
+    return U
+
+
+
+# Test twod_sample
+if __name__ == '__main__':
+    import os, tempfile
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble, twod_assemble_load
+    from twod_solve import twod_solve
+
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'linear', 17, 17)
+    r, s, w = twod_gauss(3)
+    n_elem, n_gauss = e_conn.shape[0], len(r)
+    rng = np.random.default_rng(0)
+
+    # Random sources, fixed operator
+    sources = rng.random((10, n_elem, n_gauss))
+    U = twod_sample_solve(x, e_conn, r, s, w, index_b, sources=sources, batch=4)
+
+    # Random log-normal kernels, streamed to disk
+    kernels = np.exp(rng.standard_normal((3, n_elem, 1)))*np.ones((1, 1, n_gauss))
+    path = os.path.join(tempfile.mkdtemp(), 'u.npy')
+    V = twod_sample_solve(x, e_conn, r, s, w, index_b, kernels=kernels, out=path)
+
+    A = twod_assemble(x, e_conn, r, s, w, 'stiffness')
+    x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, e_conn, r, s, w)
+    for k in [0, 9]:
+        F = twod_assemble_vector(e_conn, twod_f_int_batch(sources[k], phi[0], w_g), x.shape[0])
+        assert np.allclose(U[k], twod_solve(A, F, index_b))
+
+    for k in range(3):
+        A_k = twod_assemble(x, e_conn, r, s, w, 'stiffness', lambda x,y: kernels[k])
+        F = twod_assemble_load(x, e_conn, r, s, w, 1.)
+        assert np.allclose(np.load(path, mmap_mode='r')[k], twod_solve(A_k, F, index_b))
+
+    # Batched sources with varying boundary values (n_bnd == n_rhs included)
+    g = x[index_b,0]
+    for n_samples, size in [(5, 4), (len(index_b), len(index_b))]:
+        U = twod_sample_solve(x, e_conn, r, s, w, index_b, sources=sources[:1].repeat(n_samples, 0),
+                              g=g, batch=size)
+        F = twod_assemble_vector(e_conn, twod_f_int_batch(sources[0], phi[0], w_g), x.shape[0])
+        assert np.allclose(U, twod_solve(A, F, index_b, g)) and np.allclose(U[:,index_b], g)
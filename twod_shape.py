@@ -1,6 +1,7 @@
 
 import numpy as np
 import warnings
+from twod_ref_basis import twod_ref_basis
 
 def twod_shape(x_local,r,s,w):
     '''
@@ -48,7 +49,7 @@ def twod_shape(x_local,r,s,w):
     c1 = -x[0,:] + x[1,:]
     c2 = -x[0,:]          + x[2,:]
 
-    x_g = np.zeros(( rule, n ))
+    x_g = np.zeros(( rule, ncoord ))
     x_g[:,0] = c0[0] + c1[0]*r + c2[0]*s
     xr  = c1[0]
     xs  = c2[0]
@@ -66,96 +67,24 @@ def twod_shape(x_local,r,s,w):
     ry  =-xs/jac
     sy  = xr/jac
 
-    if n == 3:
-        # Compute shape function and derivatives at Gauss points
-        phi = np.zeros((rule,n))
-        phi[:,0] = 1. - r  - s
-        phi[:,1] =      r     
-        phi[:,2] =           s
-
-        p_x = np.zeros((rule,n))
-        p_x[:,0] =    - rx - sx
-        p_x[:,1] =      rx     
-        p_x[:,2] =           sx
-        
-        p_y = np.zeros((rule,n))
-        p_y[:,0] =    - ry - sy
-        p_y[:,1] =      ry     
-        p_y[:,2] =           sy
-
-    elif n == 6:
-        # Compute shape function and derivatives at Gauss points
-        phi = np.zeros((rule,n))
-        phi[:,0] = 1. - 3.*r - 3.*s + 2.*r*r + 4.*r*s + 2.*s*s
-        phi[:,1] =    - 1.*r        + 2.*r*r                    
-        phi[:,2] =           - 1.*s                     + 2.*s*s
-        phi[:,3] =      4.*r        - 4.*r*r - 4.*r*s          
-        phi[:,4] =                              4.*r*s          
-        phi[:,5] =             4.*s           - 4.*r*s - 4.*s*s
-
-        p_x = np.zeros(( rule,n ));
-        p_x[:,0] = ( -3. + 4.*r + 4.*s )*rx + ( -3. + 4.*r + 4.*s )*sx
-        p_x[:,1] = ( -1. + 4.*r        )*rx                            
-        p_x[:,2] =                             ( -1.        + 4.*s )*sx
-        p_x[:,3] = (  4. - 8.*r - 4.*s )*rx + (     - 4.*r        )*sx
-        p_x[:,4] = (              4.*s )*rx + (       4.*r        )*sx
-        p_x[:,5] = (            - 4.*s )*rx + (  4. - 4.*r - 8.*s )*sx
-
-        p_y = np.zeros(( rule,n ));
-        p_y[:,0] = ( -3. + 4.*r + 4.*s )*ry + ( -3. + 4.*r + 4.*s )*sy
-        p_y[:,1] = ( -1. + 4.*r        )*ry                            
-        p_y[:,2] =                             ( -1.        + 4.*s)*sy
-        p_y[:,3] = (  4. - 8.*r - 4.*s )*ry + (     - 4.*r        )*sy
-        p_y[:,4] = (              4.*s )*ry + (       4.*r        )*sy
-        p_y[:,5] = (            - 4.*s )*ry + (  4. - 4.*r - 8.*s )*sy
-    
-    elif n == 7:
-        # Compute shape function and derivatives at Gauss points
-        phi = np.zeros((rule,n))
-        phi[:,0] = (1-r-s)*(2.*(1-r-s)-1) +  3.*(1.-r-s)*r*s
-        phi[:,1] = r*(2.*r-1)             +  3.*(1.-r-s)*r*s
-        phi[:,2] = s*(2.*s-1)             +  3.*(1.-r-s)*r*s
-        phi[:,3] = 4.*(1-r-s)*r           - 12.*(1.-r-s)*r*s
-        phi[:,4] = 4.*r*s                 - 12.*(1.-r-s)*r*s
-        phi[:,5] = 4.*s*(1-r-s)           - 12.*(1.-r-s)*r*s
-        phi[:,6] = 27.*(1-r-s)*r*s                   
-
-        p_r = np.zeros((rule,n))
-        p_r[:,0] = -3 + 4.*r + 7.*s - 6.*r*s - 3.*(s**2)
-        p_r[:,1] = -1 + 4.*r + 3.*s - 6.*r*s - 3.*(s**2)
-        p_r[:,2] =             3.*s - 6.*r*s - 3.*(s**2)
-        p_r[:,3] =  4 - 8.*r -16.*s +24.*r*s +12.*(s**2)
-        p_r[:,4] =           - 8.*s +24.*r*s +12.*(s**2)
-        p_r[:,5] =           -16.*s +24.*r*s +12.*(s**2)
-        p_r[:,6] =            27.*s -54.*r*s -27.*(s**2)
-
-        p_s = np.zeros((rule,n))
-        p_s[:,0] = -3 + 7.*r + 4.*s - 6.*r*s - 3.*(r**2)
-        p_s[:,1] =      3.*r        - 6.*r*s - 3.*(r**2)
-        p_s[:,2] = -1 + 3.*r + 4.*s - 6.*r*s - 3.*(r**2)
-        p_s[:,3] =    -16.*r        +24.*r*s +12.*(r**2)
-        p_s[:,4] =    - 8.*r        +24.*r*s +12.*(r**2)
-        p_s[:,5] =  4 -16.*r - 8.*s +24.*r*s +12.*(r**2)
-        p_s[:,6] =     27.*r        -54.*r*s -27.*(r**2)
-
-        p_x = p_r*rx + p_s*sx
-        p_y = p_r*ry + p_s*sy
-
-    else:
-        raise Exception('Elements with {} interior nodes are not currently supported'
-                       .format(x.shape[0]))
+    # Shape functions and (r,s) derivatives come from the cached reference table
+    ref = twod_ref_basis(n, r, s, w)
+
+    phi = ref.phi
+    p_x = ref.p_r*rx + ref.p_s*sx
+    p_y = ref.p_r*ry + ref.p_s*sy
+
     return x_g,w_g,phi,p_x,p_y
 
 
 
 # Test twod_shape
-x_local = x[e_conn[0,:],:]  # This is the first element 
-#
-# x and e_conn are from 
-#
-# x, e_conn, _ = twod_mesh(x_l,x_r,y_l,y_r,etype,n_nodesx,n_nodesy, *args)
-
 if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+
+    x, e_conn, _ = twod_mesh(0, 1, 0, 1, 'quadratic', 5, 3)
+    r, s, w = twod_gauss(7)
+    x_local = x[e_conn[0,:],:]  # This is the first element 
+
     x_g,w_g,phi,p_x,p_y = twod_shape(x_local, r, s, w)
-    
-    
@@ -0,0 +1,93 @@
+
+import numpy as np
+from twod_ref_basis import twod_ref_basis
+
+def twod_shape_batch(x, e_conn, r, s, w):
+    '''
+    ----------------------------------------------------------------------------------
+    #  twod_shape_batch.py - computes test functions and derivatives on every        #
+    #                 element of a mesh at once, given the node coordinates,         #
+    #                 the element connectivity and Gauss points.                     #
+    #                                                                                #
+    #                 ! Note: vectorized counterpart of `twod_shape' for             #
+    #                 ! straight-sided elements (3, 6 or 7 nodes).                   #
+    #                                                                                #
+    #  Usage:    x_g,w_g,phi,p_x,p_y,jac = twod_shape_batch(x,e_conn,r,s,w)          #
+    #                                                                                #
+    #  Variables:     x                                                              #
+    #                        Node coordinates of the mesh (dim: n_nodes, 2), all     #
+    #                        outputs have the float precision of x                   #
+    #                 e_conn                                                         #
+    #                        Element connectivity (dim: n_elem, n_dof)               #
+    #                 (r,s)                                                          #
+    #                        Coordinates of Gauss points in unit triangle            #
+    #                 w                                                              #
+    #                        Gauss weights associated with (r,s)                     #
+    #                                                                                #
+    #                 x_g                                                            #
+    #                        Coordinates of Gauss points in every element            #
+    #                        (dim: n_elem, n_gauss, 2)                               #
+    #                 w_g                                                            #
+    #                        Gauss weights scaled by the element Jacobians           #
+    #                        (dim: n_elem, n_gauss)                                  #
+    #                 phi                                                            #
+    #                        Value of element shape functions at x_g                 #
+    #                        (dim: n_elem, n_gauss, n_dof, read-only view since      #
+    #                        phi does not depend on the element)                     #
+    #                 p_x                                                            #
+    #                 p_y                                                            #
+    #                        First spatial derivatives of phi                        #
+    #                        (dim: n_elem, n_gauss, n_dof)                           #
+    #                 jac                                                            #
+    #                        Jacobian of the (r,s) -> (x,y) map (dim: n_elem)        #
+    #                                                                                #
+    ----------------------------------------------------------------------------------
+    '''
+    n_elem, n = e_conn.shape
+
+    # Work in the precision of x (float32 geometry stays float32), with
+    # the basis table cached in that precision
+    dtype = np.result_type(x.dtype, np.float32)
+    ref = twod_ref_basis(n, r, s, w, dtype)
+    r, s, w = ref.r, ref.s, ref.w
+
+    # Compute (r,s) -> (x,y) transformation for straight-sided elements
+    x_v = x[e_conn[:,:3],:]                   # (n_elem, 3, 2) vertex coordinates
+    c0  = x_v[:,0,:]
+    c1  = x_v[:,1,:] - c0
+    c2  = x_v[:,2,:] - c0
+
+    x_g = c0[:,None,:] + c1[:,None,:]*r[None,:,None] + c2[:,None,:]*s[None,:,None]
+    xr  = c1[:,0];  xs = c2[:,0]
+    yr  = c1[:,1];  ys = c2[:,1]
+
+    # Compute the Jacobian of the (r,s) -> (x,y) transformation
+    jac = xr*ys - yr*xs
+    w_g = jac[:,None]*w[None,:]
+
+    rx  = ( ys/jac)[:,None,None]
+    sx  = (-yr/jac)[:,None,None]
+    ry  = (-xs/jac)[:,None,None]
+    sy  = ( xr/jac)[:,None,None]
+
+    phi = np.broadcast_to(ref.phi, (n_elem,) + ref.phi.shape)
+    p_x = ref.p_r*rx + ref.p_s*sx
+    p_y = ref.p_r*ry + ref.p_s*sy
+    return x_g, w_g, phi, p_x, p_y, jac
+
+
+# Test twod_shape_batch
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_shape import twod_shape
+
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'quadratic', 5, 3)
+    r, s, w = twod_gauss(7)
+    x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, e_conn, r, s, w)
+
+    # Compare against the one-element-at-a-time routine
+    for ie in range(e_conn.shape[0]):
+        x_g1, w_g1, phi1, p_x1, p_y1 = twod_shape(x[e_conn[ie,:],:], r, s, w)
+        assert np.allclose(x_g[ie], x_g1[:,:2]) and np.allclose(w_g[ie], w_g1)
+        assert np.allclose(p_x[ie], p_x1) and np.allclose(p_y[ie], p_y1)
@@ -0,0 +1,206 @@
+
+import numpy as np
+from twod_ref_basis import twod_ref_basis, twod_ref_eval
+from twod_shape_batch import twod_shape_batch
+
+# Reference coordinates (r,s) of the element nodes, by number of nodes
+_NODES = {3 : ([0, 1, 0], [0, 0, 1]),
+          6 : ([0, 1, 0, 1/2, 1/2, 0], [0, 0, 1, 0, 1/2, 1/2]),
+          7 : ([0, 1, 0, 1/2, 1/2, 0, 1/3], [0, 0, 1, 0, 1/2, 1/2, 1/3]),
+          10: ([0, 1, 0, 1/3, 2/3, 2/3, 1/3, 0, 0, 1/3],
+               [0, 0, 1, 0, 0, 1/3, 2/3, 2/3, 1/3, 1/3])}
+
+def twod_shapeiso(x_local,r,s,w):
+    '''
+    ----------------------------------------------------------------------------------
+    #  twod_shapeiso.py - computes test functions and derivatives on an              #
+    #                     isoparametric element given element coordinates and        #
+    #                     Gauss points.  The (r,s) -> (x,y) map uses all element     #
+    #                     nodes, so its Jacobian varies over the element             #
+    #                                                                                #
+    #  Usage:    [x_g,w_g,phi,p_x,p_y] = twod_shapeiso(x_local,r,s,w)                #
+    #                                                                                #
+    #  Variables:     as in twod_shape                                               #
+    ----------------------------------------------------------------------------------
+    '''
+    n = x_local.shape[0]
+    x_g, w_g, phi, p_x, p_y, jac = twod_shapeiso_batch(x_local, np.arange(n)[None,:], r, s, w)
+    return x_g[0], w_g[0], np.array(phi[0]), p_x[0], p_y[0]
+
+
+def twod_shapeiso_batch(x, e_conn, r, s, w, tol=1e-12):
+    '''
+    ----------------------------------------------------------------------------------
+    #  twod_shapeiso_batch - twod_shapeiso on every element at once, with the same   #
+    #                        stacked output as twod_shape_batch.  Elements whose     #
+    #                        nodes sit where the straight-sided map puts them        #
+    #                        (see twod_affine) take the constant Jacobian path,      #
+    #                        the others get a Jacobian at every Gauss point          #
+    #                                                                                #
+    #  Usage:    x_g,w_g,phi,p_x,p_y,jac = twod_shapeiso_batch(x,e_conn,r,s,w,tol)   #
+    #                                                                                #
+    #  Variables:     tol                                                            #
+    #                        relative tolerance of the affine test                   #
+    #                 jac                                                            #
+    #                        Jacobian at the Gauss points (dim: n_elem, n_gauss)     #
+    #                                                                                #
+    #                 all other outputs as in twod_shape_batch                       #
+    ----------------------------------------------------------------------------------
+    '''
+    n_elem, n = e_conn.shape
+    r = np.asarray(r); s = np.asarray(s); w = np.asarray(w)
+    n_gauss = r.size
+    affine = twod_affine(x, e_conn, tol)
+    if affine.all():
+        x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, e_conn, r, s, w)
+        return x_g, w_g, phi, p_x, p_y, np.broadcast_to(jac[:,None], (n_elem, n_gauss))
+
+    ref = twod_ref_basis(n, r, s, w)
+    x_g = np.empty((n_elem, n_gauss, 2))
+    w_g = np.empty((n_elem, n_gauss))
+    p_x = np.empty((n_elem, n_gauss, n))
+    p_y = np.empty((n_elem, n_gauss, n))
+    jac = np.empty((n_elem, n_gauss))
+
+    if affine.any():
+        x_g[affine], w_g[affine], _, p_x[affine], p_y[affine], jac_a = \
+            twod_shape_batch(x, e_conn[affine], r, s, w)
+        jac[affine] = jac_a[:,None]
+
+    # Curved elements: x = sum_i x_i phi_i(r,s) and its derivatives at every
+    # Gauss point
+    curved = ~affine
+    X  = x[e_conn[curved],:]                         # (n_curved, n, 2)
+    x_g[curved] = np.einsum('gi,eid->egd', ref.phi, X)
+    xr = np.einsum('gi,ei->eg', ref.p_r, X[...,0])
+    xs = np.einsum('gi,ei->eg', ref.p_s, X[...,0])
+    yr = np.einsum('gi,ei->eg', ref.p_r, X[...,1])
+    ys = np.einsum('gi,ei->eg', ref.p_s, X[...,1])
+
+    J = xr*ys - yr*xs
+    if np.any(J <= 0):
+        raise Exception('twod_shapeiso_batch: nonpositive Jacobian in a curved element')
+    jac[curved] = J
+    w_g[curved] = J*w[None,:]
+
+    rx = ( ys/J)[...,None];  sx = (-yr/J)[...,None]
+    ry = (-xs/J)[...,None];  sy = ( xr/J)[...,None]
+    p_x[curved] = ref.p_r*rx + ref.p_s*sx
+    p_y[curved] = ref.p_r*ry + ref.p_s*sy
+
+    phi = np.broadcast_to(ref.phi, (n_elem,) + ref.phi.shape)
+    return x_g, w_g, phi, p_x, p_y, jac
+
+
+def twod_affine(x, e_conn, tol=1e-12):
+    '''
+    ----------------------------------------------------------------------------------
+    #  twod_affine - True for elements whose nodes are the straight-sided images     #
+    #                of the reference nodes, to within tol times the element size    #
+    #                                                                                #
+    #  Usage:    affine = twod_affine(x, e_conn, tol)                                #
+    ----------------------------------------------------------------------------------
+    '''
+    n = e_conn.shape[1]
+    if n == 3:
+        return np.ones(e_conn.shape[0], dtype=bool)
+    r_n, s_n = _NODES[n]
+    lin, _, _ = twod_ref_eval(3, r_n, s_n)
+    X = x[e_conn,:]
+    d = X - np.einsum('ij,ejd->eid', lin, X[:,:3,:])
+    h = np.abs(X[:,:3,:] - X[:,[1,2,0],:]).max(axis=(1,2))
+    return np.abs(d).max(axis=(1,2)) <= tol*h
+
+
+def twod_snap(x, e_conn, e_bnd, project):
+    '''
+    ----------------------------------------------------------------------------------
+    #  twod_snap - curves a boundary: moves the interior nodes of the edges e_bnd    #
+    #              onto project(x,y).  Centroid nodes of cubic elements are reset    #
+    #              to 1/4 sum(edge nodes) - 1/6 sum(vertices), which keeps them in   #
+    #              place on straight-sided elements                                  #
+    #                                                                                #
+    #  Usage:    x = twod_snap(x, e_conn, e_bnd, project)                            #
+    #                                                                                #
+    #  Variables:     e_bnd                                                          #
+    #                        boundary edges to curve (e.g. from twod_mesh_edges)     #
+    #                 project                                                        #
+    #                        callable returning the curve points (p_x, p_y) for      #
+    #                        node coordinates (x, y)                                 #
+    ----------------------------------------------------------------------------------
+    '''
+    x = np.array(x, dtype=float)
+    nodes = np.unique(e_bnd[:,2:])
+    if nodes.size:
+        p_x, p_y = project(x[nodes,0], x[nodes,1])
+        x[nodes,0] = p_x
+        x[nodes,1] = p_y
+    if e_conn.shape[1] == 10:
+        X = x[e_conn,:]
+        x[e_conn[:,9]] = 0.25*X[:,3:9].sum(axis=1) - X[:,:3].sum(axis=1)/6
+    return x
+
+
+
+# Test twod_shapeiso
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss_degree
+    from twod_assemble import twod_assemble, twod_assemble_load
+    from twod_solve import twod_solve
+
+    r, s, w = twod_gauss_degree(8)
+
+    # Straight-sided meshes take the affine path
+    for etype in ['quadratic', 'cubic']:
+        x, e_conn, index_b = twod_mesh(0, 2, 0, 1, etype, 13, 7)
+        assert twod_affine(x, e_conn).all()
+        out_1 = twod_shapeiso_batch(x, e_conn, r, s, w)
+        out_2 = twod_shape_batch(x, e_conn, r, s, w)
+        for a, b in zip(out_1[:5], out_2[:5]):
+            assert np.allclose(a, b)
+
+    # Quarter annulus 1 < rho < 2, mapped from the (rho, theta) rectangle
+    def polar(x):
+        return np.column_stack((x[:,0]*np.cos(x[:,1]), x[:,0]*np.sin(x[:,1])))
+
+    def radial(x, y):
+        rho = np.sqrt(x**2 + y**2)
+        return x*np.round(rho)/rho, y*np.round(rho)/rho
+
+    for etype, n, p in [('quadratic', 5, 2), ('cubic', 7, 3)]:
+        err = []
+        for k in range(3):
+            m = p*n*2**k + 1
+            x, e_conn, index_b, e_bnd, e_tag = twod_mesh(1, 2, 0, np.pi/2, etype, 2*p*2**k + 1,
+                                                         m, edges=True)
+            # Straight-sided mesh of the annulus, then curve the two arcs
+            x_v = polar(x)
+            lin, _, _ = twod_ref_eval(3, *_NODES[e_conn.shape[1]])
+            x_s = np.empty_like(x_v)
+            x_s[e_conn] = np.einsum('ij,ejd->eid', lin, x_v[e_conn[:,:3]])
+            x_c = twod_snap(x_s, e_conn, e_bnd[(e_tag == 1) | (e_tag == 3)], radial)
+            affine = twod_affine(x_c, e_conn)
+            assert affine.any() and not affine.all()
+
+            # Area, and -Laplace(u) = 4 - 3/rho with u = (rho-1)(2-rho) zero on
+            # the arcs
+            rho_c = np.sqrt(x_c[:,0]**2 + x_c[:,1]**2)
+            g = ((rho_c - 1)*(2 - rho_c))[index_b]
+            res = []
+            for x_k in [x_s, x_c]:
+                A = twod_assemble(x_k, e_conn, r, s, w, iso=True)
+                F = twod_assemble_load(x_k, e_conn, r, s, w,
+                                       lambda x,y: 4 - 3/np.sqrt(x**2 + y**2), iso=True)
+                rho = np.sqrt(x_k[:,0]**2 + x_k[:,1]**2)
+                u_ex = (rho - 1)*(2 - rho)
+                u = twod_solve(A, F, index_b, g)
+                area = twod_shapeiso_batch(x_k, e_conn, r, s, w)[1].sum()
+                res += [abs(area - 3*np.pi/4), np.abs(u - u_ex).max()]
+            err.append(res)
+
+        # Curved boundaries: higher order area and solution convergence
+        err = np.array(err)
+        assert np.all(err[:,2] < 1e-2*err[:,0]) and np.all(err[:,3] < 0.1*err[:,1])
+        rate = np.log2(err[:-1]/err[1:])
+        assert np.all(rate[:,0] > 1.9) and np.all(rate[:,2] > p + 0.8) and np.all(rate[:,3] > p + 0.3)
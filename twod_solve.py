@@ -0,0 +1,240 @@
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from twod_profile import twod_timer, twod_count
+
+def twod_dirichlet(A, b, index_b, g=0.):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_solve.py - sparse solution of A u = b with Dirichlet data          #
+    #                                                                          #
+    #  twod_dirichlet - imposes u[index_b] = g on the assembled system by      #
+    #                   lifting g into the right hand side and replacing the   #
+    #                   boundary rows and columns by the identity, without     #
+    #                   densifying A (the result stays symmetric if A is)      #
+    #                                                                          #
+    #  Usage:    A_D, b_D = twod_dirichlet(A, b, index_b, g)                   #
+    #                                                                          #
+    #  Variables:     A                                                        #
+    #                        Assembled sparse matrix (n_nodes, n_nodes)        #
+    #                 b                                                        #
+    #                        Right hand side (dim: n_nodes or n_nodes, n_rhs)  #
+    #                 index_b                                                  #
+    #                        Boundary node numbers from twod_mesh              #
+    #                 g                                                        #
+    #                        Boundary values (constant or one per index_b,     #
+    #                        or dim: n_bnd, n_rhs)                             #
+    #--------------------------------------------------------------------------#
+    '''
+    A = sp.csr_matrix(A)
+    n = A.shape[0]
+    b = twod_lift(A, b, index_b, g)
+
+    # D A D + (I - D), D = diag(interior indicator)
+    d = np.ones(n)
+    d[index_b] = 0.
+    D = sp.diags(d)
+    A_D = (D @ A @ D + sp.diags(1. - d)).tocsr()
+    A_D.eliminate_zeros()
+    return A_D, b
+
+
+def twod_lift(A, b, index_b, g=0.):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_lift - the right hand side part of twod_dirichlet: b - A u_b with  #
+    #              b[index_b] = g, for a fixed operator whose A_D is reused    #
+    #                                                                          #
+    #  Usage:    b_D = twod_lift(A, b, index_b, g)                             #
+    #                                                                          #
+    #  Variables:     A                                                        #
+    #                        the matrix before twod_dirichlet                  #
+    #                 b, index_b, g                                            #
+    #                        as in twod_dirichlet                              #
+    #--------------------------------------------------------------------------#
+    '''
+    b = np.array(b, dtype=float)
+
+    # One value per boundary node applies to every right hand side
+    g = np.asarray(g, dtype=float)
+    if b.ndim == 2 and g.ndim == 1:
+        g = g[:,None]
+    u_b = np.zeros((A.shape[0],) + b.shape[1:])
+    u_b[index_b] = g
+    b = b - A @ u_b
+    b[index_b] = u_b[index_b]
+    return b
+
+
+class TwodSolver:
+    '''
+    #--------------------------------------------------------------------------#
+    #  TwodSolver - reusable sparse solver.  The factorization or              #
+    #               preconditioner is built once and reused for every right    #
+    #               hand side passed to solve()                                #
+    #                                                                          #
+    #  Usage:    solver = TwodSolver(A, method, precond, tol, maxiter)         #
+    #            u      = solver.solve(b)                                      #
+    #                                                                          #
+    #  Variables:     A                                                        #
+    #                        sparse matrix (e.g. from twod_dirichlet)          #
+    #                 method                                                   #
+    #                        'direct'  sparse LU (SuperLU), factorized once    #
+    #                        'cg'      conjugate gradients (A s.p.d.)          #
+    #                        'gmres'   restarted GMRES                         #
+    #                 precond                                                  #
+    #                        None, 'jacobi', 'ilu', 'ssor' or a                #
+    #                        LinearOperator approximating A^{-1}               #
+    #                 omega                                                    #
+    #                        SSOR relaxation parameter in (0,2)                #
+    #                 symmetric                                                #
+    #                        if True (A s.p.d.), 'direct' and 'ilu' use a      #
+    #                        symmetric fill-reducing ordering and no pivoting  #
+    #                        (always the case for 'ilu' with 'cg'); 'direct'   #
+    #                        still stores both L and U factors                 #
+    #                                                                          #
+    #                 info                                                     #
+    #                        iteration counts of the last solve (Krylov)       #
+    #--------------------------------------------------------------------------#
+    '''
+    def __init__(self, A, method='direct', precond=None, tol=1e-10, maxiter=None,
+                 omega=1., symmetric=False):
+        self.A       = sp.csr_matrix(A)
+        self.method  = method
+        self.tol     = tol
+        self.maxiter = maxiter
+        self.info    = []
+
+        with twod_timer('solve.setup'):
+            self._setup(method, precond, omega, symmetric)
+
+    def _setup(self, method, precond, omega, symmetric):
+        if method == 'direct':
+            if symmetric:
+                # SuperLU with a symmetric fill-reducing ordering and diagonal
+                # pivots: still an LU factorization (scipy has no sparse
+                # Cholesky), but with the fill of a symmetric one
+                self.lu = spla.splu(self.A.tocsc(), permc_spec='MMD_AT_PLUS_A',
+                                    diag_pivot_thresh=0., options={'SymmetricMode': True})
+            else:
+                self.lu = spla.splu(self.A.tocsc())
+            self.M  = None
+        elif method in ('cg', 'gmres'):
+            self.M = twod_precond(self.A, precond, omega, symmetric or method == 'cg')
+        else:
+            raise Exception('TwodSolver: {} is not a valid method'.format(method))
+
+    def solve(self, b):
+        with twod_timer('solve.solve'):
+            return self._solve(b)
+
+    def _solve(self, b):
+        b = np.asarray(b, dtype=float)
+        if self.method == 'direct':
+            return self.lu.solve(b)
+        if b.ndim == 2:
+            return np.column_stack([self._solve(b[:,j]) for j in range(b.shape[1])])
+
+        n_iter = [0]
+        def count(_):
+            n_iter[0] += 1
+
+        if self.method == 'cg':
+            u, flag = spla.cg(self.A, b, rtol=self.tol, atol=0., maxiter=self.maxiter,
+                              M=self.M, callback=count)
+        else:
+            u, flag = spla.gmres(self.A, b, rtol=self.tol, atol=0., maxiter=self.maxiter,
+                                 M=self.M, callback=count, callback_type='pr_norm')
+        if flag > 0:
+            raise Exception('TwodSolver: {} did not converge in {} iterations'
+                            .format(self.method, n_iter[0]))
+        self.info.append(n_iter[0])
+        twod_count('solve.iterations', n_iter[0])
+        return u
+
+
+def twod_precond(A, precond, omega=1., symmetric=False):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_precond - preconditioner M ~ A^{-1} as a LinearOperator            #
+    #                                                                          #
+    #  Usage:    M = twod_precond(A, precond, omega, symmetric)                #
+    #                                                                          #
+    #  Variables:     precond                                                  #
+    #                        None, 'jacobi', 'ilu', 'ssor' or an operator      #
+    #                        that is returned unchanged                        #
+    #--------------------------------------------------------------------------#
+    '''
+    n = A.shape[0]
+    if precond is None or isinstance(precond, spla.LinearOperator):
+        return precond
+
+    if precond == 'jacobi':
+        d_inv = 1./A.diagonal()
+        return spla.LinearOperator((n, n), matvec=lambda v: d_inv*v.ravel(), dtype=float)
+
+    if precond == 'ilu':
+        # FE matrices are structurally symmetric, so order on A^T+A; without
+        # pivoting the incomplete factors also stay close to symmetric for CG
+        if symmetric:
+            ilu = spla.spilu(A.tocsc(), drop_tol=1e-4, fill_factor=10,
+                             permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0.,
+                             options={'SymmetricMode': True})
+        else:
+            ilu = spla.spilu(A.tocsc(), drop_tol=1e-4, fill_factor=10,
+                             permc_spec='MMD_AT_PLUS_A')
+        return spla.LinearOperator((n, n), matvec=ilu.solve, dtype=float)
+
+    if precond == 'ssor':
+        # M = omega(2-omega) (D/omega + U)^{-1} (D/omega) (D/omega + L)^{-1}
+        d = A.diagonal()/omega
+        L = (sp.tril(A, k=-1) + sp.diags(d)).tocsr()
+        U = (sp.triu(A, k=1)  + sp.diags(d)).tocsr()
+        scale = omega*(2. - omega)
+        def apply(v):
+            y = spla.spsolve_triangular(L, v.ravel(), lower=True)
+            return scale*spla.spsolve_triangular(U, d*y, lower=False)
+        return spla.LinearOperator((n, n), matvec=apply, dtype=float)
+
+    raise Exception('twod_precond: {} is not a valid preconditioner'.format(precond))
+
+
+def twod_solve(A, b, index_b=None, g=0., method='direct', precond=None, **kwargs):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_solve - one-shot solve of A u = b with u[index_b] = g              #
+    #                                                                          #
+    #  Usage:    u = twod_solve(A, b, index_b, g, method, precond)             #
+    #                                                                          #
+    #  For repeated right hand sides build a TwodSolver once instead.          #
+    #--------------------------------------------------------------------------#
+    '''
+    if index_b is not None:
+        A, b = twod_dirichlet(A, b, index_b, g)
+    return TwodSolver(A, method, precond, **kwargs).solve(b)
+
+
+
+# Test twod_solve
+if __name__ == '__main__':
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble, twod_assemble_load
+
+    # -Laplace(u) = 2 pi^2 sin(pi x) sin(pi y) on the unit square, u = 0 on the boundary
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'quadratic', 33, 33)
+    r, s, w = twod_gauss(7)
+    A = twod_assemble(x, e_conn, r, s, w, 'stiffness')
+    F = twod_assemble_load(x, e_conn, r, s, w,
+                           lambda x,y: 2*np.pi**2*np.sin(np.pi*x)*np.sin(np.pi*y))
+    u_ex = np.sin(np.pi*x[:,0])*np.sin(np.pi*x[:,1])
+
+    A_D, F_D = twod_dirichlet(A, F, index_b)
+    u = TwodSolver(A_D).solve(F_D)
+    assert np.abs(u - u_ex).max() < 1e-4
+    assert np.allclose(TwodSolver(A_D, symmetric=True).solve(F_D), u)
+
+    for method, precond in [('cg', 'jacobi'), ('cg', 'ssor'), ('cg', 'ilu'), ('gmres', 'ilu')]:
+        solver = TwodSolver(A_D, method, precond)
+        assert np.abs(solver.solve(F_D) - u).max() < 1e-7
@@ -0,0 +1,337 @@
+
+import os
+import json
+from contextlib import contextmanager
+import numpy as np
+from twod_shape_batch import twod_shape_batch
+from twod_bilinear import twod_element_matrices
+from twod_assemble import AssemblyPlan, _eval_kernel
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+HEADER = 'header.json'
+
+def twod_store_save(path, x, e_conn, index_b, etype=None, rule=None, **arrays):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_store.py - on-disk mesh and solution store: a directory of raw     #
+    #                  .npy arrays opened with np.memmap, plus a JSON header   #
+    #                                                                          #
+    #  twod_store_save - writes a mesh and returns the store opened with       #
+    #                    mode 'r+'                                             #
+    #                                                                          #
+    #  Usage:    store = twod_store_save(path, x, e_conn, index_b, etype,      #
+    #                                    rule, **arrays)                       #
+    #                                                                          #
+    #  Variables:     path                                                     #
+    #                        directory of the store (created if needed)        #
+    #                 x, e_conn, index_b                                       #
+    #                        mesh from twod_mesh                               #
+    #                 etype                                                    #
+    #                        (optional) element type, e.g. 'quadratic'         #
+    #                 rule                                                     #
+    #                        (optional) quadrature rule (r, s, w)              #
+    #                 arrays                                                   #
+    #                        further named arrays, e.g. e_bnd=..., e_tag=...   #
+    #--------------------------------------------------------------------------#
+    '''
+    os.makedirs(path, exist_ok=True)
+    arrays = dict(x=x, e_conn=e_conn, index_b=index_b, **arrays)
+    header = {'etype' : etype,
+              'n_dof' : int(e_conn.shape[1]),
+              'rule'  : None if rule is None else [np.asarray(a, dtype=float).tolist() for a in rule],
+              'arrays': {},
+              'series': {}}
+
+    for name, a in arrays.items():
+        a = np.ascontiguousarray(a)
+        np.save(os.path.join(path, name + '.npy'), a)
+        header['arrays'][name] = {'dtype': a.dtype.str, 'shape': list(a.shape)}
+
+    _write_header(path, header)
+    return TwodStore(path, 'r+')
+
+
+def twod_store_open(path, mode='r'):
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_store_open - opens a store written by twod_store_save              #
+    #                                                                          #
+    #  Usage:    store = twod_store_open(path, mode)                           #
+    #                                                                          #
+    #  Variables:     mode                                                     #
+    #                        memmap mode of the mesh arrays, 'r' or 'r+'.      #
+    #                        Stores opened with 'r' refuse to append, save     #
+    #                        or build a plan                                   #
+    #--------------------------------------------------------------------------#
+    '''
+    return TwodStore(path, mode)
+
+
+class TwodStore:
+    '''
+    #--------------------------------------------------------------------------#
+    #  TwodStore - zero-copy access to a stored mesh and its solution series   #
+    #                                                                          #
+    #  Usage:    store.x, store.e_conn, store.index_b   memmapped arrays       #
+    #            store['name']                          any stored array       #
+    #            r, s, w = store.rule()                 stored quadrature      #
+    #            for start, conn in store.chunks(n):    element chunks         #
+    #            store.append('u', u)                   append rows to series  #
+    #            U = store.series('u')                  (n_rows, n_cols) map   #
+    #            plan = store.plan()                    stored AssemblyPlan    #
+    #            A = store.assemble(form, kernel)       chunked assembly       #
+    #                                                                          #
+    #  Several handles may share a path: every header update re-reads          #
+    #  header.json under a file lock and merges into it, and series() and      #
+    #  lookups of unknown arrays re-read it.                                   #
+    #--------------------------------------------------------------------------#
+    '''
+    def __init__(self, path, mode='r'):
+        self.path   = path
+        self.mode   = mode
+        self.header = _read_header(path)
+        self._arrays = {}
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            if name not in self.header['arrays']:
+                self.header = _read_header(self.path)
+            if name not in self.header['arrays']:
+                raise Exception('TwodStore: no array {} in {}'.format(name, self.path))
+            self._arrays[name] = np.load(os.path.join(self.path, name + '.npy'),
+                                         mmap_mode=self.mode)
+        return self._arrays[name]
+
+    @property
+    def x(self):
+        return self['x']
+
+    @property
+    def e_conn(self):
+        return self['e_conn']
+
+    @property
+    def index_b(self):
+        return self['index_b']
+
+    def rule(self):
+        if self.header['rule'] is None:
+            raise Exception('TwodStore: no quadrature rule stored in {}'.format(self.path))
+        return tuple(np.array(a) for a in self.header['rule'])
+
+    def chunks(self, chunk_size=65536):
+        '''
+        Yields (start, e_conn[start:start+chunk_size]) over all elements.
+        '''
+        e_conn = self.e_conn
+        for start in range(0, e_conn.shape[0], chunk_size):
+            yield start, np.asarray(e_conn[start:start+chunk_size])
+
+    def append(self, name, values, dtype=np.float64):
+        '''
+        Appends one row (dim: n_cols) or a block of rows (dim: n_rows, n_cols)
+        to the series name, creating it on first use.
+        '''
+        values = np.asarray(values)
+        rows = values.reshape(-1, values.shape[-1])
+        with self._update() as header:
+            series = header['series'].get(name)
+            if series is None:
+                series = {'dtype': np.dtype(dtype).str, 'n_cols': rows.shape[1], 'count': 0}
+                header['series'][name] = series
+            if rows.shape[1] != series['n_cols']:
+                raise Exception('TwodStore: series {} has {} columns, got {}'
+                                .format(name, series['n_cols'], rows.shape[1]))
+
+            # Write at the end of the counted rows (drops a torn earlier write)
+            itemsize = np.dtype(series['dtype']).itemsize
+            with open(os.path.join(self.path, name + '.bin'), 'ab') as f:
+                f.truncate(series['count']*series['n_cols']*itemsize)
+                f.write(np.ascontiguousarray(rows, dtype=series['dtype']).tobytes())
+            series['count'] += rows.shape[0]
+
+    def series(self, name, mode='r'):
+        '''
+        Memory map of all rows appended to the series name.
+        '''
+        self.header = _read_header(self.path)
+        series = self.header['series'].get(name)
+        if series is None:
+            raise Exception('TwodStore: no series {} in {}'.format(name, self.path))
+        shape = (series['count'], series['n_cols'])
+        if series['count'] == 0:
+            return np.empty(shape, dtype=series['dtype'])
+        return np.memmap(os.path.join(self.path, name + '.bin'), dtype=series['dtype'],
+                         mode=mode, shape=shape)
+
+    def save(self, name, a):
+        '''
+        Adds (or replaces) the array name in the store.
+        '''
+        a = np.ascontiguousarray(a)
+        with self._update() as header:
+            np.save(os.path.join(self.path, name + '.npy'), a)
+            self._arrays.pop(name, None)
+            header['arrays'][name] = {'dtype': a.dtype.str, 'shape': list(a.shape)}
+
+    def plan(self, chunk_size=65536):
+        '''
+        AssemblyPlan of the stored mesh, built chunk by chunk on first use and
+        kept in the store as plan_indptr, plan_indices and plan_scatter.  The
+        scatter map (n_elem*n_dof^2 entries) stays memmapped, only the CSR
+        structure is loaded.
+        '''
+        if 'plan_scatter' not in self.header['arrays']:
+            self.header = _read_header(self.path)
+        if 'plan_scatter' not in self.header['arrays']:
+            self._build_plan(chunk_size)
+        return AssemblyPlan.from_arrays(np.array(self['plan_indptr']),
+                                        np.array(self['plan_indices']),
+                                        self['plan_scatter'])
+
+    def _build_plan(self, chunk_size):
+        # Sorted unique (row, col) keys from the per-chunk unique keys, then
+        # the position of every element entry among them, chunk by chunk
+        self._writable('build a plan')
+        n_nodes = self.x.shape[0]
+        n_elem, n_dof = self.e_conn.shape
+        key = np.unique(np.concatenate([np.unique(_keys(conn, n_nodes))
+                                        for start, conn in self.chunks(chunk_size)]))
+
+        index_dtype = np.int32 if max(len(key), n_nodes) < 2**31 else np.int64
+        indptr = np.zeros(n_nodes+1, dtype=index_dtype)
+        np.cumsum(np.bincount(key // n_nodes, minlength=n_nodes), out=indptr[1:])
+        self.save('plan_indptr', indptr)
+        self.save('plan_indices', (key % n_nodes).astype(index_dtype))
+
+        fname = os.path.join(self.path, 'plan_scatter.npy')
+        scatter = np.lib.format.open_memmap(fname, mode='w+', dtype=index_dtype,
+                                            shape=(n_elem, n_dof, n_dof))
+        for start, conn in self.chunks(chunk_size):
+            scatter[start:start+conn.shape[0]] = \
+                np.searchsorted(key, _keys(conn, n_nodes)).reshape(-1, n_dof, n_dof)
+        scatter.flush()
+        del scatter
+        with self._update() as header:
+            header['arrays']['plan_scatter'] = {'dtype': np.dtype(index_dtype).str,
+                                                'shape': [n_elem, n_dof, n_dof]}
+
+    def _writable(self, action):
+        if self.mode == 'r':
+            raise Exception('TwodStore: cannot {} in {}, opened read-only (mode \'r\')'
+                            .format(action, self.path))
+
+    @contextmanager
+    def _update(self):
+        # Fresh header under the store lock, written back after the block
+        self._writable('write')
+        with _locked(self.path):
+            header = _read_header(self.path)
+            yield header
+            _write_header(self.path, header)
+            self.header = header
+
+    def assemble(self, form='stiffness', kernel=None, rule=None, chunk_size=65536,
+                 plan=None):
+        '''
+        Assembles a form (see twod_assemble) streaming element chunks from
+        disk, so only one chunk of element matrices is in memory at a time.
+        The plan defaults to the stored one (see plan).
+        '''
+        r, s, w = self.rule() if rule is None else rule
+        x = self.x
+        if plan is None:
+            plan = self.plan(chunk_size)
+        data = np.zeros(plan.nnz)
+        for start, conn in self.chunks(chunk_size):
+            x_g, w_g, phi, p_x, p_y, jac = twod_shape_batch(x, conn, r, s, w)
+            A_e = twod_element_matrices(form, _eval_kernel(kernel, x_g), w_g, phi, p_x, p_y)
+            plan.add(data, A_e, start)
+        return plan.matrix(data)
+
+
+def _keys(conn, n_nodes):
+    # row*n_nodes + col of every element matrix entry
+    conn = conn.astype(np.int64, copy=False)
+    return (conn[:,:,None]*n_nodes + conn[:,None,:]).ravel()
+
+
+@contextmanager
+def _locked(path):
+    # Exclusive lock on path/header.lock (advisory, POSIX only)
+    with open(os.path.join(path, HEADER + '.lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_header(path):
+    with open(os.path.join(path, HEADER)) as f:
+        return json.load(f)
+
+
+def _write_header(path, header):
+    tmp = os.path.join(path, HEADER + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(header, f, indent=1)
+    os.replace(tmp, os.path.join(path, HEADER))
+
+
+
+# Test twod_store
+if __name__ == '__main__':
+    import tempfile
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble
+
+    x, e_conn, index_b, e_bnd, e_tag = twod_mesh(0, 1, 0, 1, 'quadratic', 21, 11, edges=True)
+    r, s, w = twod_gauss(7)
+    path = tempfile.mkdtemp()
+    store = twod_store_save(path, x, e_conn, index_b, 'quadratic', (r, s, w),
+                            e_bnd=e_bnd, e_tag=e_tag)
+
+    # Read-only handles refuse every write
+    store = twod_store_open(path)
+    assert isinstance(store.e_conn, np.memmap) and np.array_equal(store['e_bnd'], e_bnd)
+    for write in [lambda: store.assemble('stiffness'), lambda: store.append('u', x[:,0]),
+                  lambda: store.save('v', x[:,0])]:
+        try:
+            write()
+            raise AssertionError('read-only store was written')
+        except Exception as err:
+            assert 'read-only' in str(err)
+
+    store = twod_store_open(path, 'r+')
+    A = store.assemble('stiffness', chunk_size=50)
+    assert np.allclose((A - twod_assemble(x, e_conn, r, s, w)).toarray(), 0.)
+
+    # The chunked plan matches the in-memory one and is reused from disk,
+    # also by read-only handles
+    plan = AssemblyPlan(e_conn, x.shape[0])
+    stored = twod_store_open(path).plan()
+    assert isinstance(stored.scatter, np.memmap)
+    assert np.array_equal(stored.indptr, plan.indptr) and np.array_equal(stored.indices, plan.indices)
+    assert np.array_equal(stored.scatter, plan.scatter)
+
+    # Two handles on one path append and save without losing each other's
+    # entries
+    other = twod_store_open(path, 'r+')
+    for k in range(3):
+        (store if k % 2 else other).append('u', k*np.ones(x.shape[0]))
+    store.append('u', np.zeros((2, x.shape[0])))
+    other.save('v', x[:,0])
+    store.append('p', np.ones(4))
+    reader = twod_store_open(path)
+    U = reader.series('u')
+    assert U.shape == (5, x.shape[0]) and U[2,0] == 2. and U[1,0] == 1.
+    assert other.series('p').shape == (1, 4) and np.array_equal(reader['v'], x[:,0])
+    assert np.array_equal(store['v'], x[:,0])
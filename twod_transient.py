@@ -0,0 +1,182 @@
+
+import numpy as np
+import scipy.sparse as sp
+from twod_solve import twod_dirichlet, twod_lift, TwodSolver
+
+class TwodTransient:
+    '''
+    #--------------------------------------------------------------------------#
+    #  twod_transient.py - time stepping of  M u' + K u = F(t),                #
+    #                      u = g(t) on index_b                                 #
+    #                                                                          #
+    #  TwodTransient - theta method and BDF2 with M and K assembled once.      #
+    #                  The system matrix and its factorization are cached per  #
+    #                  (scheme, dt), so a step costs a few sparse products     #
+    #                  and one pair of triangular solves                       #
+    #                                                                          #
+    #     theta:  (M + theta dt K) u^{n+1} = (M - (1-theta) dt K) u^n          #
+    #                          + dt (theta F^{n+1} + (1-theta) F^n)            #
+    #     bdf2:   (3/2 M + dt K) u^{n+1} = M (2 u^n - 1/2 u^{n-1}) + dt F^{n+1}#
+    #                                                                          #
+    #  Usage:    ts = TwodTransient(M, K, index_b, g, F, method, **kwargs)     #
+    #            u  = ts.step(u, t, dt, theta)              one theta step     #
+    #            u  = ts.step_bdf2(u, u_old, t, dt)         one BDF2 step      #
+    #            u, U = ts.run(u0, dt, n_steps, scheme, theta, store, name,    #
+    #                          every, chunk)                                   #
+    #                                                                          #
+    #  Variables:     M, K                                                     #
+    #                        assembled mass and stiffness matrices             #
+    #                 index_b, g                                               #
+    #                        (optional) Dirichlet nodes and values, constant,  #
+    #                        an array or g(t)                                  #
+    #                 F                                                        #
+    #                        None, a load vector or F(t)                       #
+    #                 method, kwargs                                           #
+    #                        passed to TwodSolver (default: direct,            #
+    #                        symmetric)                                        #
+    #--------------------------------------------------------------------------#
+    '''
+    def __init__(self, M, K, index_b=None, g=0., F=None, method='direct', **kwargs):
+        self.M = sp.csr_matrix(M)
+        self.K = sp.csr_matrix(K)
+        self.index_b = index_b
+        self.g = g
+        self.F = F
+        self.method = method
+        self.kwargs = dict(kwargs)
+        if method == 'direct':
+            self.kwargs.setdefault('symmetric', True)
+        self._systems = {}
+
+    def system(self, scheme, dt, theta=1.):
+        '''
+        Cached (A, A_D, B, solver) of one scheme and step size, where A is the
+        left hand side, A_D with Dirichlet rows and B multiplies u^n.
+        '''
+        key = (scheme, float(dt), float(theta) if scheme == 'theta' else None)
+        if key not in self._systems:
+            if scheme == 'theta':
+                A = self.M + (theta*dt)*self.K
+                B = self.M - ((1. - theta)*dt)*self.K
+            elif scheme == 'bdf2':
+                A = 1.5*self.M + dt*self.K
+                B = self.M
+            else:
+                raise Exception('TwodTransient: {} is not a valid scheme'.format(scheme))
+            A = A.tocsr()
+            if self.index_b is None:
+                A_D = A
+            else:
+                A_D, _ = twod_dirichlet(A, np.zeros(A.shape[0]), self.index_b)
+            self._systems[key] = (A, A_D, B.tocsr(), TwodSolver(A_D, self.method, **self.kwargs))
+        return self._systems[key]
+
+    def step(self, u, t, dt, theta=0.5):
+        A, A_D, B, solver = self.system('theta', dt, theta)
+        b = B @ u
+        if self.F is not None:
+            if theta != 0.:
+                b += (theta*dt)*self._load(t + dt)
+            if theta != 1.:
+                b += ((1. - theta)*dt)*self._load(t)
+        return solver.solve(self._lift(A, b, t + dt))
+
+    def step_bdf2(self, u, u_old, t, dt):
+        A, A_D, B, solver = self.system('bdf2', dt)
+        b = B @ (2.*u - 0.5*u_old)
+        if self.F is not None:
+            b += dt*self._load(t + dt)
+        return solver.solve(self._lift(A, b, t + dt))
+
+    def run(self, u0, dt, n_steps, scheme='theta', theta=0.5, t0=0., store=None,
+            name='u', every=1, chunk=64):
+        '''
+        Takes n_steps steps from u0 at t0.  Every every-th solution (u0
+        included) is kept: appended to the series name of a TwodStore in
+        blocks of chunk rows if store is given, else returned in memory.
+        BDF2 starts with one backward Euler step.
+
+        Returns the final solution and the snapshots (a memmap of the
+        series if store is given).
+        '''
+        u = np.array(u0, dtype=float)
+        buffer, kept = [u.copy()], []
+
+        def keep(u, final=False):
+            if u is not None:
+                buffer.append(u.copy())
+            if buffer and (final or len(buffer) >= chunk):
+                if store is None:
+                    kept.extend(buffer)
+                else:
+                    store.append(name, np.array(buffer))
+                buffer.clear()
+
+        u_old = None
+        t = t0
+        for n in range(n_steps):
+            if scheme == 'bdf2' and u_old is not None:
+                u, u_old = self.step_bdf2(u, u_old, t, dt), u
+            elif scheme == 'bdf2':
+                u, u_old = self.step(u, t, dt, theta=1.), u
+            else:
+                u = self.step(u, t, dt, theta)
+            t += dt
+            if (n + 1) % every == 0:
+                keep(u)
+        keep(None, final=True)
+
+        if store is None:
+            return u, np.array(kept)
+        return u, store.series(name)
+
+    def _load(self, t):
+        return self.F(t) if callable(self.F) else self.F
+
+    def _lift(self, A, b, t):
+        # Dirichlet values at time t lifted into b
+        if self.index_b is None:
+            return b
+        return twod_lift(A, b, self.index_b, self.g(t) if callable(self.g) else self.g)
+
+
+
+# Test twod_transient
+if __name__ == '__main__':
+    import tempfile
+    from twod_mesh import twod_mesh
+    from twod_gauss import twod_gauss
+    from twod_assemble import twod_assemble, twod_assemble_load
+    from twod_store import twod_store_save
+
+    x, e_conn, index_b = twod_mesh(0, 1, 0, 1, 'quadratic', 25, 25)
+    r, s, w = twod_gauss(7)
+    M = twod_assemble(x, e_conn, r, s, w, 'mass')
+    K = twod_assemble(x, e_conn, r, s, w, 'stiffness')
+
+    # u0 = sin(pi x) sin(pi y): first order backward Euler, second order
+    # Crank-Nicolson and BDF2 against a fine step reference
+    u0 = np.sin(np.pi*x[:,0])*np.sin(np.pi*x[:,1])
+    T  = 0.1
+    ts = TwodTransient(M, K, index_b)
+    u_ref, _ = ts.run(u0, T/2000, 2000, 'theta', .5, every=2000)
+    for scheme, theta, order in [('theta', 1., 1), ('theta', .5, 2), ('bdf2', 1., 2)]:
+        err = []
+        for n_steps in [20, 40, 80]:
+            u, U = ts.run(u0, T/n_steps, n_steps, scheme, theta, every=n_steps)
+            err.append(np.abs(u - u_ref).max())
+            assert U.shape == (2, x.shape[0])
+        rate = np.log2(np.array(err[:-1])/np.array(err[1:]))
+        assert np.all(np.abs(rate - order) < 0.2)
+    # Reference, backward Euler (reused to start BDF2), Crank-Nicolson, BDF2
+    assert len(ts._systems) == 1 + 3 + 3 + 3
+
+    # u = t (x + y): linear in time, time dependent boundary values,
+    # snapshots streamed to disk in chunks
+    F_1 = twod_assemble_load(x, e_conn, r, s, w, lambda x,y: x + y)
+    ts = TwodTransient(M, K, index_b, g=lambda t: t*(x[index_b,0] + x[index_b,1]),
+                       F=lambda t: F_1)
+    store = twod_store_save(tempfile.mkdtemp(), x, e_conn, index_b)
+    u, U = ts.run(np.zeros(x.shape[0]), 0.01, 100, 'bdf2', store=store, every=5, chunk=7)
+    assert U.shape == (21, x.shape[0])
+    assert np.allclose(U[-1], 1.0*(x[:,0] + x[:,1])) and np.allclose(U[4], 0.2*(x[:,0] + x[:,1]))